@@ -1,47 +1,185 @@
 from pathlib import Path
 import argparse
-import subprocess
 import sys
 import logging
-import logging.config
-from typing import Any, Tuple, NoReturn
+import time
+from typing import Any, Callable, Tuple, NoReturn, TYPE_CHECKING
 
-from borgctl.utils import write_state_file, get_conf_directory, \
-    load_config, BORG_COMMANDS, fail, get_new_archive_name, \
+from borgctl.utils import write_state_file, get_conf_directory, get_log_directory, \
+    load_config, BORG_COMMANDS, BORGCTL_COMMANDS, fail, format_command, get_new_archive_name, \
     print_docs_url, ask_for_passphrase, ask_for_new_passphrase, \
-    init_logging, prepare_config_files
-
-from borgctl.helper import get_version, show_config_files, \
-    generate_ssh_key, generate_authorized_keys, generate_default_config, \
-    generate_new_passphrase
-
-
-def execute_borg(cmd: list[str], env: dict[str, str]) -> int:
-    debug_out = " ".join([f"{key}=\"{value}\"" for key, value in env.items() if key not in ("BORG_PASSPHRASE", "BORG_NEW_PASSPHRASE")])
-    debug_out += " " + " ".join(cmd)
-    logging.info(f"Executing: {debug_out}")
+    init_logging, prepare_config_files, ask_for_passphrase_upfront, GOVERNOR_CONFIG_KEYS, parse_duration, current_config, \
+    BorgCtlError
+
+# borgctl is called often (monitoring, shell prompts). Modules that are not needed
+# for every invocation are imported where they are used to keep the startup fast
+if TYPE_CHECKING:
+    from typing import BinaryIO, IO
+    from borgctl.events import EventHandler
+    import subprocess
+    from borgctl.history import JsonStatsReader, StatsCollector
+
+
+DESCRIPTION = ("borgctl is a simple borgbackup wrapper. Running version {version}.\n\n"
+               "The working directory is /etc/borgctl/ "
+               "for root or $XDG_CONFIG_HOME/borgctl or ~/.config/borgctl for non-root users.\n"
+               "The log directory is /var/log/borgctl/ for root or $XDG_STATE_HOME/borgctl or "
+               "~/.local/state/borgctl for non-root users.")
+
+
+class HelpFormatter(argparse.RawTextHelpFormatter):
+
+    def __init__(self, prog: str, indent_increment: int = 2, max_help_position: int = 24, width: int | None = None) -> None:
+        # argparse creates a formatter for every add_argument. Without a width, it looks up the terminal size
+        # with shutil, which imports bz2 and lzma. Only the help needs the real width
+        super().__init__(prog, indent_increment, max_help_position, width or 80)
+
+
+class ArgumentParser(argparse.ArgumentParser):
+
+    def format_help(self) -> str:
+        # looking up the version (importlib.metadata) is slow, so only do it if the help is shown
+        from borgctl.helper import get_version
+        self.description = DESCRIPTION.format(version=get_version())
+        self.formatter_class = argparse.RawTextHelpFormatter
+        return super().format_help()
+
+
+def execute_borg(cmd: list[str], env: dict[str, str], output_prefix: str = "", handlers: "list[EventHandler] | None" = None,
+                 config: dict[str, Any] | None = None, transcript: "BinaryIO | None" = None, stdin: "IO[bytes] | None" = None,
+                 stats: "StatsCollector | None" = None) -> int:
+    if config and any(key in config for key in GOVERNOR_CONFIG_KEYS):
+        from borgctl.governor import apply_resource_limits
+        cmd = apply_resource_limits(cmd, config)
+    debug_out = format_command(cmd, env)
+    logging.info(f"{output_prefix}Executing: {debug_out}")
+    if transcript:
+        transcript.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} Executing: {debug_out}\n".encode())
+
+    if handlers:
+        # --log-json: borg output is turned into events, handlers print/collect them
+        from borgctl.events import stream_borg
+        return_code = stream_borg(cmd, env, handlers, json_output="--json" in cmd, transcript=transcript, stdin=stdin)
+    else:
+        return_code = execute_borg_plain(cmd, env, output_prefix, transcript, stdin, stats)
+    if return_code == 1:
+        logging.warning(f"{output_prefix}Borg exited with warnings (exit code {return_code})")
+    elif return_code > 1:
+        logging.error(f"{output_prefix}Borg failed with exit code {return_code}")
+    return return_code
 
-    with subprocess.Popen(cmd, env=env, bufsize=1,
-                          stdout=sys.stdout, stderr=sys.stdout) as p:
-        p.wait()
-        if p.returncode == 1:
-            logging.warning(f"Borg exited with warnings (exit code {p.returncode})")
-        elif p.returncode > 1:
-            logging.error(f"Borg failed with exit code {p.returncode}")
-        return p.returncode
 
+def execute_borg_plain(cmd: list[str], env: dict[str, str], output_prefix: str, transcript: "BinaryIO | None",
+                       stdin: "IO[bytes] | None", stats: "StatsCollector | None") -> int:
+    """Runs borg without --log-json. If stats is set, borg create runs with --json: the json on stdout is
+    read in a thread and borg's log (stderr) is shown as usual"""
+    import subprocess
+    stats_reader = None
+    # without stats, stderr goes where stdout goes
+    stderr: Any = subprocess.PIPE if stats else subprocess.STDOUT
+    if output_prefix or transcript:
+        # --parallel: several borg processes share our stdout, so every line gets the config name
+        from borgctl.transcript import tee_output
+        with subprocess.Popen(cmd, env=env, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr) as p_tee:
+            assert p_tee.stdout is not None
+            output_fd = p_tee.stdout.fileno()
+            if stats:
+                stats_reader = start_stats_reader(p_tee)
+                assert p_tee.stderr is not None
+                output_fd = p_tee.stderr.fileno()
+            tee_output(output_fd, sys.stdout, transcript, output_prefix)
+            return_code = p_tee.wait()
+    else:
+        with subprocess.Popen(cmd, env=env, stdin=stdin, stdout=subprocess.PIPE if stats else sys.stdout,
+                              stderr=sys.stdout) as p_direct:
+            if stats:
+                stats_reader = start_stats_reader(p_direct)
+            return_code = p_direct.wait()
+
+    if stats and stats_reader:
+        from borgctl.events import ArchiveStatsEvent, ConsoleRenderer
+        event = stats_reader.get_stats()
+        if transcript:
+            transcript.write(stats_reader.output.encode())
+        if isinstance(event, ArchiveStatsEvent):
+            stats(event)
+            # instead of the --stats table of borg
+            ConsoleRenderer(0, output_prefix, print_json=False)(event)
+        elif stats_reader.output:
+            sys.stdout.write(stats_reader.output)
+            sys.stdout.flush()
+    return return_code
 
-def run_borg_command(command: str, env: dict[str, str], config: dict[str, Any], config_file: Path, args: list[str]) -> int:
 
-    env = ask_for_passphrase(config, env, command, config_file, args)
+def start_stats_reader(p: "subprocess.Popen[Any]") -> "JsonStatsReader":
+    from borgctl.history import JsonStatsReader
+    assert p.stdout is not None
+    stats_reader = JsonStatsReader(p.stdout)
+    stats_reader.start()
+    return stats_reader
+
+
+def run_borg_command(command: str, env: dict[str, str], config: dict[str, Any], config_file: Path, args: list[str], output_prefix: str = "",
+                     event_handlers: "list[EventHandler] | None" = None, extract_workers: int = 1) -> int:
+    current_config.set(config_file.stem)
+    if command == "replicate":
+        from borgctl.replicate import replicate
+        return replicate(config, env, config_file, output_prefix)
+
+    change_detector = None
+    # the output of stdin sources (database dumps) always counts as changed. A create or prune with
+    # additional arguments (like a manual create of some directories) only handles the backup directories
+    stdin_sources = command in ("create", "prune") and len(args) == 0 and config.get("borg_create_stdin_sources", [])
+    if command == "create" and len(args) == 0 and config.get("borg_create_skip_unchanged", False) and not stdin_sources:
+        # only if the archive would look like the last one (no additional cli arguments)
+        from borgctl.scan import ChangeDetector
+        change_detector = ChangeDetector(config, config_file)
+        if change_detector.unchanged():
+            logging.info(f"{output_prefix}Nothing changed since the last create. Skipping borg create")
+            # for monitoring, a skipped create is a successful one
+            write_state_file(config, config_file, command)
+            if config.get("prometheus_textfile_dir", ""):
+                from borgctl.metrics import update_metrics
+                update_metrics(config, config_file, command, time.time(), 0, 0, None)
+            return 0
+
+    check_scheduler = None
+    has_check_schedule = config.get("check_max_duration") or config.get("check_full_interval")
+    if command == "check" and len(args) == 0 and has_check_schedule:
+        from borgctl.check import CheckScheduler
+        check_scheduler = CheckScheduler(config, config_file)
+        args = check_scheduler.get_arguments()
+        # it needs the log of borg (--log-json) to know if a partial check reached the end of the repository
+        event_handlers = [*(event_handlers or []), check_scheduler]
+
+    if command == "list" and "--cached" in args:
+        # the passphrase is only needed if the cache has to be updated
+        from borgctl.archives import show_cached_list
+        return show_cached_list(config, lambda: prepare_env(command, env, config, config_file, args), args)
+    env = prepare_env(command, env, config, config_file, args)
+    tar_stream = None
+    delta_mode = None
+    if command == "extract":
+        from borgctl.extract import parse_delta_argument
+        delta_mode, args = parse_delta_argument(args)
+    if command in ("export-tar", "import-tar"):
+        from borgctl.tar import TarStream
+        tar_stream, args = TarStream.from_arguments(command, args, config)
     cmd = [config["borg_binary"], "--verbose", command]
 
     if command in ("check", "create", "compact"):
         cmd.append("--progress")
     if command in ("create"):
         cmd.append("--stats")
+        if config.get("retry_checkpoint_interval"):
+            # more checkpoints: a retried create has to upload less again
+            cmd.append(f"--checkpoint-interval={int(parse_duration(config['retry_checkpoint_interval']))}")
     if command in ("prune", ):
         cmd.append("--list")
+        if stdin_sources:
+            # the archives of the sources are pruned on their own and must not count for --keep-last
+            from borgctl.stdin import get_glob_archives
+            cmd.append(get_glob_archives(config["prefix"]))
 
     if command == "import-tar":
         cmd.append(get_new_archive_name(config))
@@ -50,7 +188,7 @@ def run_borg_command(command: str, env: dict[str, str], config: dict[str, Any],
     elif command == "key" and "change-passphrase" in args:
         env = ask_for_new_passphrase(config, env, config_file)
     elif command == "create":
-        args = prepare_borg_create(config, args)
+        args = prepare_borg_create(config, args, config_file)
     elif command == "umount":
         if len(args) == 0:
             mount_point = Path(config["mount_point"]).expanduser().as_posix()
@@ -82,23 +220,145 @@ def run_borg_command(command: str, env: dict[str, str], config: dict[str, Any],
         mount_point = Path(config["mount_point"]).expanduser().as_posix()
         cmd.append(mount_point)
 
-    return_code = execute_borg(cmd, env)
     dry_run_or_help = "--dry-run" in cmd or "-s" in cmd or "--help" in cmd
-    if return_code == 0 and not dry_run_or_help:
-        write_state_file(config, config_file, command)
+    retry_policy = None
+    retry_commands = config.get("retry_commands", ["create", ])
+    # with --stream, borg's stdout is the tar: it can't be retried or written to the transcript
+    if config.get("retry_attempts", 0) and command in retry_commands and not dry_run_or_help and not tar_stream:
+        from borgctl.retry import RetryPolicy, ErrorCollector
+        retry_policy = RetryPolicy.from_config(config)
+        error_collector = ErrorCollector()
+        if retry_policy.msgids:
+            # the msgids of borg's errors are only in its --log-json output
+            event_handlers = [*(event_handlers or []), error_collector]
+
+    from borgctl.history import StatsCollector, record_run
+    from borgctl.logs import settings as log_settings
+    handlers: list[EventHandler] = []
+    stats_collector = StatsCollector()
+    # the events of borg are only available with --log-json. With per_config, borg's messages are logged by
+    # borgctl, so the log file of the config has only one writer
+    wants_events = config.get("log_json", False) or event_handlers or log_settings["per_config"]
+    if wants_events and command not in ("export-tar", "mount") and not tar_stream:
+        # borg ignores --log-json for log messages if BORG_LOGGING_CONF is set. We log them ourselves
+        from borgctl.events import ConsoleRenderer
+        cmd.insert(2, "--log-json")
+        env = {key: value for key, value in env.items() if key != "BORG_LOGGING_CONF"}
+        interactive = sys.stderr.isatty() and output_prefix == ""
+        progress_interval = 0 if interactive else config.get("progress_interval", 60)
+        print_json = "--json" in cmd
+        if command == "create" and not print_json:
+            # we want the exact numbers of --stats for the history
+            cmd.append("--json")
+        handlers = [ConsoleRenderer(progress_interval, output_prefix, print_json), stats_collector]
+        handlers.extend(event_handlers or [])
+
+    stats = None
+    wants_stats = config.get("history", True) or config.get("prometheus_textfile_dir", "")
+    if command == "create" and not handlers and wants_stats and "--json" not in cmd and not dry_run_or_help:
+        # the exact numbers for the history and the metrics, without --log-json
+        cmd.append("--json")
+        stats = stats_collector
+
+    transcript = None
+    if config.get("transcripts", False) and not dry_run_or_help and not tar_stream:
+        from borgctl.transcript import open_transcript
+        transcript = open_transcript(config_file, command)
+
+    start = time.time()
+    # borg failed if something raised
+    return_code = 2
+    try:
+        if tar_stream:
+            return_code = tar_stream.run(cmd, env, config, output_prefix)
+        elif delta_mode and not dry_run_or_help:
+            from borgctl.extract import run_delta_extract
+            if extract_workers > 1:
+                logging.warning(f"{output_prefix}--delta runs a single borg extract, --parallel {extract_workers} is ignored")
+            return_code = run_delta_extract(cmd, env, config, config_file, delta_mode, output_prefix, handlers)
+        elif command == "extract" and extract_workers > 1 and not dry_run_or_help:
+            from borgctl.extract import run_sharded_extract
+            return_code = run_sharded_extract(cmd, env, config, config_file, extract_workers, output_prefix, handlers)
+        else:
+            return_code = execute_borg(cmd, env, output_prefix, handlers, config, transcript, stats=stats)
+        attempt = 0
+        while retry_policy:
+            delay = retry_policy.get_delay(return_code, attempt, time.time() - start, error_collector.msgids)
+            if delay is None:
+                break
+            attempt += 1
+            # the archive name stays the same. The chunks of the last checkpoint are already in the repository
+            logging.warning(f"{output_prefix}Retrying borg {command} in {delay:.0f}s (attempt {attempt + 1} of {retry_policy.attempts + 1})")
+            time.sleep(delay)
+            error_collector.msgids.clear()
+            return_code = execute_borg(cmd, env, output_prefix, handlers, config, transcript, stats=stats)
+        if stdin_sources and not dry_run_or_help and return_code > 1:
+            logging.warning(f"{output_prefix}Skipping the stdin sources because 'borg {command}' failed")
+        elif stdin_sources and not dry_run_or_help and command == "create":
+            # not retried: the commands would have to run again
+            from borgctl.stdin import run_stdin_sources
+            ret = run_stdin_sources(config, env, output_prefix, handlers, transcript)
+            return_code = ret if ret > return_code else return_code
+        elif stdin_sources and not dry_run_or_help:
+            from borgctl.stdin import prune_stdin_sources
+            ret = prune_stdin_sources(config, env, output_prefix, handlers, transcript)
+            return_code = ret if ret > return_code else return_code
+    finally:
+        if transcript:
+            from borgctl.transcript import cleanup_transcripts
+            transcript.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} borg exited with exit code {return_code}\n".encode())
+            transcript.close()
+            cleanup_transcripts(config, config_file)
+    duration = time.time() - start
+    if check_scheduler:
+        check_scheduler.finished(return_code)
+    # with check_max_duration, the state file says when the last complete check cycle finished
+    cycle_completed = check_scheduler is None or check_scheduler.cycle_completed
+    # the state file first: the monitoring relies on it
+    if not dry_run_or_help and (return_code != 0 or cycle_completed):
+        write_state_file(config, config_file, command, return_code)
+    if not dry_run_or_help and config.get("history", True):
+        record_run(config_file, command, start, duration, return_code, stats_collector.stats)
+    if not dry_run_or_help and config.get("prometheus_textfile_dir", ""):
+        from borgctl.metrics import update_metrics
+        update_metrics(config, config_file, command, start, duration, return_code, stats_collector.stats)
+    if change_detector and return_code <= 1:
+        change_detector.save()
+    if command in ("create", "prune", "delete", "rename", "import-tar") and not dry_run_or_help:
+        # these commands change the list of archives
+        from borgctl.archives import refresh_archive_cache, invalidate_archive_cache
+        if config.get("archive_cache", False) and return_code <= 1:
+            refresh_archive_cache(config, env)
+        else:
+            invalidate_archive_cache(config)
     return return_code
 
 
-def prepare_borg_create(config: dict[str, Any], cli_arguments: list[str]) -> list[str]:
+def prepare_env(command: str, env: dict[str, str], config: dict[str, Any], config_file: Path, args: list[str]) -> dict[str, str]:
+    """Returns the env for borg: passphrase (asked if needed) and ssh multiplexing"""
+    env = ask_for_passphrase(config, env, command, config_file, args)
+    if config.get("ssh_multiplexing", False):
+        from borgctl.ssh import setup_multiplexing
+        env = setup_multiplexing(config, env)
+    return env
+
+
+def prepare_borg_create(config: dict[str, Any], cli_arguments: list[str], config_file: Path) -> list[str]:
+    from borgctl.patterns import get_create_excludes, get_create_backup_dirs
     arguments = []
 
-    for exclude in config["borg_create_excludes"]:
-        p = Path(exclude).expanduser()
-        arguments.append(f"--exclude={p.as_posix()}")
+    if config.get("borg_create_patterns_file", False):
+        # one optimized patterns file instead of many --exclude (fnmatch) patterns
+        from borgctl.patterns import write_patterns_file
+        patterns_file = get_log_directory() / f"borg_patterns_{config_file.stem}.lst"
+        write_patterns_file(config, patterns_file)
+        arguments.append(f"--patterns-from={patterns_file}")
+    else:
+        for exclude in get_create_excludes(config):
+            arguments.append(f"--exclude={exclude}")
     arguments.append(get_new_archive_name(config))
 
-    for backup_dir in config["borg_create_backup_dirs"]:
-        p = Path(backup_dir).expanduser()
+    for p in get_create_backup_dirs(config):
         arguments.append(p.as_posix())
         if not p.exists():
             logging.warning(f"Backup directory {p} does not exist")
@@ -107,24 +367,71 @@ def prepare_borg_create(config: dict[str, Any], cli_arguments: list[str]) -> lis
     return arguments
 
 
-def run_cron_commands(config: dict[str, Any], env: dict[str, str], config_file: Path) -> int:
+def run_cron_commands(config: dict[str, Any], env: dict[str, str], config_file: Path, output_prefix: str = "",
+                      run: Callable[[str], int] | None = None, skip: Callable[[str], None] | None = None) -> int:
+    """Runs the cron_commands and the replication. prune and compact are skipped if create failed.
+
+    run(command) runs one command and returns the exit code, skip(command) is called for skipped commands.
+    The api uses them to collect the results"""
+    current_config.set(config_file.stem)
+    if run is None:
+        def run(command: str) -> int:
+            return run_borg_command(command, env, config, config_file, [], output_prefix)
     return_code = 0
+    create_failed = False
     for command in config["cron_commands"]:
-        logging.info(f"Running 'borg {command}' in --cron mode")
-        ret = run_borg_command(command, env, config, config_file, [])
+        if create_failed and command in ("prune", "compact"):
+            logging.warning(f"{output_prefix}Skipping 'borg {command}' because 'borg create' failed")
+            if skip:
+                skip(command)
+            continue
+        logging.info(f"{output_prefix}Running 'borg {command}' in --cron mode")
+        ret = run(command)
+        return_code = ret if ret > return_code else return_code
+        if command == "create" and ret > 1:
+            create_failed = True
+    if config.get("replicate_to") and not create_failed:
+        # borg reads the backup directories once, the copies only get the new segments
+        logging.info(f"{output_prefix}Replicating the repository in --cron mode")
+        ret = run("replicate")
         return_code = ret if ret > return_code else return_code
     return return_code
 
 
+def run_parallel(config_files: list[Path], workers: int, cron: bool, command: str, args: list[str], upload_budget: int | None = None) -> int:
+    if not cron and (command == "init" or (command == "key" and "change-passphrase" in args)):
+        fail(f"'{command}' asks for a new passphrase and can't be used with --parallel")
+
+    jobs = []
+    for config_file in config_files:
+        env, config = load_config(config_file)
+        commands = config["cron_commands"] if cron else [command, ]
+        # borg runs in worker threads, so there is no terminal left to ask for passphrases
+        env = ask_for_passphrase_upfront(config, env, commands, config_file, args)
+        jobs.append((config_file, env, config))
+    if upload_budget:
+        from borgctl.governor import split_upload_budget
+        split_upload_budget([config for _, _, config in jobs], upload_budget, workers)
+
+    from concurrent.futures import ThreadPoolExecutor
+    return_code = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="borgctl") as executor:
+        futures = []
+        for config_file, env, config in jobs:
+            output_prefix = f"[{config_file.stem}] "
+            if cron:
+                futures.append(executor.submit(run_cron_commands, config, env, config_file, output_prefix))
+            else:
+                futures.append(executor.submit(run_borg_command, command, env, config, config_file, list(args), output_prefix))
+        for future in futures:
+            ret = future.result()
+            return_code = ret if ret > return_code else return_code
+    return return_code
+
+
 def parse_arguments() -> Tuple[argparse.ArgumentParser, argparse.Namespace, list[str]]:
 
-    description = (f"borgctl is a simple borgbackup wrapper. Running version {get_version()}.\n\n"
-                   "The working directory is /etc/borgctl/ "
-                   "for root or $XDG_CONFIG_HOME/borgctl or ~/.config/borgctl for non-root users.\n"
-                   "The log directory is /var/log/borgctl/ for root or $XDG_STATE_HOME/borgctl or "
-                   "~/.local/state/borgctl for non-root users.")
-    parser = argparse.ArgumentParser(description=description,
-                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser = ArgumentParser(formatter_class=HelpFormatter)
     parser.add_argument("-l", "--list",
                         nargs='?',
                         const="*.yml",
@@ -148,6 +455,20 @@ def parse_arguments() -> Tuple[argparse.ArgumentParser, argparse.Namespace, list
     parser.add_argument("--cron",
                         action="store_true",
                         help="run multiple borg commands in a row. The commands to run are specified in the config file (cron_commands)")
+    parser.add_argument("--parallel",
+                        type=int,
+                        metavar="N",
+                        help="run the borg command (or --cron) for multiple config files concurrently with N workers. "
+                             "Passphrases are asked before borg starts and the output is prefixed with the config name. "
+                             "With a single config file, extract is split over N borg processes")
+    parser.add_argument("--upload-budget",
+                        type=int,
+                        metavar="KIB",
+                        help="upload rate limit in kiB/s for all borg processes together. With --parallel, "
+                             "it is split between the borg processes running at the same time")
+    parser.add_argument("--explain",
+                        action="store_true",
+                        help="show the compiled exclude patterns and how many files every pattern excludes from the backup directories")
     parser.add_argument("-p", "--generate-passphrase",
                         action="store_true",
                         help="generate a diceware like passphrase")
@@ -156,8 +477,9 @@ def parse_arguments() -> Tuple[argparse.ArgumentParser, argparse.Namespace, list
                         help="show version and exit")
 
     subparsers = parser.add_subparsers(dest='command')
-    for command in BORG_COMMANDS:
-        subparsers.add_parser(command)
+    for command in BORG_COMMANDS + BORGCTL_COMMANDS:
+        # no -h for subcommands: --help is passed to borg
+        subparsers.add_parser(command, add_help=False)
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -169,27 +491,66 @@ def parse_arguments() -> Tuple[argparse.ArgumentParser, argparse.Namespace, list
 
 def main() -> NoReturn:
     parser, args, borg_cli_arguments = parse_arguments()
-    init_logging()
-    if args.generate_default_config:
-        generate_default_config()
-    elif args.list:
-        show_config_files(args.list)
-    elif args.generate_passphrase:
-        generate_new_passphrase()
-    elif args.version:
-        print(f"borgctl v{get_version()}")
-        sys.exit(0)
+    if not args.generate_default_config:
+        # these don't log, so there is no need to set up logging
+        if args.list:
+            from borgctl.helper import show_config_files
+            show_config_files(args.list)
+        elif args.generate_passphrase:
+            from borgctl.helper import generate_new_passphrase
+            generate_new_passphrase()
+        elif args.version:
+            from borgctl.helper import get_version
+            print(f"borgctl v{get_version()}")
+            sys.exit(0)
 
     return_code = 0
-
     try:
+        init_logging()
+        if args.generate_default_config:
+            from borgctl.helper import generate_default_config
+            generate_default_config()
+
+        if args.parallel is not None and args.parallel < 1:
+            fail("--parallel needs at least one worker")
+        if args.upload_budget is not None and args.upload_budget < 1:
+            fail("--upload-budget must be at least 1 kiB/s")
+
+        if args.command == "daemon":
+            from borgctl.daemon import run_daemon
+            return_code = run_daemon(args.config, args.parallel or 1, borg_cli_arguments, args.upload_budget)
+            sys.exit(return_code)
+        if args.command == "status":
+            # only reads the state index, no config files needed
+            from borgctl.state import show_state
+            show_state(args.config, borg_cli_arguments)
         config_files = prepare_config_files(args.config)
+        if args.command == "stats":
+            from borgctl.history import show_stats
+            show_stats(config_files, borg_cli_arguments)
+        if args.command == "plan":
+            from borgctl.plan import show_plan
+            show_plan(config_files, borg_cli_arguments)
+        runs_borg = (args.cron or args.command) and "help" not in borg_cli_arguments
+        generates_something = args.generate_ssh_key or args.generate_authorized_keys or args.explain
+        run_concurrently = bool(args.parallel and len(config_files) > 1 and runs_borg and not generates_something)
+        if run_concurrently:
+            return_code = run_parallel(config_files, args.parallel, args.cron, args.command, borg_cli_arguments, args.upload_budget)
+            config_files = []
         for config_file in config_files:
             env, config = load_config(config_file)
-
-            if args.generate_ssh_key:
+            if args.upload_budget:
+                from borgctl.governor import split_upload_budget
+                split_upload_budget([config], args.upload_budget, 1)
+
+            if args.explain:
+                from borgctl.patterns import explain_excludes
+                explain_excludes(config, config_file)
+            elif args.generate_ssh_key:
+                from borgctl.helper import generate_ssh_key
                 generate_ssh_key(config, config_file)
             elif args.generate_authorized_keys:
+                from borgctl.helper import generate_authorized_keys
                 generate_authorized_keys(config)
             elif args.cron:
                 ret = run_cron_commands(config, env, config_file)
@@ -199,21 +560,26 @@ def main() -> NoReturn:
                 print_docs_url(args.command)
                 sys.exit(0)
             elif args.command:
-                ret = run_borg_command(args.command, env, config, config_file, borg_cli_arguments)
+                # with a single config file, --parallel splits extract over several borg processes
+                ret = run_borg_command(args.command, env, config, config_file, borg_cli_arguments, extract_workers=args.parallel or 1)
                 return_code = ret if ret > return_code else return_code
             else:
                 parser.print_help()
-        multi_config = len(config_files) > 1
+        multi_config = len(config_files) > 1 or run_concurrently
         if (args.cron or multi_config) and return_code != 0:
             logging.warning(f"Returning with exit code {return_code}")
     except KeyboardInterrupt:
         pass
+    except BorgCtlError as e:
+        # fail() already logged the reason
+        return_code = e.code
     except Exception as e:
         import traceback
         logging.error("Oh no an exception occured")
         logging.error("Please report it: https://github.com/kmille/borgctl/issues")
         logging.error(traceback.format_exc())
-        fail(e)
+        logging.error(e)
+        return_code = 1
     finally:
         sys.exit(return_code)
 
@@ -0,0 +1,90 @@
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, TYPE_CHECKING
+
+from borgctl.utils import BORG_COMMANDS, fail, load_config, prepare_config_files
+
+if TYPE_CHECKING:
+    from borgctl.events import ArchiveStatsEvent, BorgEvent
+
+
+@dataclass
+class RunResult:
+    command: str
+    config_file: Path
+    exit_code: int
+    duration: float
+    # stats of borg create, None for other commands
+    stats: "ArchiveStatsEvent | None" = None
+    events: "list[BorgEvent]" = field(default_factory=list)
+    skipped: bool = False
+
+    @property
+    def success(self) -> bool:
+        # exit code 1 are warnings
+        return self.exit_code <= 1
+
+
+class BorgCtl:
+    """One config file. Use BorgCtl.load() to create it"""
+
+    def __init__(self, config_file: Path, env: dict[str, str], config: dict[str, Any]) -> None:
+        self.config_file = config_file
+        self.env = env
+        self.config = config
+
+    @classmethod
+    def load(cls, config_path: str | Path, passphrase: str | None = None) -> "BorgCtl":
+        """Loads a config file (a name in the config directory or a path).
+
+        There is nobody to ask for a passphrase: configs with passphrase 'ask' need the passphrase argument"""
+        config_file = prepare_config_files([str(config_path)])[0]
+        env, config = load_config(config_file)
+        # the config may come from the cache, don't change it for others
+        env, config = dict(env), dict(config)
+        if passphrase is not None:
+            env["BORG_PASSPHRASE"] = config["passphrase"] = passphrase
+        elif config["passphrase"] in ("ask", "ask-always"):
+            fail(f"{config_file} asks for the passphrase. Please pass it to BorgCtl.load()")
+        return cls(config_file, env, config)
+
+    def run(self, command: str, args: list[str] | None = None, keep_events: bool = False) -> RunResult:
+        """Runs one borg command. With keep_events, RunResult.events has all events of borg (a big borg create
+        has one per file with --list)"""
+        # avoid a circular import
+        from borgctl import run_borg_command
+        from borgctl.events import ArchiveStatsEvent
+        if command not in BORG_COMMANDS and command != "replicate":
+            fail(f"'{command}' is not a borg command")
+        if command == "init" or (command == "key" and "change-passphrase" in (args or [])):
+            fail(f"'{command}' asks for a new passphrase and can't be used with the api")
+
+        events: list[BorgEvent] = []
+        stats: list[ArchiveStatsEvent] = []
+
+        def handle_event(event: "BorgEvent") -> None:
+            if isinstance(event, ArchiveStatsEvent):
+                stats.append(event)
+            if keep_events:
+                events.append(event)
+
+        start = time.time()
+        exit_code = run_borg_command(command, dict(self.env), self.config, self.config_file, list(args or []),
+                                     event_handlers=[handle_event])
+        return RunResult(command, self.config_file, exit_code, time.time() - start, next(iter(stats), None), events)
+
+    def cron(self, keep_events: bool = False) -> list[RunResult]:
+        """Runs the cron_commands (and the replication) like --cron. prune and compact are skipped if create failed"""
+        from borgctl import run_cron_commands
+        results = []
+
+        def run(command: str) -> int:
+            results.append(self.run(command, keep_events=keep_events))
+            return results[-1].exit_code
+
+        def skip(command: str) -> None:
+            results.append(RunResult(command, self.config_file, 0, 0, skipped=True))
+
+        run_cron_commands(self.config, self.env, self.config_file, run=run, skip=skip)
+        return results
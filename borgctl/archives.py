@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from borgctl.utils import ArgumentParser, fail, get_log_directory, parse_duration
+
+
+DEFAULT_CACHE_MAX_AGE = "1h"
+
+
+def get_archive_cache_file(config: dict[str, Any]) -> Path:
+    # one cache per repository, several config files can use the same repository
+    cache_dir = get_log_directory() / "archive_cache"
+    repository_hash = hashlib.sha256(config["repository"].strip().encode()).hexdigest()[:16]
+    return cache_dir / f"{repository_hash}.json"
+
+
+def get_local_transaction(config: dict[str, Any]) -> int | None:
+    """Returns the id of the last transaction of a local repository (the N of index.N).
+
+    Every borg command that changes the repository commits a new transaction, so this is a
+    cheap way to find out if the cache is still valid without borg. None for remote repositories."""
+    repository = config["repository"].strip().removeprefix("file://")
+    if not repository.startswith("/"):
+        return None
+    try:
+        with os.scandir(repository) as it:
+            transactions = [int(entry.name.removeprefix("index.")) for entry in it
+                            if entry.name.startswith("index.") and entry.name.removeprefix("index.").isdigit()]
+    except OSError:
+        return None
+    return max(transactions, default=None)
+
+
+def refresh_archive_cache(config: dict[str, Any], env: dict[str, str]) -> dict[str, Any] | None:
+    cache_file = get_archive_cache_file(config)
+    transaction = get_local_transaction(config)
+    cmd = [config["borg_binary"], "list", "--json"]
+    logging.info(f"Updating archive cache: {' '.join(cmd)}")
+    try:
+        p = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if p.returncode > 1:
+            raise ValueError(f"borg list failed with exit code {p.returncode}: {p.stderr.strip()}")
+        listing = json.loads(p.stdout)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not update archive cache: {e}")
+        invalidate_archive_cache(config)
+        return None
+
+    cache = {"time": time.time(), "repository": config["repository"], "transaction": transaction, "list": listing}
+    # the archive names are not secret, but nobody else should be able to change what we show
+    cache_file.parent.mkdir(mode=0o700, exist_ok=True)
+    tmp_file = cache_file.with_name(f".{cache_file.name}.{os.getpid()}")
+    tmp_file.touch(mode=0o600)
+    tmp_file.write_text(json.dumps(cache))
+    os.replace(tmp_file, cache_file)
+    return cache
+
+
+def invalidate_archive_cache(config: dict[str, Any]) -> None:
+    get_archive_cache_file(config).unlink(missing_ok=True)
+
+
+def load_archive_cache(config: dict[str, Any], max_age: float) -> dict[str, Any] | None:
+    cache_file = get_archive_cache_file(config)
+    try:
+        cache = json.loads(cache_file.read_text())
+        age = time.time() - cache["time"]
+        if age > max_age:
+            logging.info(f"Archive cache is {age:.0f}s old (--max-age {max_age:.0f}s)")
+            return None
+        if cache["transaction"] != get_local_transaction(config):
+            logging.info("The repository changed since the archive cache was updated")
+            return None
+        return dict(cache)
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Could not read archive cache {cache_file}: {e}")
+        return None
+
+
+def format_archive(archive: dict[str, Any]) -> str:
+    import datetime
+    # the default format of borg list: {archive:<36} {time} [{id}]
+    start = datetime.datetime.fromisoformat(archive["start"]).strftime("%a, %Y-%m-%d %H:%M:%S")
+    return f"{archive['archive']:<36} {start} [{archive['id']}]"
+
+
+def show_cached_list(config: dict[str, Any], get_env: Callable[[], dict[str, str]], cli_arguments: list[str]) -> int:
+    """Lists the archives from the cache. get_env (which may ask for the passphrase) is only called if the
+    cache has to be updated with borg list"""
+    parser = ArgumentParser(prog="borgctl list --cached", description="list the archives from the local archive cache")
+    parser.add_argument("--cached", action="store_true")
+    parser.add_argument("--max-age", default=DEFAULT_CACHE_MAX_AGE,
+                        help=f"update the cache with borg list if it is older than MAX_AGE, e.g. 10m (default: {DEFAULT_CACHE_MAX_AGE}). "
+                             "For local repositories, the cache is also updated if the repository changed. "
+                             "Changes of remote repositories (e.g. by other hosts) are only noticed after MAX_AGE")
+    parser.add_argument("--json", action="store_true", help="print the output of borg list --json")
+    parser.add_argument("--first", type=int, help="only show the first N archives")
+    parser.add_argument("--last", type=int, help="only show the last N archives")
+    args, unknown = parser.parse_known_args(cli_arguments)
+    if unknown:
+        fail(f"--cached only lists the archives of the repository. Unsupported arguments: {' '.join(unknown)}")
+    try:
+        max_age = parse_duration(args.max_age)
+    except ValueError as e:
+        fail(f"Invalid --max-age: {e}")
+
+    cache = load_archive_cache(config, max_age)
+    if cache is None:
+        cache = refresh_archive_cache(config, get_env())
+        if cache is None:
+            return 2
+    else:
+        logging.info(f"Using archive cache from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cache['time']))}")
+
+    listing = cache["list"]
+    archives = listing["archives"]
+    if args.first:
+        archives = archives[:args.first]
+    if args.last:
+        archives = archives[-args.last:]
+    if args.json:
+        print(json.dumps(dict(listing, archives=archives), indent=4))
+    else:
+        for archive in archives:
+            print(format_archive(archive))
+    return 0
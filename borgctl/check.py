@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any
+
+from borgctl.events import BorgEvent, LogEvent
+from borgctl.utils import get_log_directory, parse_duration
+
+
+# borg logs how the segment check of borg check --repository-only ended:
+# "finished partial segment check, last segment checked is 42" if --max-duration stopped it,
+# "finished segment check at segment 42" if it reached the end of the repository
+SEGMENT_CHECK_FINISHED = re.compile(r"finished (partial |full )?segment check", re.IGNORECASE)
+
+
+def get_check_state_file(config_file: Path) -> Path:
+    return get_log_directory() / f"borg_check_{config_file.stem}.json"
+
+
+class CheckScheduler:
+    """Splits borg check into partial repository checks (check_max_duration) that finish a full
+    check cycle over several runs, and a full check with --verify-data every check_full_interval.
+
+    borg remembers where a partial check stopped, we only keep track of the cycles. The scheduler is an
+    event handler: borg's log (--log-json) tells if a partial check reached the end of the repository."""
+
+    def __init__(self, config: dict[str, Any], config_file: Path) -> None:
+        self.state_file = get_check_state_file(config_file)
+        self.max_duration = parse_duration(config.get("check_max_duration", 0))
+        self.full_interval = parse_duration(config.get("check_full_interval", 0))
+        self.state: dict[str, Any] = {"cycle_started": None, "cycle_runs": 0, "last_cycle_completed": None,
+                                      "last_full_check": None, "first_run": time.time()}
+        if self.state_file.exists():
+            try:
+                self.state.update(json.loads(self.state_file.read_text()))
+            except ValueError:
+                logging.warning(f"Could not parse {self.state_file}. Starting a new check cycle")
+        self.full_check = False
+        self.cycle_completed = False
+        # partial or full, from the log of borg
+        self.segment_check: str | None = None
+
+    def get_arguments(self) -> list[str]:
+        now = time.time()
+        # the first full check is done one interval after the first run, so it does not break the time budget right away
+        last_full_check = self.state["last_full_check"] or self.state["first_run"]
+        if self.full_interval and now - last_full_check >= self.full_interval:
+            self.full_check = True
+            logging.info("Running a full check (check_full_interval): repository, archives and data (--verify-data)")
+            return ["--verify-data"]
+        if self.max_duration:
+            if self.state["cycle_started"] is None:
+                self.state["cycle_started"] = now
+            logging.info(f"Running a partial repository check (run {self.state['cycle_runs'] + 1} of the current cycle, "
+                         f"at most {self.max_duration:.0f}s)")
+            return ["--repository-only", f"--max-duration={int(self.max_duration)}"]
+        return []
+
+    def __call__(self, event: BorgEvent) -> None:
+        if isinstance(event, LogEvent) and (match := SEGMENT_CHECK_FINISHED.search(event.message)):
+            self.segment_check = "partial" if match.group(1) == "partial " else "full"
+
+    def finished(self, return_code: int) -> None:
+        if return_code != 0:
+            # the same part is checked again next time
+            return
+        now = time.time()
+        if self.full_check:
+            # a full check also checks the whole repository
+            self.state.update({"last_full_check": now, "last_cycle_completed": now, "cycle_started": None, "cycle_runs": 0})
+            self.cycle_completed = True
+        elif self.max_duration:
+            self.state["cycle_runs"] += 1
+            if self.segment_check is None:
+                logging.warning("borg did not log the end of the segment check. The check cycle is not completed")
+            elif self.segment_check == "full":
+                logging.info(f"Check cycle completed after {self.state['cycle_runs']} runs")
+                self.state.update({"last_cycle_completed": now, "cycle_started": None, "cycle_runs": 0})
+                self.cycle_completed = True
+        else:
+            self.cycle_completed = True
+
+        tmp_file = self.state_file.with_name(f".{self.state_file.name}.{os.getpid()}")
+        tmp_file.write_text(json.dumps(self.state, indent=4))
+        os.replace(tmp_file, self.state_file)
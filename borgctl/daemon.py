@@ -0,0 +1,271 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from types import FrameType
+from typing import Any, NoReturn
+
+from borgctl.utils import load_config, ask_for_passphrase_upfront, get_log_directory, parse_duration, fail, \
+    prepare_config_files, BorgCtlError
+
+
+DEFAULT_INTERVAL = "1d"
+DEFAULT_JITTER = "0"
+
+
+@dataclass
+class Job:
+    config_file: Path
+    env: dict[str, str]
+    config: dict[str, Any]
+    interval: float
+    jitter: float
+    next_run: float = 0.0
+    last_run: float | None = None
+    last_exit_code: int | None = None
+    # idle, queued (waiting for a free worker) or running
+    state: str = "idle"
+
+    def schedule(self, now: float) -> None:
+        # the jitter spreads the runs of many hosts/configs sharing a backup server
+        due = now if self.last_run is None else max(now, self.last_run + self.interval)
+        self.next_run = due + random.uniform(0, self.jitter)
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "config": self.config_file.resolve().as_posix(),
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "state": self.state,
+            "next_run": format_time(self.next_run),
+            "last_run": format_time(self.last_run),
+            "last_exit_code": self.last_exit_code,
+        }
+
+
+def format_time(timestamp: float | None) -> str | None:
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+
+def get_daemon_state_file() -> Path:
+    return get_log_directory() / "borg_daemon.json"
+
+
+def get_socket_file() -> Path:
+    return get_log_directory() / "borgctl.sock"
+
+
+class Daemon:
+    """Runs the cron_commands of every config file on its own schedule (daemon_interval + daemon_jitter).
+
+    Configs are loaded and passphrases asked once. At most workers configs run at the same time.
+    SIGHUP reloads the config files, SIGTERM/SIGINT stop the daemon after the running jobs are done."""
+
+    def __init__(self, config_files: list[Path], workers: int, socket_file: Path, upload_budget: int | None = None) -> None:
+        self.config_files = config_files
+        self.workers = workers
+        self.upload_budget = upload_budget
+        self.socket_file = socket_file
+        self.jobs: dict[Path, Job] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.reload_requested = False
+        self.stop_requested = False
+        self.started = time.time()
+
+    def load_jobs(self) -> None:
+        last_runs = self.load_state()
+        jobs = {}
+        for config_file in self.config_files:
+            try:
+                env, config = load_config(config_file)
+                interval = parse_duration(config.get("daemon_interval", DEFAULT_INTERVAL))
+                jitter = parse_duration(config.get("daemon_jitter", DEFAULT_JITTER))
+            except BorgCtlError:
+                # fail() already logged the reason
+                if config_file in self.jobs:
+                    logging.error(f"Keeping the previous configuration of {config_file}")
+                    jobs[config_file] = self.jobs[config_file]
+                continue
+
+            old_job = self.jobs.get(config_file)
+            if old_job and config["passphrase"] in ("ask", "ask-always"):
+                # keep the passphrase in memory, there is nobody to ask after a reload
+                env["BORG_PASSPHRASE"] = old_job.env["BORG_PASSPHRASE"]
+                config["passphrase"] = old_job.config["passphrase"]
+            elif config["passphrase"] in ("ask", "ask-always"):
+                if not sys.stdin.isatty():
+                    logging.error(f"{config_file} needs a passphrase (ask), but there is no terminal. Skipping it")
+                    continue
+                env = ask_for_passphrase_upfront(config, env, config["cron_commands"], config_file, [])
+
+            if old_job:
+                # the job may be running, so it is updated in place
+                job = old_job
+                with self.lock:
+                    job.env, job.config = env, config
+                    if (job.interval, job.jitter) != (interval, jitter):
+                        job.interval, job.jitter = interval, jitter
+                        job.schedule(time.time())
+            else:
+                job = Job(config_file, env, config, interval, jitter, last_run=last_runs.get(config_file.resolve().as_posix()))
+                job.schedule(time.time())
+            jobs[config_file] = job
+            logging.info(f"Scheduled {config_file.stem}: every {interval:.0f}s (jitter {jitter:.0f}s), "
+                         f"next run at {format_time(job.next_run)}")
+        if self.upload_budget:
+            from borgctl.governor import split_upload_budget
+            split_upload_budget([job.config for job in jobs.values()], self.upload_budget, self.workers)
+        with self.lock:
+            self.jobs = jobs
+
+    def load_state(self) -> dict[str, float]:
+        state_file = get_daemon_state_file()
+        if not state_file.exists():
+            return {}
+        try:
+            return {config: float(last_run) for config, last_run in json.loads(state_file.read_text()).items()}
+        except (ValueError, AttributeError):
+            logging.warning(f"Could not parse {state_file}. Running all configs")
+            return {}
+
+    def save_state(self) -> None:
+        # so a restarted daemon does not run everything again
+        with self.lock:
+            state = {job.config_file.resolve().as_posix(): job.last_run for job in self.jobs.values() if job.last_run is not None}
+        get_daemon_state_file().write_text(json.dumps(state, indent=4))
+
+    def run_job(self, job: Job) -> None:
+        # avoid a circular import
+        from borgctl import run_cron_commands
+        with self.lock:
+            job.state = "running"
+        start = time.time()
+        return_code = 2
+        try:
+            return_code = run_cron_commands(job.config, dict(job.env), job.config_file, f"[{job.config_file.stem}] ")
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            # also SystemExit (sys.exit, argparse): the job must not stay "running" forever
+            logging.error(f"[{job.config_file.stem}] {type(e).__name__}: {e}")
+        finally:
+            with self.lock:
+                job.last_run = start
+                job.last_exit_code = return_code
+                job.state = "idle"
+                job.schedule(time.time())
+        logging.info(f"[{job.config_file.stem}] Done (exit code {return_code}), next run at {format_time(job.next_run)}")
+        self.save_state()
+        self.wakeup.set()
+
+    def status(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "started": format_time(self.started),
+                "workers": self.workers,
+                "jobs": [job.status() for job in self.jobs.values()],
+            }
+
+    def serve_status(self, server: socket.socket) -> None:
+        # every client gets the status as json, then the connection is closed
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            with connection:
+                try:
+                    connection.sendall(json.dumps(self.status(), indent=4).encode() + b"\n")
+                except OSError as e:
+                    logging.debug(f"Could not send status: {e}")
+
+    def handle_signal(self, signum: int, frame: FrameType | None) -> None:
+        if signum == signal.SIGHUP:
+            self.reload_requested = True
+        else:
+            self.stop_requested = True
+        self.wakeup.set()
+
+    def run(self) -> int:
+        self.load_jobs()
+        if not self.jobs:
+            fail("No config file to run")
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.handle_signal)
+
+        self.socket_file.unlink(missing_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(self.socket_file.as_posix())
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        threading.Thread(target=self.serve_status, args=(server, ), name="borgctl-status", daemon=True).start()
+        logging.info(f"borgctl daemon started with {self.workers} worker(s), status socket: {self.socket_file}")
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="borgctl") as executor:
+            while not self.stop_requested:
+                if self.reload_requested:
+                    self.reload_requested = False
+                    logging.info("Got SIGHUP, reloading config files")
+                    self.load_jobs()
+                now = time.time()
+                with self.lock:
+                    due = [job for job in self.jobs.values() if job.state == "idle" and job.next_run <= now]
+                    for job in due:
+                        # the executor queues the job if all workers are busy
+                        job.state = "queued"
+                        executor.submit(self.run_job, job)
+                    idle = [job.next_run for job in self.jobs.values() if job.state == "idle"]
+                self.wakeup.wait(timeout=max(min(idle, default=now + 60) - now, 0.1))
+                self.wakeup.clear()
+            logging.info("Stopping borgctl daemon. Waiting for running jobs")
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        server.close()
+        self.socket_file.unlink(missing_ok=True)
+        failed = [job.last_exit_code or 0 for job in self.jobs.values()]
+        return max(failed, default=0)
+
+
+def show_status(socket_file: Path) -> NoReturn:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_file.as_posix())
+    except OSError as e:
+        fail(f"Could not connect to the borgctl daemon ({socket_file}): {e}")
+    with client:
+        data = b""
+        while chunk := client.recv(65536):
+            data += chunk
+    print(data.decode(), end="")
+    sys.exit(0)
+
+
+def run_daemon(cli_config: list[str] | None, workers: int, cli_arguments: list[str], upload_budget: int | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="borgctl daemon", description="run the cron_commands of the config files on a schedule "
+                                                                        "(daemon_interval and daemon_jitter in the config files)")
+    parser.add_argument("--socket", type=Path, default=get_socket_file(),
+                        help=f"path of the status socket (default: {get_socket_file()})")
+    parser.add_argument("--status", action="store_true", help="print the status of the running daemon as json")
+    args = parser.parse_args(cli_arguments)
+
+    if args.status:
+        show_status(args.socket)
+    config_files = prepare_config_files(cli_config)
+    return Daemon(config_files, workers, args.socket, upload_budget).run()
@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import selectors
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, IO
+
+
+# stdout is shared by all borg processes if --parallel is used
+output_lock = threading.Lock()
+
+
+@dataclass
+class OutputEvent:
+    # a line borg wrote to stdout (like the output of list or --json)
+    line: str
+
+
+@dataclass
+class LogEvent:
+    level: str
+    message: str
+    name: str = ""
+    msgid: str | None = None
+
+
+@dataclass
+class ProgressEvent:
+    operation: str
+    message: str
+    percent: float | None
+    finished: bool
+
+
+@dataclass
+class ArchiveProgressEvent:
+    nfiles: int
+    original_size: int
+    compressed_size: int
+    deduplicated_size: int
+    path: str
+    files_per_sec: float
+    bytes_per_sec: float
+    finished: bool
+
+
+@dataclass
+class FileStatusEvent:
+    status: str
+    path: str
+
+
+@dataclass
+class ArchiveStatsEvent:
+    # stats of borg create --json
+    archive: str
+    duration: float
+    nfiles: int
+    original_size: int
+    compressed_size: int
+    deduplicated_size: int
+    raw: str
+
+
+BorgEvent = OutputEvent | LogEvent | ProgressEvent | ArchiveProgressEvent | FileStatusEvent | ArchiveStatsEvent
+EventHandler = Callable[[BorgEvent], None]
+
+
+def format_size(size: float) -> str:
+    # same units as borg uses (decimal)
+    for unit in ("B", "kB", "MB", "GB", "TB"):
+        if abs(size) < 1000 or unit == "TB":
+            break
+        size /= 1000
+    if unit == "B":
+        return f"{int(size)} B"
+    return f"{size:.2f} {unit}"
+
+
+class BorgEventParser:
+
+    def __init__(self) -> None:
+        self.start = time.time()
+        self.last_archive_progress: ArchiveProgressEvent | None = None
+
+    def parse(self, line: str, stream: str) -> BorgEvent | None:
+        if stream == "stdout":
+            return OutputEvent(line)
+        if line.strip() == "":
+            return None
+        try:
+            msg: dict[str, Any] = json.loads(line)
+        except ValueError:
+            msg = {}
+        if type(msg) is not dict or "type" not in msg:
+            # not everything on stderr is json, e.g. output of ssh ("Remote: ...")
+            return LogEvent("WARNING", line.rstrip(), "stderr")
+
+        match msg["type"]:
+            case "log_message":
+                return LogEvent(msg.get("levelname", "INFO"), msg.get("message", ""), msg.get("name", ""), msg.get("msgid"))
+            case "progress_percent":
+                percent = None
+                if msg.get("total"):
+                    percent = 100.0 * msg.get("current", 0) / msg["total"]
+                return ProgressEvent(msg.get("msgid") or "", msg.get("message", ""), percent, msg.get("finished", False))
+            case "progress_message":
+                return ProgressEvent(msg.get("msgid") or "", msg.get("message", ""), None, msg.get("finished", False))
+            case "archive_progress":
+                return self.parse_archive_progress(msg)
+            case "file_status":
+                return FileStatusEvent(msg.get("status", ""), msg.get("path", ""))
+        return LogEvent("DEBUG", line.rstrip(), "stderr")
+
+    def parse_archive_progress(self, msg: dict[str, Any]) -> ArchiveProgressEvent:
+        last = self.last_archive_progress
+        if msg.get("finished", False) and last:
+            # the last message only says that borg is done, so we keep the numbers of the previous one
+            event = ArchiveProgressEvent(last.nfiles, last.original_size, last.compressed_size, last.deduplicated_size,
+                                         "", last.files_per_sec, last.bytes_per_sec, True)
+        else:
+            elapsed = max(msg.get("time", time.time()) - self.start, 0.001)
+            nfiles = msg.get("nfiles", 0)
+            original_size = msg.get("original_size", 0)
+            event = ArchiveProgressEvent(nfiles, original_size, msg.get("compressed_size", 0),
+                                         msg.get("deduplicated_size", 0), msg.get("path", ""),
+                                         nfiles / elapsed, original_size / elapsed, msg.get("finished", False))
+        self.last_archive_progress = event
+        return event
+
+    def parse_json_output(self, output: str) -> BorgEvent:
+        try:
+            archive = json.loads(output)["archive"]
+            stats = archive["stats"]
+            return ArchiveStatsEvent(archive["name"], archive["duration"], stats["nfiles"], stats["original_size"],
+                                     stats["compressed_size"], stats["deduplicated_size"], output)
+        except (ValueError, KeyError, TypeError):
+            return OutputEvent(output.rstrip("\n"))
+
+
+class ConsoleRenderer:
+    """Renders the events of a --log-json borg run the way borg itself would print them.
+
+    If progress_interval is 0, progress is shown as single line that gets updated. Otherwise
+    (no terminal, e. g. cron), at most one progress line per progress_interval seconds is written."""
+
+    def __init__(self, progress_interval: float, output_prefix: str = "", print_json: bool = True) -> None:
+        self.progress_interval = progress_interval
+        self.output_prefix = output_prefix
+        self.print_json = print_json
+        self.last_progress = 0.0
+        self.progress_line_open = False
+
+    def __call__(self, event: BorgEvent) -> None:
+        if isinstance(event, OutputEvent):
+            self.write(sys.stdout, event.line + "\n")
+        elif isinstance(event, LogEvent):
+            level = logging.getLevelName(event.level)
+            self.log(level if type(level) is int else logging.INFO, event.message)
+        elif isinstance(event, FileStatusEvent):
+            self.log(logging.INFO, f"{event.status} {event.path}")
+        elif isinstance(event, ProgressEvent):
+            self.progress(event.message, event.finished)
+        elif isinstance(event, ArchiveProgressEvent):
+            line = (f"{format_size(event.original_size)} O {format_size(event.compressed_size)} C "
+                    f"{format_size(event.deduplicated_size)} D {event.nfiles} N "
+                    f"({event.files_per_sec:.0f} files/s, {format_size(event.bytes_per_sec)}/s) {event.path}")
+            self.progress(line, event.finished)
+        elif isinstance(event, ArchiveStatsEvent):
+            if self.print_json:
+                self.write(sys.stdout, event.raw)
+            else:
+                self.log(logging.INFO, f"Archive name: {event.archive}")
+                self.log(logging.INFO, f"Duration: {event.duration:.2f} seconds")
+                self.log(logging.INFO, f"Number of files: {event.nfiles}")
+                self.log(logging.INFO, f"{'':<20}{'Original size':>20}{'Compressed size':>20}{'Deduplicated size':>20}")
+                self.log(logging.INFO, f"{'This archive:':<20}{format_size(event.original_size):>20}"
+                                       f"{format_size(event.compressed_size):>20}{format_size(event.deduplicated_size):>20}")
+
+    def progress(self, line: str, finished: bool) -> None:
+        if self.progress_interval == 0:
+            if finished:
+                self.write(sys.stderr, "\r\x1b[K", progress=True)
+                self.progress_line_open = False
+            else:
+                self.write(sys.stderr, f"\r{self.output_prefix}{line}\x1b[K", progress=True)
+            return
+        now = time.monotonic()
+        if not finished and now - self.last_progress >= self.progress_interval:
+            self.last_progress = now
+            self.log(logging.INFO, f"Progress: {line}")
+
+    def log(self, level: int, message: str) -> None:
+        with output_lock:
+            self.end_progress_line()
+        logging.log(level, f"{self.output_prefix}{message}")
+
+    def write(self, stream: Any, text: str, progress: bool = False) -> None:
+        with output_lock:
+            if not progress:
+                self.end_progress_line()
+            stream.write(text)
+            stream.flush()
+            self.progress_line_open = progress
+
+    def end_progress_line(self) -> None:
+        if self.progress_line_open:
+            sys.stderr.write("\n")
+            sys.stderr.flush()
+            self.progress_line_open = False
+
+
+def stream_borg(cmd: list[str], env: dict[str, str], handlers: list[EventHandler], json_output: bool = False,
+                transcript: BinaryIO | None = None, stdin: IO[bytes] | None = None) -> int:
+    """Runs borg and passes the events of its --log-json output to the handlers.
+
+    If json_output is set (borg --json), stdout is parsed as a whole when borg is done.
+    The raw output is also written to the transcript."""
+    parser = BorgEventParser()
+    json_stdout = b""
+
+    def dispatch(line: bytes, stream: str) -> None:
+        event = parser.parse(line.decode(errors="replace"), stream)
+        if event is not None:
+            emit(event)
+
+    def emit(event: BorgEvent) -> None:
+        for handler in handlers:
+            handler(event)
+
+    with subprocess.Popen(cmd, env=env, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as p:
+        assert p.stdout is not None and p.stderr is not None
+        selector = selectors.DefaultSelector()
+        selector.register(p.stdout, selectors.EVENT_READ, "stdout")
+        selector.register(p.stderr, selectors.EVENT_READ, "stderr")
+        pending = {"stdout": b"", "stderr": b""}
+        while selector.get_map():
+            for key, _ in selector.select():
+                stream = key.data
+                data = os.read(key.fd, 65536)
+                if transcript:
+                    transcript.write(data)
+                if json_output and stream == "stdout":
+                    json_stdout += data
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        emit(parser.parse_json_output(json_stdout.decode(errors="replace")))
+                    continue
+                if not data:
+                    selector.unregister(key.fileobj)
+                    if pending[stream]:
+                        dispatch(pending[stream], stream)
+                    continue
+                *lines, pending[stream] = (pending[stream] + data).split(b"\n")
+                for line in lines:
+                    dispatch(line, stream)
+        selector.close()
+        return p.wait()
@@ -0,0 +1,368 @@
+import hashlib
+import heapq
+import json
+import logging
+import os
+import stat
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, Future
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TYPE_CHECKING
+
+from borgctl.utils import fail, format_duration, get_log_directory
+
+if TYPE_CHECKING:
+    from borgctl.events import BorgEvent, EventHandler
+
+
+# directories deeper than this are not split into smaller units
+MAX_DEPTH = 6
+# extracting a file costs time even if it's empty (latency, metadata). Counted like 64 kB of data
+FILE_COST = 64 * 1000
+# split units until the largest one is smaller than 1/(4*N) of the archive, so the shards can be balanced
+UNITS_PER_SHARD = 4
+MAX_UNITS = 10000
+# like the scan of borg_create_skip_unchanged: lstat releases the GIL
+DEFAULT_DELTA_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+DELTA_MODES = ("metadata", "checksum")
+# archive items compared by one thread at once
+DELTA_BATCH_SIZE = 1000
+# the options of borg extract (and the common options) that take a value
+OPTIONS_WITH_VALUE = ("-e", "--exclude", "--exclude-from", "--pattern", "--patterns-from", "--strip-components",
+                      "--lock-wait", "--remote-path", "--rsh", "--umask", "--upload-ratelimit", "--upload-buffer",
+                      "--debug-topic", "--debug-profile")
+
+
+def split_arguments(cmd: list[str]) -> tuple[list[str], list[str], str, list[str]]:
+    """Splits the extract command into borg + options, the archive and the paths.
+
+    The options of OPTIONS_WITH_VALUE may have a separate value (like in borg_extract_arguments: --strip-components 1),
+    they are returned as --option=value"""
+    index = cmd.index("extract") + 1
+    options = []
+    positionals = []
+    arguments = iter(cmd[index:])
+    for arg in arguments:
+        if arg in OPTIONS_WITH_VALUE:
+            value = next(arguments, None)
+            if value is None:
+                fail(f"{arg} needs a value")
+            # -e is the only short one, borg takes -e=x as the pattern =x
+            options.extend([arg, value] if arg == "-e" else [f"{arg}={value}"])
+        elif arg.startswith("-"):
+            options.append(arg)
+        else:
+            positionals.append(arg)
+    if not positionals:
+        fail("extract with --parallel or --delta needs an archive (::archive [PATH ...])")
+    return cmd[:index], options, positionals[0], positionals[1:]
+
+
+def list_archive(borg_binary: str, env: dict[str, str], archive: str, paths: list[str], keys: list[str] | None = None) -> Iterator[dict[str, Any]]:
+    """Returns the items of the archive (borg list --json-lines) while borg lists them.
+
+    Errors before the first item (like a missing archive) fail here, not while the items are used"""
+    cmd = [borg_binary, "list", "--json-lines", archive, *paths]
+    if keys:
+        # with --json-lines, the keys used in --format are added to the output
+        cmd.insert(3, "--format=" + "".join(f"{{{key}}}" for key in keys))
+    p = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE)
+    assert p.stdout is not None
+    first_line = p.stdout.readline()
+    if not first_line:
+        p.stdout.close()
+        if p.wait() != 0:
+            fail(f"Could not list {archive} (exit code {p.returncode})", 2)
+    return read_items(p, archive, first_line)
+
+
+def read_items(p: "subprocess.Popen[bytes]", archive: str, first_line: bytes) -> Iterator[dict[str, Any]]:
+    with p:
+        assert p.stdout is not None
+        if first_line:
+            yield json.loads(first_line)
+        for line in p.stdout:
+            yield json.loads(line)
+        if p.wait() != 0:
+            # borg failed while listing (like a lost connection)
+            fail(f"Could not list {archive} (exit code {p.returncode})", 2)
+
+
+def get_tree(items: Iterable[dict[str, Any]], hardlinks: dict[str, str] | None = None) -> dict[str, int]:
+    """Returns the cost of every path up to MAX_DEPTH, including everything below it.
+
+    The hardlinks (path -> path of the first link, borg extracts the content with it) are added to hardlinks"""
+    tree: dict[str, int] = {}
+    for item in items:
+        parts = item["path"].split("/")
+        cost = item.get("size", 0) + FILE_COST
+        for depth in range(1, min(len(parts), MAX_DEPTH) + 1):
+            prefix = "/".join(parts[:depth])
+            tree[prefix] = tree.get(prefix, 0) + cost
+        if hardlinks is not None and item.get("mode", "").startswith("h") and item.get("linktarget"):
+            hardlinks[item["path"]] = item["linktarget"]
+    return tree
+
+
+def get_units(tree: dict[str, int], workers: int) -> tuple[list[tuple[int, str]], list[str]]:
+    """Returns the units (cost, path) to distribute and the directories that were split into their children.
+
+    A unit is extracted with everything below it. The largest units are split until they are small enough"""
+    children: dict[str, list[str]] = {}
+    for path in tree:
+        parent = path.rpartition("/")[0]
+        children.setdefault(parent, []).append(path)
+
+    limit = sum(tree[path] for path in children.get("", [])) / (workers * UNITS_PER_SHARD)
+    # a max heap of the units that can still be split
+    heap = [(-tree[path], path) for path in children.get("", [])]
+    heapq.heapify(heap)
+    units: list[tuple[int, str]] = []
+    split_directories = []
+    while heap:
+        cost, path = heapq.heappop(heap)
+        if -cost > limit and path in children and len(units) + len(heap) < MAX_UNITS:
+            split_directories.append(path)
+            for child in children[path]:
+                heapq.heappush(heap, (-tree[child], child))
+        else:
+            units.append((-cost, path))
+    return units, split_directories
+
+
+def group_hardlinks(units: list[tuple[int, str]], hardlinks: dict[str, str]) -> list[tuple[int, list[str]]]:
+    """Merges the units with links to the same file: a borg process only restores a hardlink if it extracts
+    the first link, too. Otherwise it would be a separate copy of the file"""
+    parents = {path: path for _, path in units}
+
+    def get_unit(path: str) -> str:
+        while path and path not in parents:
+            path = path.rpartition("/")[0]
+        return path
+
+    def find(unit: str) -> str:
+        while parents[unit] != unit:
+            unit = parents[unit]
+        return unit
+
+    for path, first_link in hardlinks.items():
+        unit, other_unit = get_unit(path), get_unit(first_link)
+        # the first link may be outside of the paths to extract
+        if unit and other_unit:
+            parents[find(unit)] = find(other_unit)
+
+    groups: dict[str, tuple[int, list[str]]] = {}
+    for cost, path in units:
+        total, paths = groups.get(find(path), (0, []))
+        groups[find(path)] = (total + cost, paths + [path])
+    return list(groups.values())
+
+
+def get_shards(units: list[tuple[int, list[str]]], workers: int) -> list[tuple[int, list[str]]]:
+    """Distributes the units over the shards: the largest unit goes to the shard with the lowest cost (LPT)"""
+    shards: list[tuple[int, int, list[str]]] = [(0, i, []) for i in range(workers)]
+    for cost, unit_paths in sorted(units, reverse=True):
+        total, i, paths = heapq.heappop(shards)
+        paths.extend(unit_paths)
+        heapq.heappush(shards, (total + cost, i, paths))
+    return [(total, paths) for total, _, paths in sorted(shards, key=lambda shard: shard[1]) if paths]
+
+
+def write_patterns(patterns_file: Path, prefixes: list[str], full_paths: list[str]) -> None:
+    # pp: extracts the path and everything below it, pf: only the path itself. Everything else is excluded
+    lines = [f"+ pp:{path}" for path in prefixes] + [f"+ pf:{path}" for path in full_paths] + ["- fm:*"]
+    patterns_file.write_text("\n".join(lines) + "\n")
+
+
+def get_synchronized_handlers(handlers: "list[EventHandler] | None") -> "list[EventHandler] | None":
+    """The shards run in threads, but the handlers (console, stats, the api) are not thread safe: they get one event at a time"""
+    if not handlers:
+        return handlers
+    lock = threading.Lock()
+
+    def handle_event(event: "BorgEvent") -> None:
+        with lock:
+            for handler in handlers:
+                handler(event)
+    return [handle_event]
+
+
+def run_sharded_extract(cmd: list[str], env: dict[str, str], config: dict[str, Any], config_file: Path, workers: int,
+                        output_prefix: str = "", handlers: "list[EventHandler] | None" = None) -> int:
+    """Restores an archive with several borg extract processes at the same time.
+
+    Every borg extract gets a part of the archive (a shard) with about the same amount of data and files"""
+    from borgctl import execute_borg
+    from borgctl.events import format_size
+    base, options, archive, paths = split_arguments(cmd)
+    logging.info(f"{output_prefix}Listing {archive} to split it into {workers} shards")
+    hardlinks: dict[str, str] = {}
+    tree = get_tree(list_archive(config["borg_binary"], env, archive, paths), hardlinks)
+    units, split_directories = get_units(tree, workers)
+    shards = get_shards(group_hardlinks(units, hardlinks), workers)
+    if not shards:
+        logging.warning(f"{output_prefix}Nothing to extract in {archive}")
+        return 0
+
+    patterns_dir = get_log_directory() / "extract"
+    patterns_dir.mkdir(exist_ok=True)
+    shard_commands = []
+    for i, (cost, shard_paths) in enumerate(shards, start=1):
+        patterns_file = patterns_dir / f"{config_file.stem}_shard{i}.lst"
+        write_patterns(patterns_file, shard_paths, [])
+        logging.info(f"{output_prefix}Shard {i}: {len(shard_paths)} path(s), {format_size(cost)}")
+        # the user's options (and excludes) first: the first matching pattern wins
+        shard_commands.append((i, patterns_file, base + options + [archive, f"--patterns-from={patterns_file}"]))
+
+    start = time.time()
+    failed = []
+    return_code = 0
+    shard_handlers = get_synchronized_handlers(handlers)
+    with ThreadPoolExecutor(max_workers=len(shard_commands), thread_name_prefix="borgctl-extract") as executor:
+        futures = {executor.submit(execute_borg, shard_cmd, env, f"{output_prefix}[shard {i}] ", shard_handlers, config): (i, patterns_file)
+                   for i, patterns_file, shard_cmd in shard_commands}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i, patterns_file = futures[future]
+            ret = future.result()
+            return_code = ret if ret > return_code else return_code
+            logging.info(f"{output_prefix}Shard {i} finished with exit code {ret} ({done} of {len(shard_commands)} done, {format_duration(time.time() - start)})")
+            if ret > 1:
+                failed.append((i, patterns_file))
+            else:
+                patterns_file.unlink()
+
+    if split_directories:
+        # borg created the split directories without their metadata (or changed their mtime) while extracting their content
+        patterns_file = patterns_dir / f"{config_file.stem}_directories.lst"
+        write_patterns(patterns_file, [], split_directories)
+        ret = execute_borg(base + options + [archive, f"--patterns-from={patterns_file}"], env, f"{output_prefix}[directories] ", handlers, config)
+        return_code = ret if ret > return_code else return_code
+        patterns_file.unlink()
+
+    for i, patterns_file in failed:
+        logging.error(f"{output_prefix}Shard {i} failed. Retry it with: borgctl -c {config_file} extract {' '.join(options)} {archive} --patterns-from={patterns_file}")
+    logging.info(f"{output_prefix}Extracted {archive} with {len(shard_commands)} borg processes in {format_duration(time.time() - start)}")
+    return return_code
+
+
+def parse_delta_argument(args: list[str]) -> tuple[str | None, list[str]]:
+    """Returns the delta mode of --delta[=metadata|checksum] (None without --delta) and the arguments for borg"""
+    mode = None
+    borg_args = []
+    for arg in args:
+        if arg == "--delta" or arg.startswith("--delta="):
+            mode = arg.partition("=")[2] or "metadata"
+            if mode not in DELTA_MODES:
+                fail(f"--delta must be one of {', '.join(DELTA_MODES)}")
+        else:
+            borg_args.append(arg)
+    return mode, borg_args
+
+
+def get_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def item_changed(item: dict[str, Any], local_path: str, checksum: bool) -> bool:
+    """Returns True if borg has to extract the item because the local file is missing or differs"""
+    try:
+        st = os.lstat(local_path)
+    except OSError:
+        return True
+    # borg uses the same format (like ls -l) for the mode, but h for the second and further links of a hardlink
+    mode = item["mode"]
+    if mode.startswith("h"):
+        mode = "-" + mode[1:]
+    if stat.filemode(st.st_mode) != mode:
+        return True
+    if stat.S_ISLNK(st.st_mode):
+        try:
+            return os.readlink(local_path) != item.get("linktarget")
+        except OSError:
+            return True
+    if not stat.S_ISREG(st.st_mode):
+        # extracting the content of a directory changes its mtime, so only missing directories are extracted
+        return False
+    # borg prints the mtime in local time with microseconds, rounded through a float
+    mtime_us = datetime.fromisoformat(item["mtime"]).timestamp() * 1000000
+    if st.st_size != item["size"] or abs(st.st_mtime_ns / 1000 - mtime_us) > 1:
+        return True
+    if checksum:
+        try:
+            return bool(get_sha256(local_path) != item["sha256"])
+        except OSError:
+            return True
+    return False
+
+
+def get_changed_items(items: Iterable[dict[str, Any]], strip_components: int, checksum: bool,
+                      workers: int = DEFAULT_DELTA_WORKERS) -> Iterator[dict[str, Any]]:
+    """Compares the archive items with the files in the working directory (where borg extracts to).
+
+    The local files are checked by a thread pool in batches, the order of the changed items is not defined"""
+    def compare(batch: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        changed = []
+        for item in batch:
+            parts = item["path"].split("/")[strip_components:]
+            if parts and item_changed(item, os.path.join(*parts), checksum):
+                changed.append(item)
+        return changed
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="borgctl-delta") as executor:
+        pending: set[Future[list[dict[str, Any]]]] = set()
+        batch: list[dict[str, Any]] = []
+        for item in items:
+            batch.append(item)
+            if len(batch) == DELTA_BATCH_SIZE:
+                pending.add(executor.submit(compare, batch))
+                batch = []
+            # don't read the whole archive into memory if the file system is slower than borg list
+            while len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        pending.add(executor.submit(compare, batch))
+        for future in as_completed(pending):
+            yield from future.result()
+
+
+def run_delta_extract(cmd: list[str], env: dict[str, str], config: dict[str, Any], config_file: Path, mode: str,
+                      output_prefix: str = "", handlers: "list[EventHandler] | None" = None) -> int:
+    """Extracts only the items of the archive that are missing or differ in the working directory.
+
+    Local files that are not in the archive are kept"""
+    from borgctl import execute_borg
+    from borgctl.events import format_size
+    base, options, archive, paths = split_arguments(cmd)
+    strip_components = 0
+    for option in options:
+        if option.startswith("--strip-components="):
+            strip_components = int(option.partition("=")[2])
+    checksum = mode == "checksum"
+    logging.info(f"{output_prefix}Comparing {archive} with {Path.cwd()} ({mode})")
+
+    start = time.time()
+    changed_paths = []
+    changed_size = 0
+    keys = ["sha256"] if checksum else None
+    for item in get_changed_items(list_archive(config["borg_binary"], env, archive, paths, keys), strip_components, checksum):
+        changed_paths.append(item["path"])
+        changed_size += item.get("size", 0)
+    logging.info(f"{output_prefix}{len(changed_paths)} item(s) ({format_size(changed_size)}) missing or changed, "
+                 f"compared in {format_duration(time.time() - start)}")
+    if not changed_paths:
+        return 0
+
+    patterns_dir = get_log_directory() / "extract"
+    patterns_dir.mkdir(exist_ok=True)
+    patterns_file = patterns_dir / f"{config_file.stem}_delta.lst"
+    write_patterns(patterns_file, [], changed_paths)
+    # the user's options (and excludes) first: the first matching pattern wins
+    return_code = execute_borg(base + options + [archive, f"--patterns-from={patterns_file}"], env, output_prefix, handlers, config)
+    if return_code <= 1:
+        patterns_file.unlink()
+    return return_code
@@ -0,0 +1,49 @@
+import logging
+import shutil
+from functools import cache
+from typing import Any
+
+
+IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+
+@cache
+def has_binary(binary: str) -> bool:
+    if shutil.which(binary) is None:
+        logging.warning(f"'{binary}' not found. Ignoring the resource limits that need it")
+        return False
+    return True
+
+
+def get_governor_command(config: dict[str, Any]) -> list[str]:
+    # borg is started by nice/ionice/taskset, so the limits also apply to the ssh process it spawns
+    prefix = []
+    if "cpu_affinity" in config and has_binary("taskset"):
+        prefix.extend(["taskset", "--cpu-list", ",".join(str(cpu) for cpu in config["cpu_affinity"])])
+    if ("ionice_class" in config or "ionice_priority" in config) and has_binary("ionice"):
+        ionice_class = IONICE_CLASSES[config.get("ionice_class", "best-effort")]
+        prefix.extend(["ionice", "-c", str(ionice_class)])
+        if "ionice_priority" in config and ionice_class != IONICE_CLASSES["idle"]:
+            prefix.extend(["-n", str(config["ionice_priority"])])
+    if "nice" in config and has_binary("nice"):
+        prefix.extend(["nice", "-n", str(config["nice"])])
+    return prefix
+
+
+def apply_resource_limits(cmd: list[str], config: dict[str, Any]) -> list[str]:
+    cmd = list(cmd)
+    if config.get("upload_ratelimit"):
+        # common borg option (kiB/s), only used for remote repositories
+        cmd.insert(1, f"--upload-ratelimit={config['upload_ratelimit']}")
+    return get_governor_command(config) + cmd
+
+
+def split_upload_budget(configs: list[dict[str, Any]], budget: int, slots: int) -> None:
+    """Splits the global upload budget (kiB/s) between the borg processes that can run at the same time.
+
+    The share is an upper limit, a lower upload_ratelimit of a config file is kept."""
+    running = max(min(slots, len(configs)), 1)
+    share = max(budget // running, 1)
+    for config in configs:
+        config["upload_ratelimit"] = min(config.get("upload_ratelimit") or share, share)
+    logging.info(f"Upload budget of {budget} kiB/s: at most {share} kiB/s for each of {running} concurrent borg process(es)")
@@ -1,15 +1,11 @@
 import sys
 from pathlib import Path
-import subprocess
 import logging
-from ruamel.yaml import YAML
-import socket
 import os
 
 
 from typing import NoReturn, Tuple, Any
 from borgctl.utils import fail, get_conf_directory, update_config_sshkey
-from borgctl.wordlist import get_passphrase
 
 
 def get_version() -> str:
@@ -26,6 +22,8 @@ def show_config_files(config_filter: str) -> NoReturn:
 
 
 def run_ssh_key_gen(out_file: Path) -> None:
+    import socket
+    import subprocess
     user = os.getlogin()
     conf = out_file.name
     hostname = socket.gethostname()
@@ -55,18 +53,29 @@ def generate_ssh_key(config: dict[str, Any], config_file: Path) -> NoReturn:
     sys.exit(0)
 
 
-def parse_borg_repository(repository: str) -> Tuple[str, str | None, str | None]:
-    user = os.getlogin()
-    host = repo_dir = None
+def parse_borg_repository(repository: str) -> Tuple[str | None, str | None, str | None]:
+    """Returns user, host and directory of an ssh repository. For a local repository, all of them are None"""
+    user = host = repo_dir = None
     if repository.strip().startswith("ssh://"):
-        repository = repository.replace("ssh://", "")
-    if repository.count(":") != 1:
-        logging.warning(f"The repository '{repository}' does not use ssh")
-    else:
-        host, repo_dir = repository.split(":")
+        # ssh://user@host:port/path/to/repo
+        host, _, repo_dir = repository.strip().removeprefix("ssh://").partition("/")
         if "@" in host:
             user, host = host.split("@")
-    return user, host, repo_dir
+        return user or get_user(), host.split(":")[0], f"/{repo_dir}"
+    if repository.count(":") != 1:
+        logging.warning(f"The repository '{repository}' does not use ssh")
+        return None, None, None
+    host, repo_dir = repository.split(":")
+    if "@" in host:
+        user, host = host.split("@")
+    # no user in the repository: ssh uses the local user name
+    return user or get_user(), host, repo_dir
+
+
+def get_user() -> str:
+    # os.getlogin() needs a controlling terminal, which cron, systemd and borgctl daemon don't have
+    import getpass
+    return getpass.getuser()
 
 
 def generate_authorized_keys(config: dict[str, Any]) -> NoReturn:
@@ -100,6 +109,9 @@ def generate_authorized_keys(config: dict[str, Any]) -> NoReturn:
 
 
 def generate_default_config() -> None:
+    import socket
+    from ruamel.yaml import YAML
+    from borgctl.wordlist import get_passphrase
     config_template = Path(__file__).parent / "default.yml.template"
     yaml = YAML()
     yaml.default_flow_style = False
@@ -123,5 +135,6 @@ def generate_default_config() -> None:
 
 
 def generate_new_passphrase() -> None:
+    from borgctl.wordlist import get_passphrase
     print(get_passphrase())
     sys.exit(0)
@@ -0,0 +1,188 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, IO, NoReturn
+
+from borgctl.events import ArchiveStatsEvent, BorgEvent, BorgEventParser, format_size
+from borgctl.utils import get_log_directory
+
+
+# report a regression if the last run is this much worse than the median
+REGRESSION_FACTOR = 3
+# only commands that run regularly have trends. list, info, mount etc. are not recorded
+HISTORY_COMMANDS = ("create", "prune", "compact", "check")
+# about 5000 runs. If the file gets larger, the older half is dropped
+HISTORY_MAX_SIZE = 1024**2
+
+
+class StatsCollector:
+    """Event handler that remembers the stats of borg create --json"""
+
+    def __init__(self) -> None:
+        self.stats: ArchiveStatsEvent | None = None
+
+    def __call__(self, event: BorgEvent) -> None:
+        if isinstance(event, ArchiveStatsEvent):
+            self.stats = event
+
+
+class JsonStatsReader(threading.Thread):
+    """Reads the stdout of borg create --json (without --log-json).
+
+    With --json, borg writes the stats as json to stdout instead of the --stats table to the log (stderr),
+    so the log can be shown as usual while the stats are read here"""
+
+    def __init__(self, stdout: IO[Any]) -> None:
+        super().__init__(daemon=True)
+        self.stdout = stdout
+        self.output = ""
+
+    def run(self) -> None:
+        output = self.stdout.read()
+        self.output = output if isinstance(output, str) else output.decode(errors="replace")
+
+    def get_stats(self) -> BorgEvent:
+        self.join()
+        return BorgEventParser().parse_json_output(self.output)
+
+
+def get_history_file(config_file: Path) -> Path:
+    return get_log_directory() / f"borg_history_{config_file.stem}.jsonl"
+
+
+def record_run(config_file: Path, command: str, start: float, duration: float,
+               return_code: int, stats: ArchiveStatsEvent | None) -> None:
+    if command not in HISTORY_COMMANDS:
+        return
+    entry: dict[str, Any] = {
+        "time": datetime.datetime.fromtimestamp(start).isoformat(timespec="seconds"),
+        "command": command,
+        "duration": round(duration, 3),
+        "exit_code": return_code,
+    }
+    if stats:
+        entry.update({
+            "original_size": stats.original_size,
+            "compressed_size": stats.compressed_size,
+            "deduplicated_size": stats.deduplicated_size,
+            "nfiles": stats.nfiles,
+            "throughput": round(stats.original_size / 1000**2 / max(stats.duration or duration, 0.001), 3),
+        })
+    # one line per run, append only
+    history_file = get_history_file(config_file)
+    with history_file.open("a") as f:
+        f.write(json.dumps(entry) + "\n")
+        size = f.tell()
+    if size > HISTORY_MAX_SIZE:
+        truncate_history(history_file)
+
+
+def truncate_history(history_file: Path) -> None:
+    lines = history_file.read_text().splitlines(keepends=True)
+    tmp_file = history_file.with_name(f".{history_file.name}.{os.getpid()}.{time.monotonic_ns()}")
+    tmp_file.write_text("".join(lines[len(lines) // 2:]))
+    os.replace(tmp_file, history_file)
+    logging.debug(f"Dropped the oldest {len(lines) // 2} runs from {history_file}")
+
+
+def load_history(config_file: Path, days: int | None = None) -> list[dict[str, Any]]:
+    history_file = get_history_file(config_file)
+    if not history_file.exists():
+        return []
+    since = datetime.datetime.now() - datetime.timedelta(days=days) if days else None
+    runs = []
+    for line in history_file.read_text().splitlines():
+        try:
+            run = json.loads(line)
+            if since is None or datetime.datetime.fromisoformat(run["time"]) >= since:
+                runs.append(run)
+        except (ValueError, KeyError):
+            logging.warning(f"Ignoring invalid line in {history_file}: {line}")
+    return runs
+
+
+def percentile(values: list[float], percent: int) -> float:
+    # nearest-rank
+    values = sorted(values)
+    index = max(0, -(-percent * len(values) // 100) - 1)
+    return values[index]
+
+
+def summarize(runs: list[dict[str, Any]]) -> dict[str, Any]:
+    durations = [run["duration"] for run in runs]
+    summary: dict[str, Any] = {
+        "runs": len(runs),
+        "failed": len([run for run in runs if run["exit_code"] > 1]),
+        "last_duration": durations[-1],
+        "median_duration": statistics.median(durations),
+        "p90_duration": percentile(durations, 90),
+        "p95_duration": percentile(durations, 95),
+        "regressions": [],
+    }
+    with_stats = [run for run in runs if "original_size" in run]
+    if with_stats:
+        summary["last_throughput"] = with_stats[-1]["throughput"]
+        summary["median_throughput"] = statistics.median([run["throughput"] for run in with_stats])
+        summary["last_deduplicated_size"] = with_stats[-1]["deduplicated_size"]
+        summary["median_deduplicated_size"] = statistics.median([run["deduplicated_size"] for run in with_stats])
+        summary["last_nfiles"] = with_stats[-1]["nfiles"]
+
+    # compare the last run with the runs before
+    previous = runs[:-1]
+    if len(previous) >= 3:
+        median = statistics.median([run["duration"] for run in previous])
+        if median > 0 and runs[-1]["duration"] > REGRESSION_FACTOR * median:
+            summary["regressions"].append(f"took {runs[-1]['duration'] / median:.1f}x longer than its median ({median:.1f}s)")
+    previous_stats = with_stats[:-1]
+    if len(previous_stats) >= 3:
+        median = statistics.median([run["deduplicated_size"] for run in previous_stats])
+        if median > 0 and with_stats[-1]["deduplicated_size"] > REGRESSION_FACTOR * median:
+            summary["regressions"].append(f"added {with_stats[-1]['deduplicated_size'] / median:.1f}x more deduplicated data "
+                                          f"than its median ({format_size(median)})")
+        median = statistics.median([run["throughput"] for run in previous_stats])
+        if with_stats[-1]["throughput"] * REGRESSION_FACTOR < median:
+            summary["regressions"].append(f"throughput dropped to {with_stats[-1]['throughput']:.1f} MB/s "
+                                          f"(median {median:.1f} MB/s)")
+    return summary
+
+
+def show_stats(config_files: list[Path], cli_arguments: list[str]) -> NoReturn:
+    parser = argparse.ArgumentParser(prog="borgctl stats", description="show duration and size trends of past borg runs")
+    parser.add_argument("--days", type=int, default=30, help="only use runs of the last DAYS days (default: 30)")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args(cli_arguments)
+
+    report: dict[str, dict[str, Any]] = {}
+    for config_file in config_files:
+        runs = load_history(config_file, args.days)
+        commands = sorted(set(run["command"] for run in runs))
+        report[config_file.stem] = {command: summarize([run for run in runs if run["command"] == command])
+                                    for command in commands}
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+        sys.exit(0)
+
+    for config, summaries in report.items():
+        print(f"{config} (last {args.days} days)")
+        if not summaries:
+            print("  no runs recorded")
+        for command, summary in summaries.items():
+            print(f"  {command}: {summary['runs']} runs, {summary['failed']} failed, "
+                  f"duration last {summary['last_duration']:.1f}s median {summary['median_duration']:.1f}s "
+                  f"p90 {summary['p90_duration']:.1f}s p95 {summary['p95_duration']:.1f}s")
+            if "last_throughput" in summary:
+                print(f"  {' ' * len(command)}  throughput last {summary['last_throughput']:.1f} MB/s "
+                      f"median {summary['median_throughput']:.1f} MB/s, deduplicated size last "
+                      f"{format_size(summary['last_deduplicated_size'])} median "
+                      f"{format_size(summary['median_deduplicated_size'])}, {summary['last_nfiles']} files")
+            for regression in summary["regressions"]:
+                logging.warning(f"{config}: {command} {regression}")
+    sys.exit(0)
@@ -0,0 +1,150 @@
+import atexit
+import configparser
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+from pathlib import Path
+from typing import Any
+
+from borgctl.utils import current_config, get_log_directory
+
+
+LOG_COMPRESSIONS = ("none", "gzip", "zstd")
+LOG_FORMATS = ("text", "json")
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# settings of the [borgctl] section of logging.conf
+settings = {"compression": "none", "format": "text", "per_config": False}
+
+
+class ConfigFilter(logging.Filter):
+    """Adds the name of the config file the logging thread works on to the record.
+
+    Filters of the QueueHandler run in the thread that logs, the handlers in the thread of the QueueListener"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.config = current_config.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One json object per line, for log shippers"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "config": getattr(record, "config", None),
+            "message": record.getMessage().lstrip("\a"),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def compress_log_file(source: str, dest: str) -> None:
+    # runs in the thread of the QueueListener, so borgctl does not wait for it
+    if dest.endswith(".zst"):
+        import subprocess
+        try:
+            subprocess.run(["zstd", "-q", "-f", "--rm", "-o", dest, source], check=True, capture_output=True)
+            return
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.getLogger(__name__).warning(f"Could not compress {source} with zstd: {e}")
+            # keep the log, even if it's not compressed
+            os.replace(source, dest.removesuffix(".zst"))
+            return
+    import gzip
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def setup_handler(handler: logging.Handler) -> logging.Handler:
+    if settings["format"] == "json":
+        handler.setFormatter(JsonFormatter())
+    if settings["compression"] != "none" and isinstance(handler, logging.handlers.RotatingFileHandler):
+        suffix = COMPRESSION_SUFFIXES[str(settings["compression"])]
+        handler.namer = lambda name: name + suffix
+        handler.rotator = compress_log_file
+    return handler
+
+
+class ConfigFileHandler(logging.Handler):
+    """Writes the records of every config file to its own log file (borg_$config.log), so a
+    noisy config does not rotate away the log of the others"""
+
+    def __init__(self, max_bytes: int, backup_count: int) -> None:
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.handlers: dict[str, logging.Handler] = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        config = getattr(record, "config", None)
+        if config is None:
+            return
+        if config not in self.handlers:
+            handler = logging.handlers.RotatingFileHandler(get_config_log_file(config), "a", self.max_bytes, self.backup_count)
+            handler.setFormatter(self.formatter)
+            self.handlers[config] = setup_handler(handler)
+        self.handlers[config].handle(record)
+
+    def close(self) -> None:
+        for handler in self.handlers.values():
+            handler.close()
+        super().close()
+
+
+def get_config_log_file(config: str) -> Path:
+    return get_log_directory() / f"borg_{config}.log"
+
+
+def read_settings(parser: configparser.ConfigParser) -> None:
+    if not parser.has_section("borgctl"):
+        return
+    section = parser["borgctl"]
+    compression = section.get("compression", "none")
+    log_format = section.get("format", "text")
+    if compression not in LOG_COMPRESSIONS:
+        raise ValueError(f"compression in [borgctl] must be one of {', '.join(LOG_COMPRESSIONS)}")
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"format in [borgctl] must be one of {', '.join(LOG_FORMATS)}")
+    settings.update(compression=compression, format=log_format, per_config=section.getboolean("per_config", False))
+
+
+def start_queue_logging() -> None:
+    """Moves the file handlers of the root logger behind a queue, so logging never waits for the disk
+    (or for rotating and compressing). The console handler stays, its output is mixed with borg's"""
+    if settings["compression"] == "zstd" and shutil.which("zstd") is None:
+        logging.warning("'zstd' not found. Compressing rotated log files with gzip")
+        settings["compression"] = "gzip"
+    root = logging.getLogger()
+    handlers: list[logging.Handler] = []
+    max_bytes, backup_count = 1024**3, 1
+    for handler in list(root.handlers):
+        if type(handler) is logging.StreamHandler:
+            continue
+        if isinstance(handler, logging.handlers.RotatingFileHandler):
+            max_bytes, backup_count = handler.maxBytes, handler.backupCount
+        root.removeHandler(handler)
+        handlers.append(setup_handler(handler))
+    if settings["per_config"]:
+        config_handler = ConfigFileHandler(max_bytes, backup_count)
+        config_handler.setLevel(logging.INFO)
+        config_handler.setFormatter(handlers[0].formatter if handlers else logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        handlers.append(config_handler)
+    if not handlers:
+        return
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ConfigFilter())
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # stop() writes the remaining records
+    atexit.register(listener.stop)
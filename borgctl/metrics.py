@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+from borgctl.events import ArchiveStatsEvent
+from borgctl.utils import get_log_directory
+
+
+METRICS = [
+    # name, key in the metrics state file, help text
+    ("borgctl_last_success_timestamp_seconds", "last_success", "Unix time of the last successful run (exit code 0 or 1)"),
+    ("borgctl_last_run_timestamp_seconds", "last_run", "Unix time of the last run"),
+    ("borgctl_last_duration_seconds", "duration", "Duration of the last run"),
+    ("borgctl_last_exit_code", "exit_code", "Exit code of the last run"),
+    ("borgctl_consecutive_failures", "consecutive_failures", "Number of failed runs (exit code > 1) since the last successful one"),
+    ("borgctl_last_original_bytes", "original_size", "Original size of the last created archive"),
+    ("borgctl_last_deduplicated_bytes", "deduplicated_size", "Deduplicated size of the last created archive"),
+]
+
+
+def get_metrics_state_file(config_file: Path) -> Path:
+    return get_log_directory() / f"borg_metrics_{config_file.stem}.json"
+
+
+def update_metrics(config: dict[str, Any], config_file: Path, command: str, start: float, duration: float,
+                   return_code: int, stats: ArchiveStatsEvent | None) -> None:
+    state_file = get_metrics_state_file(config_file)
+    state: dict[str, dict[str, Any]] = {}
+    if state_file.exists():
+        try:
+            state = json.loads(state_file.read_text())
+        except ValueError:
+            logging.warning(f"Could not parse {state_file}. Starting with fresh metrics")
+
+    metrics = state.setdefault(command, {"consecutive_failures": 0})
+    metrics["last_run"] = round(start + duration, 3)
+    metrics["duration"] = round(duration, 3)
+    metrics["exit_code"] = return_code
+    if return_code > 1:
+        metrics["consecutive_failures"] += 1
+    else:
+        metrics["last_success"] = metrics["last_run"]
+        metrics["consecutive_failures"] = 0
+    if stats:
+        metrics["original_size"] = stats.original_size
+        metrics["deduplicated_size"] = stats.deduplicated_size
+
+    prom_file = Path(config["prometheus_textfile_dir"]).expanduser() / f"borgctl_{config_file.stem}.prom"
+    try:
+        write_atomically(state_file, json.dumps(state, indent=4))
+        write_atomically(prom_file, render_metrics(config_file.stem, state))
+    except OSError as e:
+        # borg already finished, missing metrics must not turn the run into a failed one
+        logging.warning(f"Could not write the metrics to {prom_file}: {e}")
+
+
+def escape_label_value(value: str) -> str:
+    # text format of node_exporter/prometheus
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics(config_name: str, state: dict[str, dict[str, Any]]) -> str:
+    lines = []
+    for name, key, description in METRICS:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for command, metrics in sorted(state.items()):
+            if key in metrics:
+                labels = f'config="{escape_label_value(config_name)}",command="{escape_label_value(command)}"'
+                lines.append(f'{name}{{{labels}}} {metrics[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_atomically(out_file: Path, content: str) -> None:
+    # node_exporter must never see a half written file
+    tmp_file = out_file.with_name(f".{out_file.name}.{os.getpid()}.{time.monotonic_ns()}")
+    try:
+        tmp_file.write_text(content)
+        tmp_file.chmod(0o644)
+        os.replace(tmp_file, out_file)
+    except OSError:
+        tmp_file.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,245 @@
+import logging
+import os
+import re
+from fnmatch import translate as fnmatch_translate
+from pathlib import Path
+from typing import Any
+
+
+# pattern styles of borg (borg help patterns). --exclude uses fm: if there is no prefix
+PATTERN_STYLES = ("fm", "sh", "re", "pp", "pf")
+DEFAULT_EXCLUDE_STYLE = "fm"
+
+
+def shell_translate(pattern: str) -> str:
+    # same as borg.shellpattern.translate: * and ? don't match /, **/ matches any number of directories
+    result = ""
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            if i + 1 < n and pattern[i] == "*" and pattern[i + 1] == "/":
+                result += r"(?:[^/]*/)*"
+                i += 2
+            else:
+                result += r"[^/]*"
+        elif c == "?":
+            result += r"[^/]"
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                result += "\\["
+            else:
+                stuff = pattern[i:j].replace("\\", "\\\\")
+                i = j + 1
+                if stuff[0] == "!":
+                    stuff = "^" + stuff[1:]
+                elif stuff[0] == "^":
+                    stuff = "\\" + stuff
+                result += f"[{stuff}]"
+        else:
+            result += re.escape(c)
+    return "(?ms)" + result + r"\Z"
+
+
+class Pattern:
+    """A borg exclude pattern. Paths are matched like borg does: relative, without a leading /"""
+
+    def __init__(self, pattern: str, default_style: str = DEFAULT_EXCLUDE_STYLE) -> None:
+        self.original = pattern
+        self.style = default_style
+        if len(pattern) > 2 and pattern[2] == ":" and pattern[:2] in PATTERN_STYLES:
+            self.style, pattern = pattern[:2], pattern[3:]
+        self.pattern = pattern
+        self.regex: re.Pattern[str] | None = None
+
+        if self.style in ("pp", "pf"):
+            self.path = os.path.normpath(pattern).lstrip("/")
+        elif self.style in ("fm", "sh"):
+            wildcard = "*" if self.style == "fm" else "**/*"
+            if pattern.endswith("/"):
+                pattern = os.path.normpath(pattern).rstrip("/") + f"/{wildcard}/"
+            else:
+                pattern = os.path.normpath(pattern) + f"/{wildcard}"
+            pattern = pattern.lstrip("/")
+            # compiled when it's used, compile_excludes turns most of them into pp: patterns
+            self.regex_source = fnmatch_translate(pattern) if self.style == "fm" else shell_translate(pattern)
+        else:
+            self.regex = re.compile(pattern)
+
+    def match(self, path: str) -> bool:
+        # path must be normalized and without leading /
+        if self.style == "pp":
+            return path == self.path or path.startswith(self.path + "/")
+        elif self.style == "pf":
+            return path == self.path
+        if self.regex is None:
+            self.regex = re.compile(self.regex_source)
+        if self.style == "re":
+            return self.regex.search(path) is not None
+        return self.regex.match(path + "/") is not None
+
+    def __repr__(self) -> str:
+        return f"{self.style}:{self.pattern}"
+
+
+class PatternMatcher:
+
+    def __init__(self, excludes: list[str] | list[Pattern]) -> None:
+        self.patterns = [exclude if isinstance(exclude, Pattern) else Pattern(exclude) for exclude in excludes]
+
+    def first_match(self, path: str) -> Pattern | None:
+        for pattern in self.patterns:
+            if pattern.match(path):
+                return pattern
+        return None
+
+    def excluded(self, path: str) -> bool:
+        return self.first_match(path) is not None
+
+
+def archive_path(path: str) -> str:
+    # borg stores paths without the leading /
+    return os.path.normpath(path).lstrip("/")
+
+
+def get_create_excludes(config: dict[str, Any]) -> list[str]:
+    # the excludes as they are passed to borg create
+    return [Path(exclude).expanduser().as_posix() for exclude in config["borg_create_excludes"]]
+
+
+def get_create_backup_dirs(config: dict[str, Any]) -> list[Path]:
+    return [Path(backup_dir).expanduser() for backup_dir in config["borg_create_backup_dirs"]]
+
+
+def get_create_arguments(config: dict[str, Any]) -> list[str]:
+    # borg_create_arguments may contain several arguments per entry (--keep-last 10)
+    return [word for argument in config.get("borg_create_arguments", []) for word in argument.split()]
+
+
+def has_wildcards(pattern: str) -> bool:
+    return any(c in pattern for c in "*?[")
+
+
+def optimize_pattern(pattern: Pattern) -> Pattern:
+    # fm:/sh: without wildcards match the path and everything below it, like the much cheaper pp:
+    if pattern.style in ("fm", "sh") and not has_wildcards(pattern.pattern) and not pattern.pattern.endswith("/"):
+        optimized = Pattern(f"pp:{os.path.normpath(pattern.pattern)}")
+        optimized.original = pattern.original
+        return optimized
+    return pattern
+
+
+def has_excluded_parent(path: str, prefixes: set[str]) -> bool:
+    # looks up the parents instead of comparing with every prefix, there may be thousands of excludes
+    parent = os.path.dirname(path)
+    while parent:
+        if parent in prefixes:
+            return True
+        parent = os.path.dirname(parent)
+    return False
+
+
+def compile_excludes(excludes: list[str]) -> list[Pattern]:
+    """Returns the excludes as optimized, deduplicated and ordered patterns.
+
+    All excludes have the same effect (the path is excluded), so the order does not matter for the
+    result. borg stops at the first matching pattern, so the cheap ones come first."""
+    patterns: dict[str, Pattern] = {}
+    for exclude in excludes:
+        pattern = optimize_pattern(Pattern(exclude))
+        key = f"{pattern.style}:{pattern.path}" if pattern.style in ("pp", "pf") else repr(pattern)
+        if key in patterns:
+            logging.debug(f"Ignoring duplicate exclude {exclude}")
+            continue
+        patterns[key] = pattern
+
+    prefixes = {pattern.path for pattern in patterns.values() if pattern.style == "pp"}
+    compiled = []
+    for pattern in patterns.values():
+        if pattern.style in ("pp", "pf") and has_excluded_parent(pattern.path, prefixes):
+            logging.debug(f"Ignoring exclude {pattern.original}: already excluded by a parent directory")
+            continue
+        compiled.append(pattern)
+    order = {"pf": 0, "pp": 1, "fm": 2, "sh": 3, "re": 4}
+    return sorted(compiled, key=lambda pattern: order[pattern.style])
+
+
+def get_local_path(path: str, backup_dirs: list[Path]) -> Path | None:
+    """Returns the file the archive path was read from or None if it is not in one of the backup directories"""
+    for backup_dir in backup_dirs:
+        root = archive_path(backup_dir.as_posix())
+        if root == ".":
+            return backup_dir / path
+        if path == root:
+            return backup_dir
+        if path.startswith(root + "/"):
+            return backup_dir / path.removeprefix(root + "/")
+    return None
+
+
+def check_excludes(patterns: list[Pattern], backup_dirs: list[Path]) -> None:
+    # only for pp: and pf: (cheap). --explain shows how many files every pattern excludes
+    for pattern in patterns:
+        if pattern.style not in ("pp", "pf"):
+            continue
+        local_path = get_local_path(pattern.path, backup_dirs)
+        if local_path is None:
+            logging.warning(f"Exclude {pattern.original} is not in one of the backup directories")
+        elif not local_path.exists():
+            logging.warning(f"Exclude {pattern.original} does not exist")
+
+
+def format_pattern(pattern: Pattern) -> str:
+    if pattern.style in ("pp", "pf"):
+        return f"{pattern.style}:/{pattern.path}"
+    return f"{pattern.style}:{pattern.pattern}"
+
+
+def write_patterns_file(config: dict[str, Any], patterns_file: Path) -> None:
+    patterns = compile_excludes(get_create_excludes(config))
+    check_excludes(patterns, get_create_backup_dirs(config))
+    # ! is exclude without recursing into the directory, the same as --exclude
+    lines = [f"! {format_pattern(pattern)}" for pattern in patterns]
+    tmp_file = patterns_file.with_name(f".{patterns_file.name}.{os.getpid()}")
+    tmp_file.write_text("\n".join(lines) + "\n")
+    os.replace(tmp_file, patterns_file)
+
+
+def explain_excludes(config: dict[str, Any], config_file: Path) -> None:
+    # avoid a circular import
+    from borgctl.events import format_size
+    from borgctl.scan import walk
+    excludes = get_create_excludes(config)
+    patterns = compile_excludes(excludes)
+    check_excludes(patterns, get_create_backup_dirs(config))
+    matcher = PatternMatcher(patterns)
+    counts = {id(pattern): [0, 0] for pattern in patterns}
+    total_files, total_size = 0, 0
+
+    one_file_system = "--one-file-system" in get_create_arguments(config)
+    for _, entries in walk(get_create_backup_dirs(config), None, one_file_system):
+        for entry in entries:
+            if entry.is_dir:
+                continue
+            total_files += 1
+            total_size += entry.size
+            pattern = matcher.first_match(archive_path(entry.path))
+            if pattern:
+                counts[id(pattern)][0] += 1
+                counts[id(pattern)][1] += entry.size
+
+    print(f"{config_file.stem}: {len(excludes)} excludes compiled to {len(patterns)} patterns, "
+          f"{total_files} files ({format_size(total_size)}) in the backup directories")
+    for pattern in patterns:
+        files, size = counts[id(pattern)]
+        compiled = format_pattern(pattern)
+        note = "  excludes nothing" if files == 0 else ""
+        print(f"  {compiled:<50} {files:>10} files {format_size(size):>12}  (from {pattern.original}){note}")
@@ -0,0 +1,151 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, NoReturn
+
+from borgctl.events import format_size
+from borgctl.history import REGRESSION_FACTOR, load_history
+from borgctl.patterns import PatternMatcher, compile_excludes, get_create_excludes, get_create_backup_dirs, \
+    get_create_arguments
+from borgctl.scan import walk
+from borgctl.utils import load_config, get_log_directory, format_duration
+
+
+def scan_backup_dirs(config: dict[str, Any], depth: int) -> dict[str, Any]:
+    roots = [backup_dir.as_posix() for backup_dir in get_create_backup_dirs(config)]
+    matcher = PatternMatcher(compile_excludes(get_create_excludes(config)))
+    one_file_system = "--one-file-system" in get_create_arguments(config)
+
+    start = time.time()
+    files, dirs, total_size = 0, 0, 0
+    dir_sizes: dict[str, int] = {}
+    for path, entries in walk([Path(root) for root in roots], matcher, one_file_system):
+        dirs += 1
+        size = 0
+        for entry in entries:
+            if not entry.is_dir:
+                files += 1
+                size += entry.size
+        total_size += size
+        dir_sizes[path] = dir_sizes.get(path, 0) + size
+
+    # add the size of every directory to its parents (up to depth levels below the backup dir)
+    subtrees: dict[str, int] = {}
+    for path, size in dir_sizes.items():
+        root = max((root for root in roots if path == root or path.startswith(root.rstrip("/") + "/")), key=len, default=None)
+        if root is None:
+            continue
+        parts = Path(path).relative_to(root).parts
+        for level in range(1, min(len(parts), depth) + 1):
+            subtree = os.path.join(root, *parts[:level])
+            subtrees[subtree] = subtrees.get(subtree, 0) + size
+    return {
+        "files": files,
+        "directories": dirs,
+        "size": total_size,
+        "scan_duration": round(time.time() - start, 3),
+        "subtrees": subtrees,
+    }
+
+
+# a create that added at least this share of its original size as new data is like a first (full) backup
+FULL_RUN_RATIO = 0.5
+
+
+def is_successful_create(run: dict[str, Any]) -> bool:
+    return run["command"] == "create" and "throughput" in run and run["exit_code"] <= 1
+
+
+def load_create_runs(config_file: Path) -> list[dict[str, Any]]:
+    runs = [run for run in load_history(config_file, 90) if is_successful_create(run)]
+    if runs:
+        return runs
+    # no history for this config yet: use the throughput of the other configs on this host
+    for history_file in sorted(get_log_directory().glob("borg_history_*.jsonl")):
+        other_config = Path(history_file.stem.removeprefix("borg_history_") + ".yml")
+        runs.extend(run for run in load_history(other_config, 90) if is_successful_create(run))
+    return runs
+
+
+def predict_duration(size: int, runs: list[dict[str, Any]]) -> tuple[float, float, int, bool]:
+    """Returns the predicted duration of a first create of size bytes, the median throughput (MB/s) and the
+    number of runs it is based on and if the prediction is only a lower bound.
+
+    Incremental creates don't read unchanged files again, their throughput (original size per second) is
+    much higher than the one of the first create. Only runs that added most of their data are used. Without
+    such runs, the prediction is based on the incremental ones and the first create takes longer"""
+    full_runs = [run for run in runs if run["deduplicated_size"] >= FULL_RUN_RATIO * run["original_size"]]
+    used_runs = full_runs or runs
+    throughput = statistics.median(run["throughput"] for run in used_runs)
+    return round(size / 1000**2 / max(throughput, 0.001), 1), throughput, len(used_runs), not full_runs
+
+
+def make_plan(config: dict[str, Any], config_file: Path, depth: int, top: int) -> dict[str, Any]:
+    scan = scan_backup_dirs(config, depth)
+    largest = sorted(scan.pop("subtrees").items(), key=lambda item: item[1], reverse=True)[:top]
+    plan: dict[str, Any] = dict(scan, largest=[{"path": path, "size": size} for path, size in largest])
+
+    runs = load_create_runs(config_file)
+    if runs:
+        own_runs = [run for run in load_history(config_file, 90) if is_successful_create(run)]
+        duration, throughput, history_runs, lower_bound = predict_duration(scan["size"], runs)
+        plan["median_throughput"] = throughput
+        plan["history_runs"] = history_runs
+        plan["predicted_duration"] = duration
+        plan["prediction_is_lower_bound"] = lower_bound
+        if own_runs:
+            plan["last_original_size"] = own_runs[-1]["original_size"]
+            plan["last_nfiles"] = own_runs[-1]["nfiles"]
+    return plan
+
+
+def print_plan(config_name: str, plan: dict[str, Any]) -> None:
+    print(f"{config_name}: {plan['files']} files in {plan['directories']} directories, {format_size(plan['size'])} "
+          f"(scanned in {plan['scan_duration']:.1f}s)")
+    if plan["largest"]:
+        print("  largest directories:")
+        for subtree in plan["largest"]:
+            print(f"  {format_size(subtree['size']):>12}  {subtree['path']}")
+    if "last_original_size" in plan:
+        growth = plan["size"] - plan["last_original_size"]
+        print(f"  last archive: {format_size(plan['last_original_size'])}, {plan['last_nfiles']} files "
+              f"({'+' if growth >= 0 else '-'}{format_size(abs(growth))})")
+        if plan["last_original_size"] and plan["size"] > REGRESSION_FACTOR * plan["last_original_size"]:
+            logging.warning(f"{config_name}: the backup directories are {plan['size'] / plan['last_original_size']:.1f}x "
+                            "larger than the last archive")
+    if "predicted_duration" in plan and plan["prediction_is_lower_bound"]:
+        print(f"  median throughput of incremental creates {plan['median_throughput']:.1f} MB/s ({plan['history_runs']} runs): "
+              f"at least {format_duration(plan['predicted_duration'])} for {format_size(plan['size'])}")
+    elif "predicted_duration" in plan:
+        print(f"  median throughput of full creates {plan['median_throughput']:.1f} MB/s ({plan['history_runs']} runs): "
+              f"about {format_duration(plan['predicted_duration'])} for {format_size(plan['size'])}")
+    else:
+        print("  no create runs in the history, can't predict the duration")
+
+
+def show_plan(config_files: list[Path], cli_arguments: list[str]) -> NoReturn:
+    parser = argparse.ArgumentParser(prog="borgctl plan", description="estimate file count, size and duration of borg create")
+    parser.add_argument("--depth", type=int, default=3, help="show directories up to DEPTH levels below the backup directories (default: 3)")
+    parser.add_argument("--top", type=int, default=10, help="number of largest directories to show (default: 10)")
+    parser.add_argument("--json", action="store_true", help="print the plan as json")
+    args = parser.parse_args(cli_arguments)
+
+    report = {}
+    for config_file in config_files:
+        _, config = load_config(config_file)
+        report[config_file.stem] = make_plan(config, config_file, args.depth, args.top)
+        for backup_dir in get_create_backup_dirs(config):
+            if not backup_dir.exists():
+                logging.warning(f"Backup directory {backup_dir} does not exist")
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        for config_name, plan in report.items():
+            print_plan(config_name, plan)
+    sys.exit(0)
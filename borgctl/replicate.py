@@ -0,0 +1,132 @@
+import logging
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Any
+
+from borgctl.utils import fail
+
+
+# rsync: "some files vanished before they could be transferred" (borg compact deleted a segment)
+RSYNC_VANISHED = 24
+# rsync: "partial transfer due to error", like a source that does not exist
+RSYNC_PARTIAL = 23
+
+
+def get_local_repository(config: dict[str, Any]) -> str:
+    repository: str = config["repository"].strip().removeprefix("file://")
+    if not repository.startswith("/"):
+        fail("'replicate_to' needs a local repository (the primary copy)")
+    return repository.rstrip("/") + "/"
+
+
+def get_rsync_command(config: dict[str, Any], env: dict[str, str], *options: str) -> list[str]:
+    rsync = shutil.which("rsync")
+    if rsync is None:
+        fail("'rsync' not found. It's needed for replicate_to")
+    # the copy must not be locked forever: borg with-lock holds the lock while rsync runs
+    cmd = [rsync, "--archive", "--partial", "--exclude=/lock.exclusive", "--exclude=/lock.roster", *options]
+    if "BORG_RSH" in env:
+        # same ssh key (and options) as borg
+        cmd.append(f"--rsh={env['BORG_RSH']}")
+    if config.get("upload_ratelimit"):
+        # both in kiB/s
+        cmd.append(f"--bwlimit={config['upload_ratelimit']}")
+    return cmd
+
+
+def run(cmd: list[str], env: dict[str, str], output_prefix: str, **kwargs: Any) -> "subprocess.CompletedProcess[str]":
+    logging.info(f"{output_prefix}Executing: {' '.join(cmd)}")
+    return subprocess.run(cmd, env=env, text=True, **kwargs)
+
+
+def get_repository_id(config_file: str) -> str | None:
+    import configparser
+    parser = configparser.ConfigParser()
+    try:
+        parser.read_string(Path(config_file).read_text())
+        return parser.get("repository", "id")
+    except (OSError, configparser.Error):
+        return None
+
+
+def check_destination(config: dict[str, Any], env: dict[str, str], repository: str, destination: str, output_prefix: str) -> bool:
+    """rsync --delete deletes everything else in the destination. So it must not exist yet, be empty or
+    be a copy of the repository (a borg config with the same repository id)"""
+    p = run(get_rsync_command(config, env, "--no-recursive", "--dirs", "--list-only") + [destination], env, output_prefix,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode == RSYNC_PARTIAL and "No such file or directory" in p.stderr:
+        return True
+    if p.returncode != 0:
+        logging.error(f"{output_prefix}Could not list {destination} (exit code {p.returncode}): {p.stderr.strip()}")
+        return False
+    # like ls -l: permissions, size, date, time, name
+    if all(line.split(None, 4)[-1] == "." for line in p.stdout.splitlines() if line.strip()):
+        return True
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        p = run(get_rsync_command(config, env) + [f"{destination}config", tmp_dir], env, output_prefix, stderr=subprocess.PIPE)
+        destination_id = get_repository_id(f"{tmp_dir}/config") if p.returncode == 0 else None
+    if destination_id is None or destination_id != get_repository_id(f"{repository}config"):
+        logging.error(f"{output_prefix}{destination} is not empty and not a copy of {repository}. Not replicating to it, "
+                      "rsync --delete would delete its content")
+        return False
+    return True
+
+
+def replicate_repository(config: dict[str, Any], env: dict[str, str], destination: str, output_prefix: str = "") -> int:
+    """Brings the copy of the repository at destination up to date.
+
+    borg only adds segment files (and compact deletes them), so rsync copies only the new ones. The repository
+    is copied without the lock first, then everything is synced again while borg with-lock holds the lock,
+    so the copy is consistent and borg is only blocked for the (short) second run. With replicate_check,
+    borg check reads the whole copy afterwards"""
+    repository = get_local_repository(config)
+    destination = destination.rstrip("/") + "/"
+
+    logging.info(f"{output_prefix}Replicating {repository} to {destination}")
+    if not check_destination(config, env, repository, destination, output_prefix):
+        return 2
+    # the whole repository, not only data/: rsync only creates the last directory of the destination
+    p = run(get_rsync_command(config, env) + [repository, destination], env, output_prefix)
+    if p.returncode not in (0, RSYNC_VANISHED):
+        logging.error(f"{output_prefix}Copying the segments to {destination} failed with exit code {p.returncode}")
+        return 2
+
+    with_lock = [config["borg_binary"], "with-lock", repository.rstrip("/")]
+    rsync = get_rsync_command(config, env, "--delete")
+    p = run(with_lock + rsync + [repository, destination], env, output_prefix)
+    if p.returncode != 0:
+        logging.error(f"{output_prefix}Replicating to {destination} failed with exit code {p.returncode}")
+        return 2
+
+    # validate: a second run must not find any difference (size and mtime, segments never change)
+    p = run(with_lock + rsync + ["--dry-run", "--itemize-changes", repository, destination], env, output_prefix,
+            stdout=subprocess.PIPE)
+    differences = [line for line in p.stdout.splitlines() if line and not line.startswith(".d")]
+    if p.returncode != 0 or differences:
+        logging.error(f"{output_prefix}The copy at {destination} differs from {repository}: {', '.join(differences[:5])}")
+        return 2
+    if config.get("replicate_check", True):
+        # the dry run only compares size and mtime. borg checks the crc32 of every segment entry of the copy
+        # (without the key/passphrase)
+        p = run([config["borg_binary"], "check", "--repository-only", destination.rstrip("/")], env, output_prefix)
+        if p.returncode > 1:
+            logging.error(f"{output_prefix}borg check of {destination} failed with exit code {p.returncode}")
+            return 2
+    logging.info(f"{output_prefix}Replicated {repository} to {destination}")
+    return 0
+
+
+def replicate(config: dict[str, Any], env: dict[str, str], config_file: Path, output_prefix: str = "") -> int:
+    from borgctl.state import update_state_index
+    if not config.get("replicate_to"):
+        fail(f"No 'replicate_to' in {config_file}")
+    return_code = 0
+    for destination in config["replicate_to"]:
+        ret = replicate_repository(config, env, destination, output_prefix)
+        return_code = ret if ret > return_code else return_code
+    # for monitoring, like the state_commands
+    update_state_index(config_file.stem, "replicate", return_code)
+    return return_code
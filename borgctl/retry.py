@@ -0,0 +1,57 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any
+
+from borgctl.events import BorgEvent, LogEvent
+from borgctl.utils import parse_duration
+
+
+# errors that usually go away by themselves. Other errors (wrong passphrase, full disk, ...) would only fail again
+DEFAULT_RETRY_MSGIDS = ["LockTimeout", "ConnectionClosed", "ConnectionClosedWithHint"]
+DEFAULT_RETRY_BACKOFF = "1m"
+
+
+@dataclass
+class RetryPolicy:
+    attempts: int
+    exit_codes: list[int]
+    msgids: list[str]
+    backoff: float
+    max_time: float
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any]) -> "RetryPolicy":
+        return cls(config.get("retry_attempts", 0),
+                   config.get("retry_exit_codes", []),
+                   config.get("retry_msgids", DEFAULT_RETRY_MSGIDS),
+                   parse_duration(config.get("retry_backoff", DEFAULT_RETRY_BACKOFF)),
+                   parse_duration(config.get("retry_max_time", 0)))
+
+    def get_delay(self, return_code: int, attempt: int, elapsed: float, msgids: list[str]) -> float | None:
+        """Returns the time to wait before the next attempt or None if borg should not be run again.
+
+        borg is run again if it failed with one of the msgids or (opt-in) one of the exit codes"""
+        if attempt >= self.attempts:
+            return None
+        if return_code not in self.exit_codes:
+            if return_code <= 1:
+                return None
+            if not set(self.msgids) & set(msgids):
+                logging.info(f"Not retrying: borg failed with {', '.join(msgids) or 'an unknown error'}, not one of retry_msgids")
+                return None
+        # exponential backoff: backoff, 2 * backoff, 4 * backoff, ...
+        delay: float = self.backoff * 2**attempt
+        if self.max_time and elapsed + delay >= self.max_time:
+            logging.info(f"Not retrying: retry_max_time ({self.max_time:.0f}s) would be exceeded")
+            return None
+        return delay
+
+
+@dataclass
+class ErrorCollector:
+    """Event handler that remembers the msgids of the errors borg logged (--log-json)"""
+    msgids: list[str] = field(default_factory=list)
+
+    def __call__(self, event: BorgEvent) -> None:
+        if isinstance(event, LogEvent) and event.level in ("ERROR", "CRITICAL") and event.msgid:
+            self.msgids.append(event.msgid)
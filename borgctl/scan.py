@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import os
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator
+
+from borgctl.patterns import PatternMatcher, archive_path, get_create_excludes, get_create_backup_dirs, \
+    get_create_arguments, compile_excludes
+from borgctl.utils import get_log_directory, parse_duration
+
+
+# os.scandir and lstat release the GIL, so threads help a lot on network file systems and SSDs
+DEFAULT_SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+@dataclass
+class ScanEntry:
+    name: str
+    path: str
+    is_dir: bool
+    size: int
+    mtime_ns: int
+    ctime_ns: int
+    inode: int
+    dev: int
+
+
+def scan_directory(path: str, matcher: PatternMatcher | None) -> tuple[str, list[ScanEntry]]:
+    entries = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if matcher and matcher.excluded(archive_path(entry.path)):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    # vanished or no permissions
+                    continue
+                entries.append(ScanEntry(entry.name, entry.path, stat.S_ISDIR(st.st_mode), st.st_size,
+                                         st.st_mtime_ns, st.st_ctime_ns, st.st_ino, st.st_dev))
+    except OSError as e:
+        logging.debug(f"Could not scan {path}: {e}")
+    return path, entries
+
+
+def walk(roots: list[Path], matcher: PatternMatcher | None = None, one_file_system: bool = False,
+         workers: int = DEFAULT_SCAN_WORKERS) -> Iterator[tuple[str, list[ScanEntry]]]:
+    """Walks the roots like borg create does (excludes, --one-file-system, no symlinks followed).
+
+    Directories are scanned by a thread pool. Yields every directory with its (not excluded) entries,
+    the order is not defined. A root that is a file is yielded as its parent with only this entry."""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="borgctl-scan") as executor:
+        pending: dict[Future[tuple[str, list[ScanEntry]]], int] = {}
+        for root in roots:
+            root_path = root.as_posix()
+            if matcher and matcher.excluded(archive_path(root_path)):
+                continue
+            try:
+                st = os.lstat(root_path)
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                pending[executor.submit(scan_directory, root_path, matcher)] = st.st_dev
+            else:
+                yield os.path.dirname(root_path), [ScanEntry(root.name, root_path, False, st.st_size, st.st_mtime_ns,
+                                                             st.st_ctime_ns, st.st_ino, st.st_dev)]
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                root_dev = pending.pop(future)
+                path, entries = future.result()
+                for entry in entries:
+                    if entry.is_dir and (not one_file_system or entry.dev == root_dev):
+                        pending[executor.submit(scan_directory, entry.path, matcher)] = root_dev
+                yield path, entries
+
+
+def get_scan_index_file(config_file: Path) -> Path:
+    return get_log_directory() / f"borg_scan_{config_file.stem}.json"
+
+
+class ChangeDetector:
+    """Decides if borg create can be skipped because nothing changed since the last successful create.
+
+    The index has a digest for every directory (name, inode, size, mtime and ctime of every entry).
+    It is taken before borg create runs, so changes during the backup are found the next time."""
+
+    def __init__(self, config: dict[str, Any], config_file: Path) -> None:
+        self.config = config
+        self.index_file = get_scan_index_file(config_file)
+        self.max_age = parse_duration(config.get("borg_create_skip_unchanged_max_age", 0))
+        self.index: dict[str, Any] = {}
+
+    def get_settings_digest(self) -> str:
+        # a changed config (backup dirs, excludes, arguments) always needs a new archive
+        settings = [self.config["borg_create_backup_dirs"], self.config["borg_create_excludes"],
+                    self.config.get("borg_create_arguments", [])]
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+    def scan(self) -> dict[str, str]:
+        arguments = get_create_arguments(self.config)
+        matcher = PatternMatcher(compile_excludes(get_create_excludes(self.config)))
+        # file roots in the same directory (like /etc/fstab and /etc/hosts) are yielded as the directory
+        # one at a time, so all entries of a directory are collected first
+        dir_entries: dict[str, list[ScanEntry]] = {}
+        for path, entries in walk(get_create_backup_dirs(self.config), matcher, "--one-file-system" in arguments):
+            dir_entries.setdefault(path, []).extend(entries)
+        dirs = {}
+        for path, entries in dir_entries.items():
+            digest = hashlib.blake2b(digest_size=8)
+            for entry in sorted(entries, key=lambda entry: entry.path):
+                digest.update(f"{entry.name}\0{entry.inode}\0{entry.size}\0{entry.mtime_ns}\0{entry.ctime_ns}\0".encode(errors="surrogateescape"))
+            dirs[path] = digest.hexdigest()
+        return dirs
+
+    def unchanged(self) -> bool:
+        start = time.time()
+        self.index = {"time": start, "settings": self.get_settings_digest(), "dirs": self.scan()}
+        logging.info(f"Scanned {len(self.index['dirs'])} directories in {time.time() - start:.1f}s")
+
+        if not self.index_file.exists():
+            return False
+        try:
+            last_index = json.loads(self.index_file.read_text())
+            if last_index["settings"] != self.index["settings"]:
+                logging.info("Config changed since the last create")
+                return False
+            if self.max_age and start - last_index["time"] > self.max_age:
+                logging.info(f"Last create is older than {self.max_age:.0f}s (borg_create_skip_unchanged_max_age)")
+                return False
+            last_dirs = last_index["dirs"]
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Could not read {self.index_file}: {e}")
+            return False
+
+        changed = [path for path in self.index["dirs"].keys() | last_dirs.keys()
+                   if self.index["dirs"].get(path) != last_dirs.get(path)]
+        if changed:
+            logging.info(f"{len(changed)} directories changed since the last create, e.g. {sorted(changed)[0]}")
+            return False
+        return True
+
+    def save(self) -> None:
+        # only called after a successful create
+        tmp_file = self.index_file.with_name(f".{self.index_file.name}.{os.getpid()}")
+        tmp_file.write_text(json.dumps(self.index))
+        os.replace(tmp_file, self.index_file)
@@ -0,0 +1,70 @@
+import atexit
+import hashlib
+import logging
+import shlex
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any
+
+from borgctl.helper import parse_borg_repository
+from borgctl.utils import get_log_directory, parse_duration
+
+
+DEFAULT_CONTROL_PERSIST = "5m"
+
+# control paths of the masters started by this process, stopped at exit
+control_paths: dict[str, list[str]] = {}
+# --parallel: several configs are set up at the same time
+control_paths_lock = threading.Lock()
+
+
+def get_control_path(user: str, host: str, ssh_key: str) -> Path:
+    # unix socket paths are limited to 108 bytes, so only a short hash is used as name.
+    # %p (the port) is expanded by ssh
+    control_dir = get_log_directory() / "ssh"
+    control_dir.mkdir(mode=0o700, exist_ok=True)
+    key = hashlib.sha256(f"{user}\0{host}\0{ssh_key}".encode()).hexdigest()[:16]
+    return control_dir / f"{key}-%p"
+
+
+def stop_masters() -> None:
+    with control_paths_lock:
+        masters = list(control_paths.items())
+        control_paths.clear()
+    for control_path, cmd in masters:
+        # -O stop: the master does not accept new sessions and exits after the running ones
+        # (e.g. a borg process of another borgctl instance) are finished
+        logging.debug(f"Stopping ssh master {control_path}")
+        try:
+            subprocess.run(cmd, capture_output=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.debug(f"Could not stop ssh master {control_path}: {e}")
+
+
+def setup_multiplexing(config: dict[str, Any], env: dict[str, str]) -> dict[str, str]:
+    """Adds ControlMaster/ControlPersist to BORG_RSH, so every borg command (and every config
+    using the same user, host and ssh key) uses the same ssh connection"""
+    user, host, _ = parse_borg_repository(config["repository"])
+    if host is None or user is None:
+        return env
+    # ssh accepts ssh:// urls, so the port is the same as borg's
+    repository = config["repository"].strip()
+    destination = f"ssh://{repository.removeprefix('ssh://').partition('/')[0]}" if repository.startswith("ssh://") else f"{user}@{host}"
+    rsh = env.get("BORG_RSH", "ssh")
+    if "ControlPath" in rsh or "ControlMaster" in rsh:
+        logging.warning("BORG_RSH already configures ssh multiplexing. Ignoring ssh_multiplexing")
+        return env
+
+    control_path = get_control_path(user, host, config["ssh_key"]).as_posix()
+    persist = int(parse_duration(config.get("ssh_control_persist", DEFAULT_CONTROL_PERSIST)))
+    options = ["-o", "ControlMaster=auto", "-o", f"ControlPath={control_path}", "-o", f"ControlPersist={persist}"]
+    rsh_args = shlex.split(rsh)
+    with control_paths_lock:
+        if control_path not in control_paths:
+            if not control_paths:
+                atexit.register(stop_masters)
+            control_paths[control_path] = rsh_args + ["-o", f"ControlPath={control_path}", "-O", "stop", destination]
+    env = dict(env)
+    env["BORG_RSH"] = shlex.join(rsh_args + options)
+    return env
@@ -0,0 +1,81 @@
+import argparse
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, NoReturn
+
+from borgctl.utils import get_log_directory, format_duration
+
+
+# --parallel runs several configs in threads of the same process, flock only locks against other processes
+state_lock = threading.Lock()
+
+
+def get_state_index_file() -> Path:
+    return get_log_directory() / "borg_state.json"
+
+
+def load_state_index() -> dict[str, dict[str, dict[str, Any]]]:
+    try:
+        state: dict[str, dict[str, dict[str, Any]]] = json.loads(get_state_index_file().read_text())
+        return state
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logging.warning(f"Could not parse {get_state_index_file()}: {e}")
+        return {}
+
+
+def update_state_index(config_name: str, command: str, return_code: int) -> None:
+    """Remembers the last run, success and failure of every config and command in one json file"""
+    state_file = get_state_index_file()
+    with state_lock, open(state_file.with_name(".borg_state.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = load_state_index()
+        entry = state.setdefault(config_name, {}).setdefault(command, {})
+        now = round(time.time(), 3)
+        entry["last_run"] = now
+        entry["exit_code"] = return_code
+        if return_code == 0:
+            entry["last_success"] = now
+        elif return_code > 1:
+            entry["last_failure"] = now
+
+        # readers never see a half written file
+        tmp_file = state_file.with_name(f".{state_file.name}.{os.getpid()}")
+        tmp_file.write_text(json.dumps(state, indent=4))
+        os.replace(tmp_file, state_file)
+    logging.info(f"Updated state of '{command}' in {state_file}")
+
+
+def format_age(timestamp: float | None) -> str:
+    if timestamp is None:
+        return "never"
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))} ({format_duration(time.time() - timestamp)} ago)"
+
+
+def show_state(cli_config: list[str] | None, cli_arguments: list[str]) -> NoReturn:
+    parser = argparse.ArgumentParser(prog="borgctl status", description="show the last successful and failed run of every config and borg command")
+    parser.add_argument("--json", action="store_true", help="print the state as json")
+    args = parser.parse_args(cli_arguments)
+
+    state = load_state_index()
+    if cli_config:
+        config_names = [Path(config).stem for config in cli_config]
+        state = {config_name: commands for config_name, commands in state.items() if config_name in config_names}
+
+    if args.json:
+        print(json.dumps(state, indent=4))
+        sys.exit(0)
+    for config_name, commands in sorted(state.items()):
+        print(f"{config_name}:")
+        for command, entry in sorted(commands.items()):
+            print(f"  {command:<8} last success: {format_age(entry.get('last_success'))}")
+            if entry.get("last_failure", 0) > entry.get("last_success", 0):
+                print(f"  {'':<8} last failure: {format_age(entry['last_failure'])} (exit code {entry['exit_code']})")
+    sys.exit(0)
@@ -0,0 +1,116 @@
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+from typing import Any, BinaryIO, TYPE_CHECKING
+
+from borgctl.utils import get_new_archive_name, parse_duration
+
+if TYPE_CHECKING:
+    from borgctl.events import EventHandler
+
+
+def get_source_command(source: dict[str, Any]) -> list[str]:
+    if isinstance(source["command"], list):
+        return [str(word) for word in source["command"]]
+    return shlex.split(source["command"])
+
+
+def get_source_prefix(config: dict[str, Any], source: dict[str, Any]) -> str:
+    # every source gets its own archive (and prefix), so prune can keep them independently of the file backups
+    return str(source.get("prefix", f"{config['prefix']}-{os.path.splitext(os.path.basename(source['name']))[0]}"))
+
+
+def get_source_archive_name(config: dict[str, Any], source: dict[str, Any]) -> str:
+    return get_new_archive_name(dict(config, prefix=get_source_prefix(config, source)))
+
+
+def get_glob_archives(prefix: str) -> str:
+    # the archive names are <prefix>_<date>, so <prefix>-postgres_<date> does not match <prefix>_*
+    return f"--glob-archives={prefix}_*"
+
+
+def kill_source(process: subprocess.Popen[bytes], name: str, output_prefix: str) -> None:
+    logging.error(f"{output_prefix}Timeout of '{name}' reached. Killing it")
+    try:
+        # the command runs in its own process group: also kill what it started (like sh -c "pg_dump | zstd")
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def backup_stdin_source(source: dict[str, Any], config: dict[str, Any], env: dict[str, str], output_prefix: str = "",
+                        handlers: "list[EventHandler] | None" = None, transcript: BinaryIO | None = None) -> int:
+    """Pipes the stdout of the command of the source into borg create.
+
+    The pipe connects both processes directly, borgctl does not copy the data. If borg is slow, the command
+    blocks on the full pipe. The archive is deleted if the command failed, it would contain an incomplete dump"""
+    # avoid a circular import
+    from borgctl import execute_borg
+    archive = get_source_archive_name(config, source)
+    cmd = [config["borg_binary"], "--verbose", "create", "--stats", f"--stdin-name={source['name']}"]
+    if handlers:
+        cmd.insert(1, "--log-json")
+    for argument in config.get("borg_create_arguments", []):
+        cmd.extend(argument.split())
+    cmd.extend([archive, "-"])
+
+    command = get_source_command(source)
+    logging.info(f"{output_prefix}Streaming the output of '{' '.join(command)}' into {archive}")
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, start_new_session=True)
+    except OSError as e:
+        logging.error(f"{output_prefix}Could not run '{' '.join(command)}': {e}")
+        return 2
+    assert process.stdout is not None
+
+    timer = None
+    if "timeout" in source:
+        timer = threading.Timer(parse_duration(source["timeout"]), kill_source, (process, source["name"], output_prefix))
+        timer.start()
+    try:
+        return_code = execute_borg(cmd, env, output_prefix, handlers, config, transcript, stdin=process.stdout)
+    finally:
+        # if borg died, the command gets SIGPIPE instead of blocking on the full pipe
+        process.stdout.close()
+        source_return_code = process.wait()
+        if timer:
+            timer.cancel()
+
+    if source_return_code != 0:
+        logging.error(f"{output_prefix}'{' '.join(command)}' failed with exit code {source_return_code}")
+        if return_code <= 1:
+            logging.warning(f"{output_prefix}Deleting the incomplete archive {archive}")
+            execute_borg([config["borg_binary"], "--verbose", "delete", archive], env, output_prefix, config=config, transcript=transcript)
+        return max(return_code, 2)
+    return return_code
+
+
+def run_stdin_sources(config: dict[str, Any], env: dict[str, str], output_prefix: str = "",
+                      handlers: "list[EventHandler] | None" = None, transcript: BinaryIO | None = None) -> int:
+    return_code = 0
+    for source in config["borg_create_stdin_sources"]:
+        ret = backup_stdin_source(source, config, env, output_prefix, handlers, transcript)
+        return_code = ret if ret > return_code else return_code
+    return return_code
+
+
+def prune_stdin_sources(config: dict[str, Any], env: dict[str, str], output_prefix: str = "",
+                        handlers: "list[EventHandler] | None" = None, transcript: BinaryIO | None = None) -> int:
+    """Prunes the archives of every source on their own, with the prune_arguments of the source
+    (default: borg_prune_arguments). The archives of the backup directories are pruned with their own glob"""
+    # avoid a circular import
+    from borgctl import execute_borg
+    return_code = 0
+    for source in config["borg_create_stdin_sources"]:
+        cmd = [config["borg_binary"], "--verbose", "prune", "--list", get_glob_archives(get_source_prefix(config, source))]
+        if handlers:
+            cmd.insert(1, "--log-json")
+        for argument in source.get("prune_arguments", config.get("borg_prune_arguments", [])):
+            cmd.extend(argument.split())
+        logging.info(f"{output_prefix}Pruning the archives of '{source['name']}'")
+        ret = execute_borg(cmd, env, output_prefix, handlers, config, transcript)
+        return_code = ret if ret > return_code else return_code
+    return return_code
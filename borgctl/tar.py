@@ -0,0 +1,238 @@
+import hashlib
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from borgctl.events import format_size
+from borgctl.utils import ArgumentParser, fail, format_command, format_duration, GOVERNOR_CONFIG_KEYS
+
+
+# multi-threaded compressors first. All of them understand -c (write to stdout) and -d (decompress)
+COMPRESSORS = {
+    ".zst": [["zstd", "-T0"]],
+    ".gz": [["pigz"], ["gzip"]],
+    ".xz": [["xz", "-T0"]],
+    ".bz2": [["pbzip2"], ["bzip2"]],
+    ".lz4": [["lz4"]],
+}
+READ_SIZE = 1024**2
+
+
+def get_compressor(file: str, compressor: str | None) -> list[str]:
+    """Returns the compressor for the file (by its suffix) or [] for an uncompressed tar"""
+    if compressor:
+        return shlex.split(compressor)
+    suffix = Path(file).suffix
+    if suffix not in COMPRESSORS:
+        return []
+    for candidate in COMPRESSORS[suffix]:
+        if shutil.which(candidate[0]):
+            return candidate
+    fail(f"No compressor for '{suffix}' found. Please install {' or '.join(candidate[0] for candidate in COMPRESSORS[suffix])}")
+
+
+def copy_stream(source: int, dest: int, digest: Any, label: str, progress_interval: float, output_prefix: str = "") -> int:
+    """Copies source to dest until EOF and feeds the data to the digest. Logs the throughput every progress_interval seconds"""
+    start = last_report = time.monotonic()
+    total = 0
+    while data := os.read(source, READ_SIZE):
+        if digest:
+            digest.update(data)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dest, view):]
+        total += len(data)
+        now = time.monotonic()
+        if progress_interval and now - last_report >= progress_interval:
+            logging.info(f"{output_prefix}{label} {format_size(total)} ({format_size(total / (now - start))}/s)")
+            last_report = now
+    duration = time.monotonic() - start
+    logging.info(f"{output_prefix}{label} {format_size(total)} in {format_duration(duration)} ({format_size(total / max(duration, 0.001))}/s)")
+    return total
+
+
+def get_checksum_file(file: str) -> Path:
+    return Path(f"{file}.sha256")
+
+
+@dataclass
+class TarStream:
+    """export-tar/import-tar with --stream: borg reads/writes the tar on stdin/stdout, an external
+    (multi-threaded) compressor runs in its own process and borgctl computes the sha256 of the file"""
+    command: str
+    file: str
+    compressor: list[str]
+    checksum: bool
+    progress_interval: float
+
+    @classmethod
+    def from_arguments(cls, command: str, args: list[str], config: dict[str, Any]) -> tuple["TarStream | None", list[str]]:
+        """Returns the stream (None without --stream) and the arguments for borg: the file is replaced by - (stdin/stdout)"""
+        if "--stream" not in args:
+            return None, args
+        parser = ArgumentParser(prog=f"borgctl {command} --stream", description="stream the tar through an external compressor")
+        parser.add_argument("--stream", action="store_true")
+        parser.add_argument("--compressor", default=config.get("tar_compressor"),
+                            help="compressor command, like 'zstd -T0 -19' (default: by suffix of the file)")
+        parser.add_argument("--no-checksum", action="store_true", help="don't compute the sha256 of the file")
+        if command == "export-tar":
+            parser.add_argument("archive")
+        parser.add_argument("file", help="the tar file or - for stdin/stdout")
+        if command == "export-tar":
+            parser.add_argument("paths", nargs="*")
+        known, borg_args = parser.parse_known_args(args)
+        stream = cls(command, known.file, get_compressor(known.file, known.compressor), not known.no_checksum,
+                     config.get("progress_interval", 60))
+        if command == "export-tar":
+            return stream, [known.archive, "-", *known.paths, *borg_args]
+        return stream, ["-", *borg_args]
+
+    def run(self, cmd: list[str], env: dict[str, str], config: dict[str, Any], output_prefix: str = "") -> int:
+        if any(key in config for key in GOVERNOR_CONFIG_KEYS):
+            from borgctl.governor import apply_resource_limits
+            cmd = apply_resource_limits(cmd, config)
+        # like execute_borg
+        logging.info(f"{output_prefix}Executing: {format_command(cmd, env)}")
+        if self.compressor:
+            logging.info(f"{output_prefix}Using '{' '.join(self.compressor)}' for {self.file}")
+        if self.command == "export-tar":
+            return_code = self.export_tar(cmd, env, output_prefix)
+        else:
+            return_code = self.import_tar(cmd, env, output_prefix)
+        if return_code == 1:
+            logging.warning(f"{output_prefix}Borg exited with warnings (exit code {return_code})")
+        elif return_code > 1:
+            logging.error(f"{output_prefix}Borg failed with exit code {return_code}")
+        return return_code
+
+    def export_tar(self, cmd: list[str], env: dict[str, str], output_prefix: str) -> int:
+        digest = hashlib.sha256() if self.checksum else None
+        borg = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE)
+        assert borg.stdout is not None
+        source = borg.stdout
+        compressor = None
+        if self.compressor:
+            # borg and the compressor are connected directly, borgctl only reads the compressed data
+            compressor = subprocess.Popen(self.compressor + ["-c"], stdin=borg.stdout, stdout=subprocess.PIPE)
+            assert compressor.stdout is not None
+            borg.stdout.close()
+            source = compressor.stdout
+
+        write_failed = False
+        try:
+            if self.file == "-":
+                sys.stdout.flush()
+                copy_stream(source.fileno(), sys.stdout.fileno(), digest, "Exported", self.progress_interval, output_prefix)
+            else:
+                with open(self.file, "wb") as f:
+                    copy_stream(source.fileno(), f.fileno(), digest, "Exported", self.progress_interval, output_prefix)
+        except OSError as e:
+            logging.error(f"{output_prefix}Could not write {self.file}: {e}")
+            write_failed = True
+            borg.kill()
+            if compressor:
+                compressor.kill()
+        finally:
+            source.close()
+        return_code = self.wait(borg, compressor, output_prefix)
+        if write_failed:
+            # the file is incomplete, whatever borg says
+            return_code = max(return_code, 2)
+
+        if return_code > 1:
+            # only files borgctl created, never a device like /dev/full
+            if self.file != "-" and Path(self.file).is_file():
+                logging.warning(f"{output_prefix}Deleting the incomplete {self.file}")
+                Path(self.file).unlink()
+            return return_code
+        if digest is None:
+            return return_code
+        if self.file == "-":
+            logging.info(f"{output_prefix}sha256: {digest.hexdigest()}")
+        else:
+            # the format of sha256sum, check it with sha256sum -c
+            get_checksum_file(self.file).write_text(f"{digest.hexdigest()}  {Path(self.file).name}\n")
+            logging.info(f"{output_prefix}Wrote sha256 {digest.hexdigest()} to {get_checksum_file(self.file)}")
+        return return_code
+
+    def import_tar(self, cmd: list[str], env: dict[str, str], output_prefix: str) -> int:
+        checksum_file = get_checksum_file(self.file)
+        if self.checksum and self.file != "-" and checksum_file.exists():
+            # before borg runs: borg commits the archive as soon as the tar is complete
+            if not self.verify_checksum(checksum_file, output_prefix):
+                return 2
+        # stdin can only be read once, so its sha256 is computed while it is imported
+        digest = hashlib.sha256() if self.checksum and self.file == "-" else None
+        compressor = None
+        read_failed = False
+        if self.compressor:
+            compressor = subprocess.Popen(self.compressor + ["-d", "-c"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            assert compressor.stdin is not None and compressor.stdout is not None
+            borg = subprocess.Popen(cmd, env=env, stdin=compressor.stdout)
+            compressor.stdout.close()
+            dest = compressor.stdin
+        else:
+            borg = subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE)
+            assert borg.stdin is not None
+            dest = borg.stdin
+
+        try:
+            if self.file == "-":
+                copy_stream(sys.stdin.fileno(), dest.fileno(), digest, "Imported", self.progress_interval, output_prefix)
+            else:
+                with open(self.file, "rb") as f:
+                    copy_stream(f.fileno(), dest.fileno(), digest, "Imported", self.progress_interval, output_prefix)
+        except BrokenPipeError:
+            # borg (or the compressor) stopped reading. The exit code tells why
+            pass
+        except OSError as e:
+            logging.error(f"{output_prefix}Could not read {self.file}: {e}")
+            read_failed = True
+            # without the end of the tar, borg fails and does not commit the archive
+            borg.kill()
+        finally:
+            try:
+                dest.close()
+            except BrokenPipeError:
+                pass
+        return_code = self.wait(borg, compressor, output_prefix)
+        if read_failed:
+            return_code = max(return_code, 2)
+        if digest and return_code <= 1:
+            logging.info(f"{output_prefix}sha256: {digest.hexdigest()}")
+        return return_code
+
+    def verify_checksum(self, checksum_file: Path, output_prefix: str) -> bool:
+        """Reads the file once to compare its sha256 with the checksum file (written by export-tar)"""
+        digest = hashlib.sha256()
+        try:
+            with open(self.file, "rb") as f:
+                while data := f.read(READ_SIZE):
+                    digest.update(data)
+            expected = checksum_file.read_text().split()[0]
+        except (OSError, IndexError) as e:
+            logging.error(f"{output_prefix}Could not verify {self.file} with {checksum_file}: {e}")
+            return False
+        if digest.hexdigest() != expected:
+            logging.error(f"{output_prefix}sha256 of {self.file} is {digest.hexdigest()}, but {checksum_file} says {expected}. Not importing it")
+            return False
+        logging.info(f"{output_prefix}sha256 of {self.file} matches {checksum_file}")
+        return True
+
+    def wait(self, borg: "subprocess.Popen[bytes]", compressor: "subprocess.Popen[bytes] | None", output_prefix: str) -> int:
+        return_code = borg.wait()
+        if return_code < 0:
+            # killed by a signal (like borgctl after a write error): borg did not finish
+            logging.error(f"{output_prefix}borg was killed by signal {-return_code}")
+            return_code = 2
+        if compressor and (compressor_return_code := compressor.wait()) != 0:
+            logging.error(f"{output_prefix}'{' '.join(self.compressor)}' failed with exit code {compressor_return_code}")
+            return max(return_code, 2)
+        return return_code
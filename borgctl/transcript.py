@@ -0,0 +1,93 @@
+import gzip
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, BinaryIO, TextIO, cast
+
+from borgctl.utils import get_log_directory, parse_duration
+
+
+DEFAULT_TRANSCRIPT_MAX_AGE = "30d"
+# MiB per config file
+DEFAULT_TRANSCRIPT_MAX_SIZE = 1024
+# borg output is read in large chunks, not line by line
+READ_SIZE = 1024**2
+
+
+def get_transcript_directory(config_file: Path) -> Path:
+    transcript_dir = get_log_directory() / "transcripts" / config_file.stem
+    transcript_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return transcript_dir
+
+
+def open_transcript(config_file: Path, command: str) -> BinaryIO:
+    transcript_file = get_transcript_directory(config_file) / f"{command}_{time.strftime('%Y-%m-%d_%H:%M:%S')}.log.gz"
+    logging.info(f"Writing the output of borg to {transcript_file}")
+    # the fastest level: a transcript is rarely read, it only has to be there
+    return cast(BinaryIO, gzip.open(transcript_file, "ab", compresslevel=1))
+
+
+def tee_output(fd: int, console: TextIO, transcript: BinaryIO | None, output_prefix: str = "") -> None:
+    """Copies everything from fd to the console and to the transcript until EOF.
+
+    The output has to pass the compressor, so a kernel side copy (splice/tee) is not possible.
+    os.read returns what's there (up to 1 MiB), so borg output still shows up immediately.
+    With output_prefix (--parallel), every line gets the prefix and is written while holding the output lock,
+    so the lines of several borg processes don't mix. An incomplete line waits for the next read"""
+    console.flush()
+    console_fd = console.fileno()
+    prefix = output_prefix.encode()
+    rest = b""
+    while data := os.read(fd, READ_SIZE):
+        if transcript:
+            transcript.write(data)
+        if not prefix:
+            write_all(console_fd, data)
+            continue
+        # \r too: the --progress line of borg
+        lines = (rest + data).splitlines(keepends=True)
+        rest = b"" if lines[-1].endswith((b"\n", b"\r")) else lines.pop()
+        if lines:
+            write_prefixed(console_fd, prefix, lines)
+    if rest:
+        write_prefixed(console_fd, prefix, [rest + b"\n"])
+
+
+def write_prefixed(fd: int, prefix: bytes, lines: list[bytes]) -> None:
+    from borgctl.events import output_lock
+    data = b"".join(prefix + line for line in lines)
+    with output_lock:
+        write_all(fd, data)
+
+
+def write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def cleanup_transcripts(config: dict[str, Any], config_file: Path) -> None:
+    """Deletes transcripts older than transcript_max_age, then the oldest ones until all transcripts
+    of the config file are smaller than transcript_max_size"""
+    max_age = parse_duration(config.get("transcript_max_age", DEFAULT_TRANSCRIPT_MAX_AGE))
+    max_size = config.get("transcript_max_size", DEFAULT_TRANSCRIPT_MAX_SIZE) * 1024**2
+    now = time.time()
+    transcripts = []
+    for transcript in get_transcript_directory(config_file).glob("*.log.gz"):
+        try:
+            stat = transcript.stat()
+        except FileNotFoundError:
+            continue
+        if max_age and now - stat.st_mtime > max_age:
+            transcript.unlink(missing_ok=True)
+        else:
+            transcripts.append((stat.st_mtime, stat.st_size, transcript))
+
+    total_size = sum(size for _, size, _ in transcripts)
+    # keep the newest one, even if it's too large on its own
+    for _, size, transcript in sorted(transcripts)[:-1]:
+        if total_size <= max_size:
+            break
+        transcript.unlink(missing_ok=True)
+        total_size -= size
@@ -1,10 +1,10 @@
+import argparse
 import os
 from pathlib import Path
-import datetime
-import sys
-from ruamel.yaml import YAML, YAMLError  # type: ignore
+import time
 import logging
-from getpass import getpass
+from contextvars import ContextVar
+from functools import cache
 from typing import Tuple, NoReturn, Any
 
 
@@ -14,14 +14,80 @@ BORG_COMMANDS = [
     'key', 'list', 'mount', 'prune', 'rename', 'umount', 'upgrade', 'with-lock'
 ]
 
+# optional config keys and their types. If they are missing, defaults are used
+OPTIONAL_CONFIG_KEYS: dict[str, type | tuple[type, ...]] = {
+    "log_json": bool,
+    "progress_interval": (int, float),
+    "history": bool,
+    "prometheus_textfile_dir": str,
+    "daemon_interval": (str, int, float),
+    "daemon_jitter": (str, int, float),
+    "nice": int,
+    "ionice_class": str,
+    "ionice_priority": int,
+    "cpu_affinity": list,
+    "upload_ratelimit": int,
+    "borg_create_skip_unchanged": bool,
+    "borg_create_skip_unchanged_max_age": (str, int, float),
+    "borg_create_patterns_file": bool,
+    "check_max_duration": (str, int, float),
+    "check_full_interval": (str, int, float),
+    "retry_attempts": int,
+    "retry_exit_codes": list,
+    "retry_msgids": list,
+    "retry_commands": list,
+    "retry_backoff": (str, int, float),
+    "retry_max_time": (str, int, float),
+    "retry_checkpoint_interval": (str, int, float),
+    "ssh_multiplexing": bool,
+    "ssh_control_persist": (str, int, float),
+    "archive_cache": bool,
+    "legacy_state_files": bool,
+    "transcripts": bool,
+    "transcript_max_age": (str, int, float),
+    "transcript_max_size": int,
+    "borg_create_stdin_sources": list,
+    "tar_compressor": str,
+    "replicate_to": list,
+    "replicate_check": bool,
+}
+
+# config keys that limit the resources borg may use (see governor.py)
+GOVERNOR_CONFIG_KEYS = ("nice", "ionice_class", "ionice_priority", "cpu_affinity", "upload_ratelimit")
+
+# commands handled by borgctl itself (not passed to borg)
+BORGCTL_COMMANDS = ["stats", "daemon", "plan", "status", "replicate", ]
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
 remembered_passphrase = ""
 
+# the config file the current thread works on (per_config in logging.conf)
+current_config: ContextVar[str | None] = ContextVar("current_config", default=None)
+
+
+class BorgCtlError(Exception):
+    """Raised by fail(). main() exits with its code, users of the api can catch it"""
+
+    def __init__(self, msg: str | Exception, code: int = 1) -> None:
+        super().__init__(str(msg))
+        self.code = code
+
 
 def fail(msg: str | Exception, code: int = 1) -> NoReturn:
     logging.error(msg)
-    sys.exit(code)
+    raise BorgCtlError(msg, code)
 
 
+class ArgumentParser(argparse.ArgumentParser):
+    """For arguments parsed while running a borg command: errors raise BorgCtlError instead of SystemExit,
+    so users of the api can catch them"""
+
+    def error(self, message: str) -> NoReturn:
+        fail(f"{self.prog}: {message}", 2)
+
+
+@cache
 def get_log_directory() -> Path:
     # https://specifications.freedesktop.org/basedir-spec/latest/ar01s03.html
     if os.getuid() == 0:
@@ -36,13 +102,26 @@ def get_log_directory() -> Path:
     return log_dir
 
 
+@cache
 def init_logging() -> None:
+    # only once: a second QueueListener would write every record twice
+    import configparser
+    import logging.config
+    from borgctl.logs import read_settings, start_queue_logging
     config_file = get_conf_directory() / "logging.conf"
     if not config_file.exists():
         write_logging_config()
-    logging.config.fileConfig(config_file)
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(config_file)
+    logging.config.fileConfig(parser)
+    try:
+        read_settings(parser)
+    except ValueError as e:
+        fail(f"Invalid logging configuration {config_file}: {e}")
+    start_queue_logging()
 
 
+@cache
 def get_conf_directory() -> Path:
     # https://specifications.freedesktop.org/basedir-spec/latest/ar01s03.html
     if os.getuid() == 0:
@@ -57,17 +136,47 @@ def get_conf_directory() -> Path:
     return conf_dir
 
 
-def write_state_file(config: dict[str, Any], config_file: Path, command: str) -> None:
+def write_state_file(config: dict[str, Any], config_file: Path, command: str, return_code: int = 0) -> None:
     if command not in config["state_commands"]:
         return
+    from borgctl.state import update_state_index
+    update_state_index(config_file.stem, command, return_code)
+    if return_code != 0 or not config.get("legacy_state_files", False):
+        return
     log_dir = get_log_directory()
     config_prefix = config_file.stem
     state_file = log_dir / f"borg_state_{config_prefix}_{command}.txt"
-    now = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    now = time.strftime("%Y-%m-%d_%H:%M:%S")
     state_file.write_text(now)
     logging.info(f"Updated state file {state_file}")
 
 
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+def parse_duration(duration: str | int | float) -> float:
+    # 90 (seconds), "90s", "15m", "6h", "1d"
+    if type(duration) in (int, float):
+        seconds = float(duration)
+    else:
+        value = str(duration).strip()
+        unit = value[-1:] if value[-1:] in DURATION_UNITS else "s"
+        try:
+            seconds = float(value.removesuffix(unit)) * DURATION_UNITS[unit]
+        except ValueError:
+            raise ValueError(f"'{duration}' is not a duration (like 90s, 15m, 6h or 1d)")
+    if seconds < 0:
+        raise ValueError(f"'{duration}' is negative")
+    return seconds
+
+
 def check_config(config: dict[str, Any]) -> None:
     config_keys = ['repository', 'ssh_key', 'prefix', 'passphrase', 'mount_point', 'borg_create_backup_dirs',
                    'borg_create_excludes', 'envs', 'borg_binary', 'cron_commands', 'state_commands']
@@ -88,6 +197,61 @@ def check_config(config: dict[str, Any]) -> None:
             if command not in BORG_COMMANDS:
                 fail(f"'{command}' in '{key}' is not a valid borg command")
 
+    for config_key, config_type in OPTIONAL_CONFIG_KEYS.items():
+        if config_key in config and not isinstance(config[config_key], config_type):
+            fail(f"'{config_key}' in config file has the wrong type ({type(config[config_key]).__name__})")
+
+    for config_key in ("daemon_interval", "daemon_jitter", "borg_create_skip_unchanged_max_age",
+                       "check_max_duration", "check_full_interval", "retry_backoff", "retry_max_time",
+                       "retry_checkpoint_interval", "ssh_control_persist", "transcript_max_age"):
+        if config_key in config:
+            try:
+                parse_duration(config[config_key])
+            except ValueError as e:
+                fail(f"'{config_key}' in config file is invalid: {e}")
+
+    if not -20 <= config.get("nice", 0) <= 19:
+        fail("'nice' in config file must be between -20 and 19")
+    if config.get("ionice_class", "best-effort") not in ("realtime", "best-effort", "idle"):
+        fail("'ionice_class' in config file must be realtime, best-effort or idle")
+    if not 0 <= config.get("ionice_priority", 0) <= 7:
+        fail("'ionice_priority' in config file must be between 0 (highest) and 7 (lowest)")
+    if not all(type(cpu) is int and cpu >= 0 for cpu in config.get("cpu_affinity", [])):
+        fail("'cpu_affinity' in config file must be a list of cpu numbers")
+    if config.get("upload_ratelimit", 0) < 0:
+        fail("'upload_ratelimit' in config file must be positive (kiB/s)")
+    if config.get("retry_attempts", 0) < 0:
+        fail("'retry_attempts' in config file must be positive")
+    for command in config.get("retry_commands", []):
+        if command not in BORG_COMMANDS:
+            fail(f"'{command}' in 'retry_commands' is not a valid borg command")
+        if command == "extract":
+            # a retry would extract the whole archive, not only the shard or the delta of --parallel/--delta
+            fail("'extract' can't be retried (retry_commands). Run borgctl extract --delta to continue a failed restore")
+    for source in config.get("borg_create_stdin_sources", []):
+        if type(source) is not dict or not isinstance(source.get("command"), (str, list)) or not isinstance(source.get("name"), str):
+            fail("Every entry of 'borg_create_stdin_sources' in config file needs a 'command' and a 'name'")
+        if "timeout" in source:
+            try:
+                parse_duration(source["timeout"])
+            except ValueError as e:
+                fail(f"'timeout' of '{source['name']}' in 'borg_create_stdin_sources' is invalid: {e}")
+        prune_arguments = source.get("prune_arguments", [])
+        if type(prune_arguments) is not list or not all(type(argument) is str for argument in prune_arguments):
+            fail(f"'prune_arguments' of '{source['name']}' in 'borg_create_stdin_sources' must be a list of strings")
+        if str(source.get("prefix", "")).startswith(f"{config['prefix']}_"):
+            fail(f"The prefix of '{source['name']}' in 'borg_create_stdin_sources' must not start with '{config['prefix']}_', "
+                 "prune could not tell its archives from the others")
+    prune_options = [argument.split()[0].split("=")[0] for argument in config.get("borg_prune_arguments", [])
+                     if type(argument) is str and argument.strip()]
+    if config.get("borg_create_stdin_sources") and set(prune_options) & {"-a", "--glob-archives", "-P", "--prefix"}:
+        fail("'borg_prune_arguments' must not select archives if there are 'borg_create_stdin_sources', "
+             "borgctl prunes the archives of every source on their own")
+    if not all(type(destination) is str and destination.strip() for destination in config.get("replicate_to", [])):
+        fail("'replicate_to' in config file must be a list of rsync destinations")
+    if config.get("replicate_to") and not config["repository"].strip().removeprefix("file://").startswith("/"):
+        fail("'replicate_to' needs a local repository (the primary copy)")
+
     for command in BORG_COMMANDS:
         config_key = f"borg_{command}_arguments"
         if config_key in config:
@@ -128,14 +292,21 @@ def load_config(config_file: Path) -> Tuple[dict[str, str], dict[str, Any]]:
                 env["BORG_RSH"] = f"ssh -i {config['ssh_key']}"
         return env
 
+    current_config.set(config_file.stem)
     logging.info(f"\aUsing config file {config_file}")
     if not config_file.exists():
         fail(f"Could not load config. File {config_file} does not exist. Please use --list to list "
              "all config files or --generate-default-config to create a default config")
 
+    content = config_file.read_bytes()
+    cached = load_cached_config(config_file, content)
+    if cached:
+        return cached
+
+    from ruamel.yaml import YAML, YAMLError  # type: ignore
     yaml = YAML(typ="safe")
     try:
-        config = yaml.load(config_file)
+        config = yaml.load(content)
         if not config:
             raise YAMLError("File is empty")
     except YAMLError as e:
@@ -143,9 +314,87 @@ def load_config(config_file: Path) -> Tuple[dict[str, str], dict[str, Any]]:
 
     check_config(config)
     env = setup_env()
+    write_cached_config(config_file, content, env, config)
     return env, config
 
 
+def get_config_cache_file(config_file: Path) -> Path:
+    import hashlib
+    cache_dir = get_log_directory() / "config_cache"
+    cache_dir.mkdir(mode=0o700, exist_ok=True)
+    path_hash = hashlib.sha256(config_file.resolve().as_posix().encode()).hexdigest()[:16]
+    return cache_dir / f"{config_file.stem}_{path_hash}.json"
+
+
+@cache
+def get_config_cache_version() -> str:
+    # check_config and the env setup of load_config are in this file: if it changes (new version of borgctl),
+    # old cache entries are not used
+    import hashlib
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+def get_config_cache_key(config_file: Path, content: bytes) -> dict[str, Any]:
+    import hashlib
+    stat = config_file.stat()
+    return {
+        "version": get_config_cache_version(),
+        "path": config_file.resolve().as_posix(),
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "conf_dir": get_conf_directory().as_posix(),
+    }
+
+
+def load_cached_config(config_file: Path, content: bytes) -> Tuple[dict[str, str], dict[str, Any]] | None:
+    import json
+    cache_file = get_config_cache_file(config_file)
+    try:
+        with cache_file.open() as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+                # someone else could have written it
+                logging.warning(f"Ignoring config cache {cache_file}: wrong owner or permissions")
+                return None
+            cached = json.load(f)
+        if cached["key"] != get_config_cache_key(config_file, content):
+            return None
+        return cached["env"], cached["config"]
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError, OSError) as e:
+        logging.debug(f"Ignoring config cache {cache_file}: {e}")
+        return None
+
+
+def write_cached_config(config_file: Path, content: bytes, env: dict[str, str], config: dict[str, Any]) -> None:
+    import json
+    # the cache contains the passphrase: never readable by more users than the config file itself
+    mode = config_file.stat().st_mode & 0o600
+    if not mode & 0o400:
+        return
+    cached = {"key": get_config_cache_key(config_file, content), "env": env, "config": config}
+    try:
+        data = json.dumps(cached)
+        if json.loads(data) != cached:
+            # e.g. yaml dates or non string keys
+            return
+    except (TypeError, ValueError):
+        return
+
+    cache_file = get_config_cache_file(config_file)
+    tmp_file = cache_file.with_name(f".{cache_file.name}.{os.getpid()}")
+    try:
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logging.debug(f"Could not write config cache {cache_file}: {e}")
+        tmp_file.unlink(missing_ok=True)
+
+
 def write_logging_config() -> None:
 
     log_file = get_log_directory() / "borg.log"
@@ -177,15 +426,30 @@ args=(sys.stderr,)
 [formatter_simple]
 format=%(asctime)s %(levelname)s %(message)s
 datefmt=
-class=logging.Formatter"""
+class=logging.Formatter
+
+# borgctl only, borg ignores this section
+[borgctl]
+# compress rotated log files: none, gzip or zstd
+compression=none
+# text or json (one json object per line)
+format=text
+# also write the log of every config file to borg_$config.log
+per_config=false"""
 
     log_conf_file = get_conf_directory() / "logging.conf"
     log_conf_file.write_text(logging_config)
     print(f"Wrote logging configuration to {log_conf_file}")
 
 
+def format_command(cmd: list[str], env: dict[str, str]) -> str:
+    """The command with its environment for the log, without the passphrases"""
+    debug_out = " ".join([f"{key}=\"{value}\"" for key, value in env.items() if key not in ("BORG_PASSPHRASE", "BORG_NEW_PASSPHRASE")])
+    return debug_out + " " + " ".join(cmd)
+
+
 def get_new_archive_name(config: dict[str, Any]) -> str:
-    now = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    now = time.strftime("%Y-%m-%d_%H:%M:%S")
     archive = "::" + str(config["prefix"]) + "_" + now
     return archive
 
@@ -221,6 +485,7 @@ def ask_for_passphrase(config: dict[str, Any], env: dict[str, str], command: str
         if command == "init":
             return ask_for_new_passphrase(config, env, config_file)
         else:
+            from getpass import getpass
             passphrase = getpass(f"Please enter the borg passphrase for {config['repository']}: ")
             remembered_passphrase = passphrase
 
@@ -228,7 +493,18 @@ def ask_for_passphrase(config: dict[str, Any], env: dict[str, str], command: str
     return env
 
 
+def ask_for_passphrase_upfront(config: dict[str, Any], env: dict[str, str], commands: list[str], config_file: Path, args: list[str]) -> dict[str, str]:
+    for command in commands:
+        env = ask_for_passphrase(config, env, command, config_file, args)
+        if env["BORG_PASSPHRASE"] not in ("ask", "ask-always"):
+            break
+    # later calls to ask_for_passphrase for this config must not prompt again (ask-always)
+    config["passphrase"] = env["BORG_PASSPHRASE"]
+    return env
+
+
 def update_config_passphrase(passphrase: str, config_file: Path) -> None:
+    from ruamel.yaml import YAML, YAMLError  # type: ignore
     yaml = YAML()
     yaml.default_flow_style = False
     yaml.preserve_quotes = True
@@ -251,6 +527,7 @@ def update_config_passphrase(passphrase: str, config_file: Path) -> None:
 
 
 def ask_for_new_passphrase(config: dict[str, Any], env: dict[str, str], config_file: Path) -> dict[str, str] | NoReturn:
+    from getpass import getpass
     passphrase1 = getpass(f"Please enter the new borg passphrase for repository {config['repository']}:")
     passphrase2 = getpass(f"Please re-enter the new borg passphrase for repository {config['repository']}:")
     if passphrase1 != passphrase2:
@@ -262,6 +539,7 @@ def ask_for_new_passphrase(config: dict[str, Any], env: dict[str, str], config_f
 
 
 def update_config_sshkey(ssh_key_location: str, config_file: Path) -> None:
+    from ruamel.yaml import YAML, YAMLError  # type: ignore
     try:
         yaml = YAML()
         yaml.default_flow_style = False
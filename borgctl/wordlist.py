@@ -1,4 +1,5 @@
-import secrets
+# os.urandom is what secrets.choice uses in the end, without importing random, hashlib, hmac and base64
+import os
 # source of wordlist:
 # consists of 2048 words
 # https://github.com/FiloSottile/age/blob/101cc8676386b0503571a929a88618cae2f0b1cd/cmd/age/wordlist.go
@@ -6,7 +7,8 @@ wordlist = "abandon ability able about above absent absorb abstract absurd abuse
 
 
 def get_passphrase() -> str:
-    words = [secrets.choice(wordlist) for i in range(10)]
+    # 2048 words: 11 of the 16 random bits, without modulo bias
+    words = [wordlist[int.from_bytes(os.urandom(2), "big") % len(wordlist)] for i in range(10)]
     passphrase = "-".join(words)
     return passphrase
 
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import datetime
+import json
 from pathlib import Path
 
 
@@ -12,9 +13,18 @@ class Py3status:
         days_last_backup = 9000
         now = datetime.datetime.now()
 
-        for state_file in self.log_dir.glob("borg_state*_create.txt"):
-            backup_date = state_file.read_text()
-            backup_date = datetime.datetime.strptime(backup_date, "%Y-%m-%d_%H:%M:%S")
+        backup_dates = []
+        state_index = self.log_dir / "borg_state.json"
+        if state_index.exists():
+            for commands in json.loads(state_index.read_text()).values():
+                if "last_success" in commands.get("create", {}):
+                    backup_dates.append(datetime.datetime.fromtimestamp(commands["create"]["last_success"]))
+        else:
+            # older borgctl versions wrote one text file per config and command
+            for state_file in self.log_dir.glob("borg_state*_create.txt"):
+                backup_dates.append(datetime.datetime.strptime(state_file.read_text(), "%Y-%m-%d_%H:%M:%S"))
+
+        for backup_date in backup_dates:
             diff = now - backup_date
             if diff.days < days_last_backup:
                 days_last_backup = diff.days
@@ -0,0 +1,67 @@
+import pytest
+
+from borgctl import archives, utils
+from borgctl.api import BorgCtl
+from borgctl.utils import BorgCtlError
+
+CONFIG = """repository: "/tmp/repo"
+ssh_key: ""
+prefix: "host"
+passphrase: "{passphrase}"
+mount_point: "/mnt"
+borg_create_backup_dirs: ["/home"]
+borg_create_excludes: []
+cron_commands: ["create", "prune"]
+state_commands: []
+history: false
+envs: {{}}
+borg_binary: "{borg}"
+"""
+
+BORG = """#!/bin/sh
+echo '{"type": "log_message", "time": 1, "levelname": "INFO", "name": "borg.archiver", "message": "Creating archive"}' >&2
+case "$*" in *create*) echo '{"archive": {"name": "x", "duration": 1.5, "stats": {"nfiles": 12, "original_size": 500, "compressed_size": 300, "deduplicated_size": 100}}}';; esac
+exit ${EXIT_CODE:-0}
+"""
+
+
+class TestApi:
+
+    def setup_config(self, tmp_path, monkeypatch, passphrase="secret"):
+        monkeypatch.setattr(utils, "get_log_directory", lambda: tmp_path)
+        monkeypatch.setattr(archives, "get_log_directory", lambda: tmp_path)
+        borg = tmp_path / "borg"
+        borg.write_text(BORG)
+        borg.chmod(0o755)
+        config_file = tmp_path / "test.yml"
+        config_file.write_text(CONFIG.format(passphrase=passphrase, borg=borg))
+        config_file.chmod(0o600)
+        return config_file
+
+    def test_run(self, tmp_path, monkeypatch):
+        borgctl = BorgCtl.load(self.setup_config(tmp_path, monkeypatch))
+        result = borgctl.run("create")
+        assert result.exit_code == 0 and result.success
+        assert result.stats.nfiles == 12
+        # only with keep_events
+        assert result.events == []
+        result = borgctl.run("create", keep_events=True)
+        assert any(getattr(event, "message", "") == "Creating archive" for event in result.events)
+        assert borgctl.run("list").stats is None
+
+    def test_cron(self, tmp_path, monkeypatch):
+        borgctl = BorgCtl.load(self.setup_config(tmp_path, monkeypatch))
+        monkeypatch.setitem(borgctl.env, "EXIT_CODE", "2")
+        results = borgctl.cron()
+        assert [(result.command, result.exit_code, result.skipped) for result in results] == [("create", 2, False), ("prune", 0, True)]
+
+    def test_errors(self, tmp_path, monkeypatch):
+        config_file = self.setup_config(tmp_path, monkeypatch, passphrase="ask")
+        with pytest.raises(BorgCtlError):
+            BorgCtl.load(tmp_path / "missing.yml")
+        with pytest.raises(BorgCtlError):
+            BorgCtl.load(config_file)
+        borgctl = BorgCtl.load(config_file, passphrase="secret")
+        with pytest.raises(BorgCtlError) as e:
+            borgctl.run("nonsense")
+        assert e.value.code == 1
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from borgctl import archives
+from borgctl.utils import BorgCtlError
+
+
+LISTING = {
+    "repository": {"id": "abc", "last_modified": "2024-01-02T03:04:05.000000", "location": "/tmp/repo"},
+    "archives": [
+        {"archive": "host_2024-01-01_03:00:00", "name": "host_2024-01-01_03:00:00", "id": "11", "start": "2024-01-01T03:00:00.000000"},
+        {"archive": "host_2024-01-02_03:00:00", "name": "host_2024-01-02_03:00:00", "id": "22", "start": "2024-01-02T03:00:00.000000"},
+    ],
+}
+
+
+class TestArchiveCache:
+
+    def setup_config(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(archives, "get_log_directory", lambda: tmp_path)
+        repository = tmp_path / "repo"
+        repository.mkdir()
+        (repository / "index.5").touch()
+        borg = tmp_path / "borg"
+        borg.write_text(f"#!/bin/sh\necho '{json.dumps(LISTING)}'\n")
+        borg.chmod(0o755)
+        return {"repository": repository.as_posix(), "borg_binary": borg.as_posix()}
+
+    def test_refresh_and_load(self, tmp_path, monkeypatch):
+        config = self.setup_config(tmp_path, monkeypatch)
+        assert archives.load_archive_cache(config, 3600) is None
+        cache = archives.refresh_archive_cache(config, {})
+        assert cache["transaction"] == 5
+        assert archives.get_archive_cache_file(config).stat().st_mode & 0o777 == 0o600
+        assert archives.load_archive_cache(config, 3600)["list"] == LISTING
+        # too old
+        assert archives.load_archive_cache(config, -1) is None
+
+    def test_repository_changed(self, tmp_path, monkeypatch):
+        config = self.setup_config(tmp_path, monkeypatch)
+        archives.refresh_archive_cache(config, {})
+        (tmp_path / "repo" / "index.5").rename(tmp_path / "repo" / "index.6")
+        assert archives.load_archive_cache(config, 3600) is None
+
+    def test_show_cached_list(self, tmp_path, monkeypatch, capsys):
+        config = self.setup_config(tmp_path, monkeypatch)
+        envs = []
+
+        def get_env():
+            envs.append({})
+            return {}
+
+        assert archives.show_cached_list(config, get_env, ["--cached", "--last", "1"]) == 0
+        out = capsys.readouterr().out.splitlines()
+        assert out == ["host_2024-01-02_03:00:00             Tue, 2024-01-02 03:00:00 [22]"]
+        assert archives.show_cached_list(config, get_env, ["--cached", "--json"]) == 0
+        assert json.loads(capsys.readouterr().out) == LISTING
+        # the env (and the passphrase) was only needed to update the cache the first time
+        assert len(envs) == 1
+
+    def test_invalid_arguments(self, tmp_path, monkeypatch):
+        config = self.setup_config(tmp_path, monkeypatch)
+        with pytest.raises(BorgCtlError) as e:
+            archives.show_cached_list(config, dict, ["--cached", "--last", "x"])
+        assert e.value.code == 2
+
+    def test_invalidate_without_cache(self, tmp_path, monkeypatch):
+        config = self.setup_config(tmp_path, monkeypatch)
+        archives.invalidate_archive_cache(config)
+        assert not (tmp_path / "archive_cache").exists()
@@ -0,0 +1,206 @@
+import json
+import logging
+import logging.handlers
+import os
+import platform
+import queue
+import subprocess
+import sys
+import time
+
+import pytest
+
+from borgctl import archives, execute_borg, prepare_borg_create, run_borg_command, state, utils
+from borgctl.events import stream_borg
+from borgctl.history import StatsCollector, record_run
+
+
+# The overhead borgctl adds around borg. Not run by default (takes a while):
+#   BORGCTL_BENCHMARK=1 pytest tests/test_benchmark.py -s
+# The results are written to BORGCTL_BENCHMARK_RESULTS (default: benchmark.json), compare two runs with
+#   BORGCTL_BENCHMARK_BASELINE=old.json
+# BORGCTL_BENCHMARK_OUTPUT_MB is the amount of output the stub borg prints (default: 1024)
+pytestmark = pytest.mark.skipif(not os.environ.get("BORGCTL_BENCHMARK"), reason="set BORGCTL_BENCHMARK=1 to run the benchmarks")
+
+OUTPUT_MB = int(os.environ.get("BORGCTL_BENCHMARK_OUTPUT_MB", "1024"))
+CONFIG_COUNTS = (1, 10, 100, 1000)
+EXCLUDE_COUNTS = (10, 1000, 10000)
+
+# prints $STUB_OUTPUT_MB of borg like output (plain or --log-json) and exits with $STUB_EXIT_CODE.
+# Like borg, the output goes to stderr with --log-json or --json and create --json prints the stats to stdout
+STUB_BORG = """#!{python}
+import json, os, sys
+line = "A /home/user/some/directory/with/a/file/that/changed.txt\\n"
+if "--log-json" in sys.argv:
+    line = json.dumps({{"type": "file_status", "status": "A", "path": line[2:-1]}}) + "\\n"
+out = sys.stderr if "--log-json" in sys.argv or "--json" in sys.argv else sys.stdout
+chunk = line * (65536 // len(line))
+for _ in range(int(float(os.environ.get("STUB_OUTPUT_MB", "0")) * 1024**2 // len(chunk))):
+    out.write(chunk)
+if "create" in sys.argv and "--json" in sys.argv:
+    stats = {{"nfiles": 1000, "original_size": 10**9, "compressed_size": 5 * 10**8, "deduplicated_size": 10**7}}
+    print(json.dumps({{"archive": {{"name": sys.argv[-1], "duration": 1.5, "stats": stats}}}}))
+sys.exit(int(os.environ.get("STUB_EXIT_CODE", "0")))
+"""
+
+CONFIG = """repository: "/tmp/repo"
+ssh_key: ""
+prefix: "host"
+passphrase: "secret"
+mount_point: "/mnt"
+borg_create_backup_dirs: ["/home", "/etc"]
+borg_create_excludes: {excludes}
+cron_commands: ["create", "prune"]
+state_commands: ["create"]
+envs: {{}}
+borg_binary: "{borg}"
+"""
+
+results: dict[str, float] = {}
+throughputs: dict[str, float] = {}
+
+
+def timed(name, function, *args, runs=5):
+    # the fastest run is the one least disturbed by other processes on the machine
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - start)
+    results[name] = round(min(durations) * 1000, 3)
+    # stdout may be /dev/null while borg output is measured
+    print(f"{name}: {results[name]:.1f}ms", file=sys.stderr)
+    return results[name]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def save_results():
+    yield
+    if not results:
+        return
+    report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "machine": platform.machine(), "output_mb": OUTPUT_MB, "results_ms": results,
+              "throughput_mb_per_s": throughputs}
+    results_file = os.environ.get("BORGCTL_BENCHMARK_RESULTS", "benchmark.json")
+    with open(results_file, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"\nWrote {results_file}")
+    baseline_file = os.environ.get("BORGCTL_BENCHMARK_BASELINE")
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)["results_ms"]
+        for name, value in results.items():
+            if name in baseline and baseline[name]:
+                print(f"{name:<40} {baseline[name]:>10.1f}ms -> {value:>10.1f}ms ({value / baseline[name]:.2f}x)")
+
+
+@pytest.fixture
+def borg(tmp_path, monkeypatch):
+    for module in (utils, state, archives):
+        monkeypatch.setattr(module, "get_log_directory", lambda: tmp_path)
+    for module in ("borgctl", "borgctl.history", "borgctl.metrics", "borgctl.logs"):
+        monkeypatch.setattr(f"{module}.get_log_directory", lambda: tmp_path)
+    stub = tmp_path / "borg"
+    stub.write_text(STUB_BORG.format(python=sys.executable))
+    stub.chmod(0o755)
+    return stub
+
+
+def write_configs(tmp_path, borg, count, excludes=10):
+    config_dir = tmp_path / "configs"
+    config_dir.mkdir(exist_ok=True)
+    config_files = []
+    for i in range(count):
+        config_file = config_dir / f"config{i}.yml"
+        exclude_list = json.dumps([f"/home/user{j}/.cache" for j in range(excludes)])
+        config_file.write_text(CONFIG.format(excludes=exclude_list, borg=borg))
+        config_file.chmod(0o600)
+        config_files.append(config_file)
+    return config_files
+
+
+class TestBenchmark:
+
+    def test_startup(self):
+        for name, code in (("interpreter", "pass"),
+                           ("startup_generate_passphrase", "import sys; sys.argv = ['borgctl', '-p']; import borgctl; borgctl.main()")):
+            timed(name, lambda: subprocess.run([sys.executable, "-c", code], check=True, capture_output=True), runs=10)
+
+    @pytest.mark.parametrize("count", CONFIG_COUNTS)
+    def test_load_config(self, tmp_path, borg, count):
+        config_files = write_configs(tmp_path, borg, count)
+
+        def load(use_cache):
+            if not use_cache:
+                for cache_file in (tmp_path / "config_cache").glob("*.json"):
+                    cache_file.unlink()
+            for config_file in config_files:
+                utils.load_config(config_file)
+        timed(f"load_config_{count}_uncached", load, False, runs=3)
+        timed(f"load_config_{count}_cached", load, True, runs=3)
+
+    @pytest.mark.parametrize("count", EXCLUDE_COUNTS)
+    def test_prepare_borg_create(self, tmp_path, borg, count):
+        config_file = write_configs(tmp_path, borg, 1, count)[0]
+        _, config = utils.load_config(config_file)
+        timed(f"prepare_create_{count}_excludes", prepare_borg_create, config, [], config_file)
+        timed(f"prepare_create_{count}_excludes_patterns_file", prepare_borg_create,
+              dict(config, borg_create_patterns_file=True), [], config_file)
+
+    def test_execute_borg(self, borg, monkeypatch):
+        env = dict(os.environ, STUB_OUTPUT_MB=str(OUTPUT_MB))
+        with open(os.devnull, "w") as devnull:
+            monkeypatch.setattr(sys, "stdout", devnull)
+            # the stub itself, without borgctl reading its output
+            timed("stub_borg", lambda: subprocess.run([borg.as_posix()], env=env, stdout=devnull), runs=1)
+            for name, prefix in (("execute_borg_direct", ""), ("execute_borg_prefixed", "[config] ")):
+                duration = timed(name, execute_borg, [borg.as_posix(), "create"], env, prefix, runs=1)
+                throughputs[name] = round(OUTPUT_MB / (duration / 1000), 1)
+            duration = timed("stream_borg_log_json", stream_borg, [borg.as_posix(), "--log-json", "create"], env, [StatsCollector()], runs=1)
+            throughputs["stream_borg_log_json"] = round(OUTPUT_MB / (duration / 1000), 1)
+
+    def test_run_borg_command(self, tmp_path, borg, monkeypatch):
+        # everything around borg: building the command, reading the stats, writing the state file, history and metrics
+        config_file = write_configs(tmp_path, borg, 1)[0]
+        env, config = utils.load_config(config_file)
+        env = dict(env, STUB_OUTPUT_MB=str(OUTPUT_MB))
+        with open(os.devnull, "w") as devnull:
+            monkeypatch.setattr(sys, "stdout", devnull)
+            duration = timed("run_borg_command_create", run_borg_command, "create", env, config, config_file, [], runs=1)
+            throughputs["run_borg_command_create"] = round(OUTPUT_MB / (duration / 1000), 1)
+            assert run_borg_command("create", dict(env, STUB_OUTPUT_MB="0"), config, config_file, []) == 0
+            # a failed borg create: no stats, but the state file and the history are written
+            env = dict(env, STUB_EXIT_CODE="2")
+            timed("run_borg_command_create_failed", run_borg_command, "create", env, config, config_file, [], runs=1)
+            assert run_borg_command("create", dict(env, STUB_OUTPUT_MB="0"), config, config_file, []) == 2
+
+    def test_state_writes(self, tmp_path, borg):
+        def update_state(count):
+            for i in range(count):
+                state.update_state_index(f"config{i % 100}", "create", 0)
+
+        def record_runs(count):
+            for _ in range(count):
+                record_run(tmp_path / "config.yml", "create", time.time(), 1, 0, None)
+        timed("update_state_index_1000", update_state, 1000, runs=1)
+        timed("record_run_1000", record_runs, 1000, runs=1)
+
+    def test_log_writes(self, tmp_path):
+        def log(handler, count):
+            logger = logging.getLogger("borgctl-benchmark")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            try:
+                for i in range(count):
+                    logger.info(f"Executing: /usr/bin/borg --verbose create {i}")
+            finally:
+                logger.removeHandler(handler)
+        file_handler = logging.handlers.RotatingFileHandler(tmp_path / "borg.log", "a", 1024**3, 1)
+        timed("log_100000_file", log, file_handler, 100000, runs=1)
+        log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, file_handler)
+        listener.start()
+        timed("log_100000_queue", log, logging.handlers.QueueHandler(log_queue), 100000, runs=1)
+        listener.stop()
+        file_handler.close()
@@ -0,0 +1,47 @@
+from borgctl import check
+from borgctl.events import LogEvent
+
+
+class TestCheck:
+
+    def test_partial_checks(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(check, "get_log_directory", lambda: tmp_path)
+        config = {"check_max_duration": "1h", "check_full_interval": "30d"}
+        config_file = tmp_path / "test.yml"
+
+        scheduler = check.CheckScheduler(config, config_file)
+        assert scheduler.get_arguments() == ["--repository-only", "--max-duration=3600"]
+        # --max-duration stopped the check: the check cycle is not complete yet
+        scheduler(LogEvent("INFO", "finished partial segment check, last segment checked is 100", "borg.repository"))
+        scheduler.finished(0)
+        assert not scheduler.cycle_completed
+        assert scheduler.state["cycle_runs"] == 1
+
+        scheduler = check.CheckScheduler(config, config_file)
+        scheduler.get_arguments()
+        scheduler(LogEvent("INFO", "finished segment check at segment 200", "borg.repository"))
+        scheduler.finished(0)
+        assert scheduler.cycle_completed
+        assert scheduler.state["cycle_runs"] == 0
+        assert scheduler.state["last_cycle_completed"] is not None
+
+    def test_full_check(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(check, "get_log_directory", lambda: tmp_path)
+        config = {"check_max_duration": "1h", "check_full_interval": "30d"}
+        config_file = tmp_path / "test.yml"
+
+        scheduler = check.CheckScheduler(config, config_file)
+        scheduler.state["first_run"] -= 31 * 24 * 60 * 60
+        assert scheduler.get_arguments() == ["--verify-data"]
+        scheduler.finished(0)
+        assert scheduler.cycle_completed
+
+        scheduler = check.CheckScheduler(config, config_file)
+        assert scheduler.get_arguments()[0] == "--repository-only"
+
+    def test_no_segment_check_message(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(check, "get_log_directory", lambda: tmp_path)
+        scheduler = check.CheckScheduler({"check_max_duration": "1h"}, tmp_path / "test.yml")
+        scheduler.get_arguments()
+        scheduler.finished(0)
+        assert not scheduler.cycle_completed
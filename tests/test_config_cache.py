@@ -0,0 +1,58 @@
+import os
+import sys
+
+from borgctl import utils
+
+CONFIG = f"""repository: "/tmp/repo"
+ssh_key: ""
+prefix: "host"
+passphrase: "secret"
+mount_point: "/mnt"
+borg_create_backup_dirs: ["/home"]
+borg_create_excludes: []
+cron_commands: ["create"]
+state_commands: ["create"]
+envs: {{}}
+borg_binary: "{sys.executable}"
+"""
+
+
+class TestConfigCache:
+
+    def setup_config(self, tmp_path, monkeypatch, mode=0o600):
+        monkeypatch.setattr(utils, "get_log_directory", lambda: tmp_path)
+        config_file = tmp_path / "test.yml"
+        config_file.write_text(CONFIG)
+        config_file.chmod(mode)
+        return config_file
+
+    def test_cache_is_used(self, tmp_path, monkeypatch):
+        config_file = self.setup_config(tmp_path, monkeypatch)
+        env, config = utils.load_config(config_file)
+        cache_file = utils.get_config_cache_file(config_file)
+        assert cache_file.stat().st_mode & 0o777 == 0o600
+        assert utils.load_cached_config(config_file, config_file.read_bytes()) == (env, config)
+
+    def test_cache_is_invalidated(self, tmp_path, monkeypatch):
+        config_file = self.setup_config(tmp_path, monkeypatch)
+        utils.load_config(config_file)
+        config_file.write_text(CONFIG.replace('prefix: "host"', 'prefix: "other"'))
+        assert utils.load_cached_config(config_file, config_file.read_bytes()) is None
+        env, config = utils.load_config(config_file)
+        assert config["prefix"] == "other"
+
+    def test_cache_is_invalidated_by_new_borgctl(self, tmp_path, monkeypatch):
+        config_file = self.setup_config(tmp_path, monkeypatch)
+        utils.load_config(config_file)
+        monkeypatch.setattr(utils, "get_config_cache_version", lambda: "changed utils.py")
+        assert utils.load_cached_config(config_file, config_file.read_bytes()) is None
+
+    def test_cache_permissions(self, tmp_path, monkeypatch):
+        config_file = self.setup_config(tmp_path, monkeypatch, mode=0o644)
+        utils.load_config(config_file)
+        cache_file = utils.get_config_cache_file(config_file)
+        assert cache_file.stat().st_mode & 0o077 == 0
+
+        # a cache file others can write to is not trusted
+        os.chmod(cache_file, 0o622)
+        assert utils.load_cached_config(config_file, config_file.read_bytes()) is None
@@ -0,0 +1,96 @@
+import signal
+import sys
+from pathlib import Path
+
+import pytest
+
+import borgctl
+from borgctl import daemon, utils
+from borgctl.daemon import Daemon, Job
+from borgctl.utils import parse_duration
+
+CONFIG = f"""repository: "/tmp/repo"
+ssh_key: ""
+prefix: "host"
+passphrase: "ask"
+mount_point: "/mnt"
+borg_create_backup_dirs: ["/home"]
+borg_create_excludes: []
+cron_commands: ["create"]
+state_commands: ["create"]
+envs: {{}}
+borg_binary: "{sys.executable}"
+"""
+
+
+class TestDaemon:
+
+    def test_parse_duration(self):
+        assert parse_duration(90) == 90
+        assert parse_duration("90") == 90
+        assert parse_duration("90s") == 90
+        assert parse_duration("15m") == 15 * 60
+        assert parse_duration("1.5h") == 90 * 60
+        assert parse_duration("1d") == 24 * 60 * 60
+        for invalid in ("", "1w", "d", "-1h"):
+            with pytest.raises(ValueError):
+                parse_duration(invalid)
+
+    def test_schedule(self):
+        job = Job(Path("test.yml"), {}, {}, interval=3600, jitter=60)
+        # never ran: run now (plus jitter)
+        job.schedule(1000)
+        assert 1000 <= job.next_run <= 1060
+        # ran recently: wait for the interval
+        job.last_run = 900
+        job.schedule(1000)
+        assert 4500 <= job.next_run <= 4560
+        # overdue: run now
+        job.last_run = -5000
+        job.schedule(1000)
+        assert 1000 <= job.next_run <= 1060
+
+    def setup_daemon(self, tmp_path, monkeypatch):
+        for module in (utils, daemon):
+            monkeypatch.setattr(module, "get_log_directory", lambda: tmp_path)
+        config_file = tmp_path / "test.yml"
+        config_file.write_text(CONFIG)
+        config_file.chmod(0o600)
+        return Daemon([config_file], 1, tmp_path / "borgctl.sock")
+
+    @pytest.mark.parametrize("exception", [RuntimeError("broken"), SystemExit(1)])
+    def test_run_job_failed(self, tmp_path, monkeypatch, exception):
+        instance = self.setup_daemon(tmp_path, monkeypatch)
+
+        def run_cron_commands(*args):
+            raise exception
+
+        monkeypatch.setattr(borgctl, "run_cron_commands", run_cron_commands)
+        job = Job(Path("test.yml"), {}, {}, interval=3600, jitter=0, state="queued")
+        instance.run_job(job)
+        assert job.state == "idle"
+        assert job.last_exit_code == 2
+        assert job.next_run > job.last_run
+
+    def test_reload_keeps_passphrase(self, tmp_path, monkeypatch):
+        instance = self.setup_daemon(tmp_path, monkeypatch)
+        monkeypatch.setattr(sys.stdin, "isatty", lambda: True)
+
+        def ask_for_passphrase_upfront(config, env, *args):
+            config["passphrase"] = "secret"
+            return dict(env, BORG_PASSPHRASE="secret")
+
+        monkeypatch.setattr(daemon, "ask_for_passphrase_upfront", ask_for_passphrase_upfront)
+        instance.load_jobs()
+
+        def ask_again(*args):
+            raise AssertionError("asked for the passphrase again")
+
+        monkeypatch.setattr(daemon, "ask_for_passphrase_upfront", ask_again)
+        instance.handle_signal(signal.SIGHUP, None)
+        assert instance.reload_requested
+        # what the main loop does after SIGHUP
+        instance.load_jobs()
+        job = next(iter(instance.jobs.values()))
+        assert job.env["BORG_PASSPHRASE"] == "secret"
+        assert job.config["passphrase"] == "secret"
@@ -0,0 +1,41 @@
+from borgctl.events import BorgEventParser, OutputEvent, LogEvent, ProgressEvent, ArchiveProgressEvent, format_size
+
+
+class TestEvents:
+
+    def test_parse_stdout(self):
+        event = BorgEventParser().parse('{"archives": []}', "stdout")
+        assert event == OutputEvent('{"archives": []}')
+
+    def test_parse_log_message(self):
+        line = '{"type": "log_message", "time": 1, "levelname": "WARNING", "name": "borg.archiver", "message": "oh", "msgid": "Odd"}'
+        event = BorgEventParser().parse(line, "stderr")
+        assert event == LogEvent("WARNING", "oh", "borg.archiver", "Odd")
+
+    def test_parse_no_json(self):
+        event = BorgEventParser().parse("Remote: ssh: Could not resolve hostname", "stderr")
+        assert isinstance(event, LogEvent)
+        assert event.level == "WARNING"
+
+    def test_parse_progress_percent(self):
+        line = '{"type": "progress_percent", "msgid": "check.segments", "message": "Checking segments 50%", "current": 5, "total": 10, "finished": false}'
+        event = BorgEventParser().parse(line, "stderr")
+        assert isinstance(event, ProgressEvent)
+        assert event.percent == 50.0
+        assert event.operation == "check.segments"
+
+    def test_parse_archive_progress(self):
+        parser = BorgEventParser()
+        parser.start = 100
+        line = '{"type": "archive_progress", "original_size": 1000, "compressed_size": 500, "deduplicated_size": 10, "nfiles": 20, "path": "a", "time": 110}'
+        event = parser.parse(line, "stderr")
+        assert isinstance(event, ArchiveProgressEvent)
+        assert event.files_per_sec == 2
+        assert event.bytes_per_sec == 100
+        finished = parser.parse('{"type": "archive_progress", "finished": true, "time": 111}', "stderr")
+        assert finished.finished
+        assert finished.nfiles == 20
+
+    def test_format_size(self):
+        assert format_size(999) == "999 B"
+        assert format_size(1550000000) == "1.55 GB"
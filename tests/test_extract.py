@@ -0,0 +1,132 @@
+import hashlib
+import stat
+from datetime import datetime
+
+import pytest
+
+from borgctl import extract
+from borgctl.utils import BorgCtlError
+
+
+def get_items():
+    items = [{"path": "home", "size": 0}, {"path": "home/big", "size": 10_000_000}, {"path": "home/small", "size": 0},
+             {"path": "etc", "size": 0}, {"path": "etc/passwd", "size": 1000}]
+    return items + [{"path": f"home/small/{i}", "size": 200_000} for i in range(20)]
+
+
+class TestShardedExtract:
+
+    def test_split_arguments(self):
+        cmd = ["borg", "--verbose", "extract", "--sparse", "::archive", "home", "--exclude=*.log"]
+        assert extract.split_arguments(cmd) == (["borg", "--verbose", "extract"], ["--sparse", "--exclude=*.log"], "::archive", ["home"])
+        # borg_extract_arguments like --strip-components 1
+        cmd = ["borg", "--verbose", "extract", "--strip-components", "1", "-e", "*.log", "::archive", "home"]
+        assert extract.split_arguments(cmd) == (["borg", "--verbose", "extract"], ["--strip-components=1", "-e", "*.log"], "::archive", ["home"])
+        with pytest.raises(BorgCtlError):
+            extract.split_arguments(["borg", "extract", "--strip-components", "1"])
+
+    def test_tree(self):
+        tree = extract.get_tree(get_items())
+        assert tree["home/big"] == 10_000_000 + extract.FILE_COST
+        assert tree["home/small"] == 21 * extract.FILE_COST + 20 * 200_000
+        assert tree["home"] == tree["home/big"] + tree["home/small"] + extract.FILE_COST
+
+    def test_units(self):
+        tree = extract.get_tree(get_items())
+        units, split_directories = extract.get_units(tree, 1)
+        # home is larger than a quarter of the archive: it's split, home/big can't be split
+        assert split_directories == ["home", "home/small"]
+        assert sorted(path for _, path in units) == sorted(["etc", "home/big"] + [f"home/small/{i}" for i in range(20)])
+        # small enough, nothing is split
+        assert extract.get_units({"a": 1, "b": 1, "c": 1, "d": 1, "d/x": 1}, 1) == ([(1, "a"), (1, "b"), (1, "c"), (1, "d")], [])
+
+    def test_shards(self):
+        units = [(10, ["a"]), (7, ["b"]), (6, ["c"]), (3, ["d"]), (2, ["e"]), (2, ["f"])]
+        # the largest unit goes to the shard with the lowest cost
+        assert extract.get_shards(units, 2) == [(15, ["a", "d", "f"]), (15, ["b", "c", "e"])]
+        assert extract.get_shards([(1, ["a"])], 4) == [(1, ["a"])]
+
+    def test_hardlinks(self):
+        items = get_items() + [{"path": "etc/link", "mode": "hrw-r--r--", "linktarget": "home/small/3", "size": 0},
+                               {"path": "home/link", "mode": "hrw-r--r--", "linktarget": "home/big", "size": 0}]
+        hardlinks = {}
+        tree = extract.get_tree(items, hardlinks)
+        assert hardlinks == {"etc/link": "home/small/3", "home/link": "home/big"}
+        units, _ = extract.get_units(tree, 1)
+        groups = extract.group_hardlinks(units, hardlinks)
+        # home/link is a unit on its own, etc is not split
+        assert sorted(sorted(paths) for _, paths in groups if len(paths) > 1) == [["etc", "home/small/3"], ["home/big", "home/link"]]
+        assert sum(cost for cost, _ in groups) == sum(cost for cost, _ in units)
+
+    def test_synchronized_handlers(self):
+        events = []
+        assert extract.get_synchronized_handlers(None) is None
+        handlers = extract.get_synchronized_handlers([events.append, events.append])
+        handlers[0]("event")
+        assert events == ["event", "event"]
+
+    def test_patterns(self, tmp_path):
+        extract.write_patterns(tmp_path / "patterns.lst", ["home/big"], ["home"])
+        assert (tmp_path / "patterns.lst").read_text() == "+ pp:home/big\n+ pf:home\n- fm:*\n"
+
+
+def get_item(path, local_file):
+    st = local_file.lstat()
+    return {"path": path, "mode": stat.filemode(st.st_mode), "size": st.st_size,
+            "mtime": datetime.fromtimestamp(st.st_mtime_ns / 1e9).isoformat(), "sha256": hashlib.sha256(b"data\n").hexdigest()}
+
+
+class TestDeltaExtract:
+
+    def test_parse_delta_argument(self):
+        assert extract.parse_delta_argument(["::archive"]) == (None, ["::archive"])
+        assert extract.parse_delta_argument(["--delta", "::archive"]) == ("metadata", ["::archive"])
+        assert extract.parse_delta_argument(["::archive", "--delta=checksum"]) == ("checksum", ["::archive"])
+        with pytest.raises(BorgCtlError):
+            extract.parse_delta_argument(["--delta=size"])
+
+    def test_item_changed(self, tmp_path):
+        local_file = tmp_path / "file"
+        local_file.write_text("data\n")
+        item = get_item("file", local_file)
+        assert not extract.item_changed(item, local_file.as_posix(), True)
+        assert extract.item_changed(item, (tmp_path / "missing").as_posix(), False)
+        assert extract.item_changed(dict(item, size=1), local_file.as_posix(), False)
+        assert extract.item_changed(dict(item, mtime="2000-01-01T00:00:00"), local_file.as_posix(), False)
+        assert extract.item_changed(dict(item, mode="-rwx------"), local_file.as_posix(), False)
+        # same size and mtime, only the checksum finds the change
+        assert not extract.item_changed(dict(item, sha256="0" * 64), local_file.as_posix(), False)
+        assert extract.item_changed(dict(item, sha256="0" * 64), local_file.as_posix(), True)
+        # the second link of a hardlink
+        assert not extract.item_changed(dict(item, mode="h" + item["mode"][1:]), local_file.as_posix(), False)
+
+        (tmp_path / "link").symlink_to("file")
+        link = {"path": "link", "mode": "lrwxrwxrwx", "linktarget": "file"}
+        assert not extract.item_changed(link, (tmp_path / "link").as_posix(), False)
+        assert extract.item_changed(dict(link, linktarget="other"), (tmp_path / "link").as_posix(), False)
+        # the content of directories is compared item by item
+        assert not extract.item_changed({"path": "", "mode": stat.filemode((tmp_path).lstat().st_mode)}, tmp_path.as_posix(), False)
+
+    def test_changed_items(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(extract, "DELTA_BATCH_SIZE", 2)
+        (tmp_path / "home").mkdir()
+        items = []
+        for i in range(5):
+            local_file = tmp_path / "home" / str(i)
+            local_file.write_text("data\n")
+            items.append(get_item(f"backup/home/{i}", local_file))
+        (tmp_path / "home" / "3").unlink()
+        items.append({"path": "backup", "mode": "drwxr-xr-x"})
+        changed = extract.get_changed_items(items, 1, False, workers=2)
+        # the stripped item (backup) is not extracted by borg
+        assert [item["path"] for item in changed] == ["backup/home/3"]
+
+    def test_list_archive(self, tmp_path):
+        borg = tmp_path / "borg"
+        borg.write_text("#!/bin/sh\n[ \"$3\" = ::missing ] && exit 2\necho '{\"path\": \"home\"}'\n")
+        borg.chmod(0o755)
+        assert list(extract.list_archive(borg.as_posix(), {}, "::archive", [])) == [{"path": "home"}]
+        # before the first item is used
+        with pytest.raises(BorgCtlError):
+            extract.list_archive(borg.as_posix(), {}, "::missing", [])
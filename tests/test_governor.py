@@ -0,0 +1,25 @@
+from borgctl.governor import apply_resource_limits, split_upload_budget
+
+
+class TestGovernor:
+
+    def test_apply_resource_limits(self):
+        cmd = ["/usr/bin/borg", "--verbose", "create"]
+        assert apply_resource_limits(cmd, {}) == cmd
+
+        config = {"nice": 10, "ionice_class": "idle", "ionice_priority": 7, "upload_ratelimit": 1000}
+        limited = apply_resource_limits(cmd, config)
+        assert limited[limited.index("ionice"):] == ["ionice", "-c", "3", "nice", "-n", "10", "/usr/bin/borg",
+                                                     "--upload-ratelimit=1000", "--verbose", "create"]
+
+        limited = apply_resource_limits(cmd, {"ionice_priority": 5, "cpu_affinity": [0, 2]})
+        assert limited[:7] == ["taskset", "--cpu-list", "0,2", "ionice", "-c", "2", "-n"]
+
+    def test_split_upload_budget(self):
+        configs = [{}, {"upload_ratelimit": 100}, {"upload_ratelimit": 5000}]
+        split_upload_budget(configs, 3000, slots=2)
+        assert [config["upload_ratelimit"] for config in configs] == [1500, 100, 1500]
+
+        configs = [{}]
+        split_upload_budget(configs, 3000, slots=4)
+        assert configs[0]["upload_ratelimit"] == 3000
@@ -1,6 +1,6 @@
 from borgctl.helper import parse_borg_repository
 import pytest
-import os
+import getpass
 
 
 class TestTools:
@@ -10,7 +10,7 @@ class TestTools:
             ("ssh://user1@backuphost:/opt/dir", ("user1", "backuphost", "/opt/dir")),
             ("user1@backuphost:/opt/dir", ("user1", "backuphost", "/opt/dir")),
             ("root@backup-1.my.domain:/media", ("root", "backup-1.my.domain", "media")),
-            ("backup-1.my.domain:/media", (os.getlogin(), "backup-1.my.domain", "media")),
+            ("backup-1.my.domain:/media", (getpass.getuser(), "backup-1.my.domain", "media")),
         ]
     )
     def test_parse_borg_repository_valid(self, repo, result):
@@ -0,0 +1,62 @@
+import json
+from pathlib import Path
+
+from borgctl import execute_borg
+from borgctl import history
+from borgctl.history import StatsCollector, load_history, percentile, record_run, summarize
+
+
+def run(duration, deduplicated_size=None, exit_code=0):
+    entry = {"time": "2024-01-01T00:00:00", "command": "create", "duration": duration, "exit_code": exit_code}
+    if deduplicated_size is not None:
+        entry.update({"original_size": 10**9, "compressed_size": 10**8, "deduplicated_size": deduplicated_size,
+                      "nfiles": 10, "throughput": 1000 / duration})
+    return entry
+
+
+class TestHistory:
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile([3], 90) == 3
+
+    def test_summarize_no_regression(self):
+        summary = summarize([run(10, 100), run(11, 100), run(9, 100), run(10, 120)])
+        assert summary["runs"] == 4
+        assert summary["median_duration"] == 10
+        assert summary["regressions"] == []
+
+    def test_summarize_regressions(self):
+        summary = summarize([run(10, 100), run(11, 100), run(9, 100), run(40, 1000, exit_code=2)])
+        assert summary["failed"] == 1
+        assert len(summary["regressions"]) == 3
+        assert summary["regressions"][0].startswith("took 4.0x longer")
+
+    def test_summarize_without_stats(self):
+        summary = summarize([run(10), run(12)])
+        assert "last_throughput" not in summary
+
+    def test_record_run(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(history, "get_log_directory", lambda: tmp_path)
+        monkeypatch.setattr(history, "HISTORY_MAX_SIZE", 1000)
+        config_file = Path("/etc/borgctl/test.yml")
+        record_run(config_file, "list", 0, 1, 0, None)
+        assert load_history(config_file) == []
+        for i in range(20):
+            record_run(config_file, "create", 0, i, 0, None)
+        runs = load_history(config_file)
+        # the oldest runs were dropped
+        assert history.get_history_file(config_file).stat().st_size <= 1000
+        assert 0 < len(runs) < 20
+        assert runs[-1]["duration"] == 19
+
+    def test_stats_without_log_json(self, capfd):
+        output = {"archive": {"name": "test", "duration": 2.0, "stats": {"nfiles": 3, "original_size": 100,
+                                                                         "compressed_size": 50, "deduplicated_size": 10}}}
+        cmd = ["sh", "-c", f"echo '{json.dumps(output)}'; echo 'borg log' >&2"]
+        stats = StatsCollector()
+        assert execute_borg(cmd, {}, stats=stats) == 0
+        assert stats.stats is not None and stats.stats.deduplicated_size == 10
+        assert "borg log" in capfd.readouterr().out
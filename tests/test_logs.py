@@ -0,0 +1,59 @@
+import gzip
+import json
+import logging
+import logging.handlers
+
+from borgctl import logs, utils
+from borgctl.utils import current_config
+
+
+class TestLogs:
+
+    def test_json_formatter(self):
+        record = logging.LogRecord("root", logging.INFO, __file__, 1, "\aUsing config file %s", ("default.yml", ), None)
+        record.config = "default"
+        entry = json.loads(logs.JsonFormatter().format(record))
+        assert entry["level"] == "INFO" and entry["config"] == "default"
+        assert entry["message"] == "Using config file default.yml"
+
+    def test_config_file_handler(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(logs, "get_log_directory", lambda: tmp_path)
+        monkeypatch.setitem(logs.settings, "compression", "gzip")
+        handler = logs.ConfigFileHandler(100, 1)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log_filter = logs.ConfigFilter()
+        for config in ("first", "second", None):
+            current_config.set(config)
+            for i in range(10):
+                record = logging.LogRecord("root", logging.INFO, __file__, 1, f"{config} line {i:02}", None, None)
+                log_filter.filter(record)
+                handler.handle(record)
+        handler.close()
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["borg_first.log", "borg_first.log.1.gz",
+                                                                    "borg_second.log", "borg_second.log.1.gz"]
+        assert "first line 09" in (tmp_path / "borg_first.log").read_text()
+        assert "second line" not in (tmp_path / "borg_first.log").read_text()
+        assert gzip.decompress((tmp_path / "borg_second.log.1.gz").read_bytes()).decode().startswith("second line")
+
+    def test_init_logging_once(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(utils, "get_conf_directory", lambda: tmp_path)
+        monkeypatch.setattr(utils, "get_log_directory", lambda: tmp_path)
+        stop_listeners = []
+        monkeypatch.setattr(logs.atexit, "register", stop_listeners.append)
+        root = logging.getLogger()
+        handlers, level = list(root.handlers), root.level
+        disabled = {name: logger.disabled for name, logger in logging.root.manager.loggerDict.items()
+                    if isinstance(logger, logging.Logger)}
+        utils.init_logging.cache_clear()
+        try:
+            utils.init_logging()
+            utils.init_logging()
+            assert len(stop_listeners) == 1
+            assert len([handler for handler in root.handlers if isinstance(handler, logging.handlers.QueueHandler)]) == 1
+        finally:
+            for stop in stop_listeners:
+                stop()
+            utils.init_logging.cache_clear()
+            root.handlers, root.level = handlers, level
+            for name, value in disabled.items():
+                logging.getLogger(name).disabled = value
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from borgctl import metrics
+from borgctl.metrics import render_metrics, update_metrics
+
+
+class TestMetrics:
+
+    def test_render_metrics(self):
+        state = {
+            "create": {"last_run": 100.5, "last_success": 100.5, "duration": 30, "exit_code": 0,
+                       "consecutive_failures": 0, "original_size": 1000, "deduplicated_size": 10},
+            "prune": {"last_run": 200, "duration": 1, "exit_code": 2, "consecutive_failures": 3},
+        }
+        prom = render_metrics("backend1", state)
+        assert 'borgctl_last_success_timestamp_seconds{config="backend1",command="create"} 100.5' in prom
+        assert 'borgctl_consecutive_failures{config="backend1",command="prune"} 3' in prom
+        assert 'borgctl_last_success_timestamp_seconds{config="backend1",command="prune"}' not in prom
+        assert prom.count("# TYPE") == 7
+        assert prom.endswith("\n")
+
+    def test_escape_label_values(self):
+        prom = render_metrics('back"end\\1\n', {"create": {"exit_code": 0}})
+        assert 'borgctl_last_exit_code{config="back\\"end\\\\1\\n",command="create"} 0' in prom
+
+    def test_unwritable_textfile_dir(self, tmp_path, monkeypatch, caplog):
+        monkeypatch.setattr(metrics, "get_log_directory", lambda: tmp_path)
+        config = {"prometheus_textfile_dir": (tmp_path / "missing").as_posix()}
+        update_metrics(config, Path("/etc/borgctl/test.yml"), "create", 0, 1, 0, None)
+        assert "Could not write the metrics" in caplog.text
+        # no temporary files are left behind
+        assert [file.name for file in tmp_path.iterdir()] == ["borg_metrics_test.json"]
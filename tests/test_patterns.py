@@ -0,0 +1,71 @@
+from pathlib import Path
+
+from borgctl.patterns import Pattern, PatternMatcher, check_excludes, compile_excludes, format_pattern, get_local_path
+
+
+class TestPatterns:
+
+    def test_fnmatch(self):
+        # default style of --exclude, * also matches /
+        pattern = Pattern("/home/*/.cache")
+        assert pattern.match("home/user/.cache")
+        assert pattern.match("home/user/.cache/file")
+        assert pattern.match("home/a/b/.cache")
+        assert not pattern.match("home/user/.cache2")
+        assert Pattern("*.pyc").match("home/user/test.pyc")
+        assert Pattern("home/user/").match("home/user/file")
+        assert not Pattern("home/user/").match("home/user")
+
+    def test_shell(self):
+        pattern = Pattern("sh:home/*/.cache")
+        assert pattern.match("home/user/.cache/file")
+        assert not pattern.match("home/a/b/.cache")
+        assert Pattern("sh:home/**/.cache").match("home/a/b/.cache")
+        assert Pattern("sh:**/*.pyc").match("home/test.pyc")
+        assert Pattern("sh:home/[ab]?c").match("home/axc")
+
+    def test_path_prefix_full_regex(self):
+        assert Pattern("pp:/home/user").match("home/user/file")
+        assert not Pattern("pp:/home/user").match("home/user2")
+        assert Pattern("pf:/home/user/file").match("home/user/file")
+        assert not Pattern("pf:/home/user").match("home/user/file")
+        assert Pattern("re:\\.tmp$").match("home/user/a.tmp")
+        assert not Pattern("re:^\\.tmp").match("home/user/.tmp")
+
+    def test_matcher(self):
+        matcher = PatternMatcher(["*.pyc", "pp:/var/cache"])
+        assert matcher.first_match("var/cache/x.pyc").original == "*.pyc"
+        assert matcher.excluded("var/cache/apt")
+        assert not matcher.excluded("var/lib")
+
+    def test_compile_excludes(self):
+        excludes = ["re:\\.tmp$", "*.pyc", "/home/user/.cache", "/home/user/.cache/thumbnails", "fm:/var/cache",
+                    "sh:/var/lib/**/*.log", "pp:/home/user/.cache", "/home/*/Downloads"]
+        compiled = [format_pattern(pattern) for pattern in compile_excludes(excludes)]
+        assert compiled == ["pp:/home/user/.cache", "pp:/var/cache", "fm:*.pyc", "fm:/home/*/Downloads",
+                            "sh:/var/lib/**/*.log", "re:\\.tmp$"]
+
+        # same result as the original excludes
+        original, optimized = PatternMatcher(excludes), PatternMatcher(compile_excludes(excludes))
+        for path in ("home/user/.cache/x", "home/user/.cache2", "var/cache", "var/lib/a/b.log", "home/a/Downloads/x",
+                     "tmp/a.tmp", "home/user/file"):
+            assert original.excluded(path) == optimized.excluded(path)
+
+    def test_get_local_path(self):
+        assert get_local_path("home/user/.cache", [Path("/etc"), Path("/home")]) == Path("/home/user/.cache")
+        assert get_local_path("home", [Path("/home/")]) == Path("/home")
+        assert get_local_path("data/cache", [Path("data")]) == Path("data/cache")
+        assert get_local_path("srv/cache", [Path(".")]) == Path("srv/cache")
+        assert get_local_path("srv/cache", [Path("/home")]) is None
+
+    def test_check_excludes(self, tmp_path, monkeypatch, caplog):
+        (tmp_path / "data" / "cache").mkdir(parents=True)
+        # data/tmp is missing in the backup directory, even if it exists relative to the working directory
+        cwd = tmp_path / "cwd"
+        (cwd / tmp_path.relative_to("/") / "data" / "tmp").mkdir(parents=True)
+        monkeypatch.chdir(cwd)
+        patterns = compile_excludes([f"{tmp_path}/data/cache", f"{tmp_path}/data/tmp", "/data/cache"])
+        check_excludes(patterns, [tmp_path / "data"])
+        assert f"{tmp_path}/data/cache does not exist" not in caplog.text
+        assert f"{tmp_path}/data/tmp does not exist" in caplog.text
+        assert "/data/cache is not in one of the backup directories" in caplog.text
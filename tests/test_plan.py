@@ -0,0 +1,27 @@
+from borgctl import plan
+
+
+class TestPlan:
+
+    def test_scan_backup_dirs(self, tmp_path):
+        data = tmp_path / "data"
+        (data / "big" / "sub").mkdir(parents=True)
+        (data / "small").mkdir()
+        (data / "big" / "sub" / "file").write_bytes(b"x" * 1000)
+        (data / "big" / "file").write_bytes(b"x" * 500)
+        (data / "small" / "file").write_bytes(b"x" * 10)
+        (data / "small" / "excluded").write_bytes(b"x" * 10000)
+        config = {"borg_create_backup_dirs": [data.as_posix()], "borg_create_excludes": ["*/excluded"]}
+
+        scan = plan.scan_backup_dirs(config, depth=1)
+        assert scan["files"] == 3
+        assert scan["size"] == 1510
+        assert scan["subtrees"] == {(data / "big").as_posix(): 1500, (data / "small").as_posix(): 10}
+
+    def test_predict_duration(self):
+        incremental = {"original_size": 10 * 1000**3, "deduplicated_size": 10 * 1000**2, "throughput": 1000}
+        full = {"original_size": 10 * 1000**3, "deduplicated_size": 8 * 1000**3, "throughput": 50}
+        # only incremental runs: unchanged files were skipped, the first create takes longer
+        assert plan.predict_duration(100 * 1000**3, [incremental, incremental]) == (100, 1000, 2, True)
+        # the throughput of full runs is used
+        assert plan.predict_duration(100 * 1000**3, [full, incremental, incremental]) == (2000, 50, 1, False)
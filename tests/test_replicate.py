@@ -0,0 +1,114 @@
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from borgctl import replicate, state
+from borgctl.utils import BorgCtlError
+
+
+class TestReplicate:
+
+    def setup(self, monkeypatch, returncodes=None, outputs=None, destination_id=None, errors=None):
+        # call 1 lists the destination (empty by default), call 2 copies the segments, ...
+        calls = []
+
+        def run(cmd, env, output_prefix, **kwargs):
+            calls.append(cmd)
+            if destination_id and cmd[-2].endswith("/config"):
+                Path(cmd[-1], "config").write_text(f"[repository]\nid = {destination_id}\n")
+            return subprocess.CompletedProcess(cmd, (returncodes or {}).get(len(calls), 0), (outputs or {}).get(len(calls), ""),
+                                               (errors or {}).get(len(calls), ""))
+        monkeypatch.setattr(replicate, "run", run)
+        monkeypatch.setattr(replicate.shutil, "which", lambda binary: f"/usr/bin/{binary}")
+        return calls
+
+    def test_rsync_command(self, monkeypatch):
+        self.setup(monkeypatch)
+        cmd = replicate.get_rsync_command({"upload_ratelimit": 1000}, {"BORG_RSH": "ssh -i key"}, "--delete")
+        assert cmd == ["/usr/bin/rsync", "--archive", "--partial", "--exclude=/lock.exclusive", "--exclude=/lock.roster",
+                       "--delete", "--rsh=ssh -i key", "--bwlimit=1000"]
+
+    def test_replicate(self, monkeypatch):
+        calls = self.setup(monkeypatch, outputs={1: "drwx------ 4,096 2024/01/02 03:04:05 .\n", 4: ".d..t...... ./\n"})
+        config = {"repository": "/backup/repo", "borg_binary": "borg", "replicate_check": True}
+        assert replicate.replicate_repository(config, {}, "offsite:/backup/repo") == 0
+        # check the destination, the segments without the lock, then everything with the lock, validate, borg check
+        assert calls[0][-2:] == ["--list-only", "offsite:/backup/repo/"]
+        assert calls[1][-2:] == ["/backup/repo/", "offsite:/backup/repo/"]
+        assert calls[2][:3] == ["borg", "with-lock", "/backup/repo"]
+        assert calls[2][-3:] == ["--delete", "/backup/repo/", "offsite:/backup/repo/"]
+        assert "--dry-run" in calls[3]
+        assert calls[4] == ["borg", "check", "--repository-only", "offsite:/backup/repo"]
+
+    def test_new_destination(self, monkeypatch):
+        error = 'rsync: [sender] change_dir "/mnt/usb-disk/linbox" failed: No such file or directory (2)'
+        calls = self.setup(monkeypatch, {1: replicate.RSYNC_PARTIAL}, errors={1: error})
+        assert replicate.replicate_repository({"repository": "/repo", "borg_binary": "borg"}, {}, "/mnt/usb-disk/linbox") == 0
+        assert "--delete" in calls[2]
+        # other errors (like a failed ssh connection)
+        calls = self.setup(monkeypatch, {1: 255}, errors={1: "ssh: connect to host offsite port 22: Connection refused"})
+        assert replicate.replicate_repository({"repository": "/repo", "borg_binary": "borg"}, {}, "offsite:/repo") == 2
+        assert len(calls) == 1
+
+    def test_destination_with_other_files(self, tmp_path, monkeypatch):
+        repository = tmp_path / "repo"
+        repository.mkdir()
+        (repository / "config").write_text("[repository]\nid = 1234\n")
+        config = {"repository": repository.as_posix(), "borg_binary": "borg"}
+        listing = {1: "drwxr-xr-x 4,096 2024/01/02 03:04:05 .\n-rw-r--r-- 1,000 2024/01/02 03:04:05 holiday photo.jpg\n"}
+        # not a borg repository (no config)
+        calls = self.setup(monkeypatch, {2: replicate.RSYNC_PARTIAL}, listing)
+        assert replicate.replicate_repository(config, {}, "/mnt/usb-disk") == 2
+        assert len(calls) == 2
+        # another borg repository
+        calls = self.setup(monkeypatch, outputs=listing, destination_id="5678")
+        assert replicate.replicate_repository(config, {}, "/mnt/usb-disk") == 2
+        assert len(calls) == 2
+        # a copy of the repository
+        calls = self.setup(monkeypatch, outputs=listing, destination_id="1234")
+        assert replicate.replicate_repository(config, {}, "/mnt/usb-disk/linbox") == 0
+        assert "--delete" in calls[3]
+
+    def test_without_check(self, monkeypatch):
+        calls = self.setup(monkeypatch)
+        assert replicate.replicate_repository({"repository": "/repo", "borg_binary": "borg", "replicate_check": False}, {}, "/copy") == 0
+        assert len(calls) == 4
+
+    @pytest.mark.skipif(shutil.which("rsync") is None, reason="rsync is not installed")
+    def test_fresh_destination(self, tmp_path):
+        repository = tmp_path / "repo"
+        (repository / "data" / "0").mkdir(parents=True)
+        (repository / "data" / "0" / "1").write_bytes(b"segment")
+        (repository / "config").write_text("[repository]\n")
+        # borg with-lock runs the command, borg check succeeds
+        borg = tmp_path / "borg"
+        borg.write_text('#!/bin/sh\n[ "$1" = with-lock ] && shift 2 && exec "$@"\nexit 0\n')
+        borg.chmod(0o755)
+        destination = tmp_path / "usb-disk" / "linbox"
+        (tmp_path / "usb-disk").mkdir()
+        config = {"repository": repository.as_posix(), "borg_binary": borg.as_posix()}
+        assert replicate.replicate_repository(config, dict(os.environ), destination.as_posix()) == 0
+        assert (destination / "data" / "0" / "1").read_bytes() == b"segment"
+        assert (destination / "config").exists()
+
+    def test_vanished_segment(self, monkeypatch):
+        self.setup(monkeypatch, {2: replicate.RSYNC_VANISHED})
+        assert replicate.replicate_repository({"repository": "/repo", "borg_binary": "borg"}, {}, "/copy") == 0
+        self.setup(monkeypatch, {3: 12})
+        assert replicate.replicate_repository({"repository": "/repo", "borg_binary": "borg"}, {}, "/copy") == 2
+
+    def test_differences(self, monkeypatch):
+        self.setup(monkeypatch, outputs={4: ">f+++++++++ data/0/17\n"})
+        assert replicate.replicate_repository({"repository": "/repo", "borg_binary": "borg"}, {}, "/copy") == 2
+
+    def test_replicate_state(self, tmp_path, monkeypatch):
+        self.setup(monkeypatch)
+        monkeypatch.setattr(state, "get_log_directory", lambda: tmp_path)
+        config = {"repository": "/repo", "borg_binary": "borg", "replicate_to": ["/copy1", "/copy2"]}
+        assert replicate.replicate(config, {}, tmp_path / "default.yml") == 0
+        assert state.load_state_index()["default"]["replicate"]["exit_code"] == 0
+        with pytest.raises(BorgCtlError):
+            replicate.get_local_repository({"repository": "user@host:/repo"})
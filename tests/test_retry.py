@@ -0,0 +1,47 @@
+import sys
+
+import pytest
+
+from borgctl.events import LogEvent
+from borgctl.retry import RetryPolicy, ErrorCollector
+from borgctl.utils import BorgCtlError, check_config
+
+CONFIG = {"repository": "/repo", "ssh_key": "", "prefix": "host", "passphrase": "", "mount_point": "/mnt",
+          "borg_create_backup_dirs": [], "borg_create_excludes": [], "envs": {}, "borg_binary": sys.executable,
+          "cron_commands": [], "state_commands": []}
+
+
+class TestRetry:
+
+    def test_get_delay(self):
+        policy = RetryPolicy.from_config({"retry_attempts": 3, "retry_backoff": "10s", "retry_max_time": "1m"})
+        assert policy.get_delay(0, 0, 0, []) is None
+        assert policy.get_delay(1, 0, 0, []) is None
+        assert policy.get_delay(2, 0, 0, ["LockTimeout"]) == 10
+        assert policy.get_delay(2, 1, 0, ["ConnectionClosed"]) == 20
+        # retry_max_time
+        assert policy.get_delay(2, 2, 30, ["LockTimeout"]) is None
+        assert policy.get_delay(2, 3, 0, ["LockTimeout"]) is None
+
+    def test_only_transient_errors_by_default(self):
+        policy = RetryPolicy.from_config({"retry_attempts": 3})
+        assert policy.get_delay(2, 0, 0, []) is None
+        assert policy.get_delay(2, 0, 0, ["PassphraseWrong"]) is None
+        # opt-in: every exit code 2
+        policy = RetryPolicy.from_config({"retry_attempts": 3, "retry_exit_codes": [2]})
+        assert policy.get_delay(2, 0, 0, ["PassphraseWrong"]) == 60
+
+    def test_msgids(self):
+        policy = RetryPolicy.from_config({"retry_attempts": 1, "retry_msgids": ["ConnectionClosed"]})
+        collector = ErrorCollector()
+        collector(LogEvent("ERROR", "Connection closed by remote host", "borg.archiver", "ConnectionClosed"))
+        collector(LogEvent("INFO", "Creating archive", "borg.archiver", "Info"))
+        assert collector.msgids == ["ConnectionClosed"]
+        assert policy.get_delay(2, 0, 0, collector.msgids) == 60
+        assert policy.get_delay(2, 0, 0, ["Repository.DoesNotExist"]) is None
+
+    def test_config(self):
+        # the msgids don't need log_json: true, borgctl adds --log-json itself
+        check_config(dict(CONFIG, retry_attempts=1, retry_msgids=["LockTimeout"]))
+        with pytest.raises(BorgCtlError):
+            check_config(dict(CONFIG, retry_attempts=1, retry_commands=["create", "extract"]))
@@ -0,0 +1,59 @@
+from borgctl import scan
+from borgctl.patterns import PatternMatcher
+
+
+def create_tree(tmp_path):
+    data = tmp_path / "data"
+    (data / "sub").mkdir(parents=True)
+    (data / ".cache").mkdir()
+    (data / "file").write_text("file")
+    (data / "sub" / "file").write_text("sub file")
+    (data / ".cache" / "file").write_text("cache")
+    return data
+
+
+class TestScan:
+
+    def test_walk(self, tmp_path):
+        data = create_tree(tmp_path)
+        matcher = PatternMatcher([(data / ".cache").as_posix()])
+        entries = {entry.path: entry for _, dir_entries in scan.walk([data], matcher) for entry in dir_entries}
+        assert sorted(entries) == [(data / "file").as_posix(), (data / "sub").as_posix(), (data / "sub" / "file").as_posix()]
+        assert entries[(data / "sub" / "file").as_posix()].size == 8
+        assert entries[(data / "sub").as_posix()].is_dir
+
+    def test_change_detector(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(scan, "get_log_directory", lambda: tmp_path)
+        data = create_tree(tmp_path)
+        config = {"borg_create_backup_dirs": [data.as_posix()], "borg_create_excludes": [(data / ".cache").as_posix()]}
+        config_file = tmp_path / "test.yml"
+
+        detector = scan.ChangeDetector(config, config_file)
+        assert not detector.unchanged()
+        detector.save()
+        assert scan.ChangeDetector(config, config_file).unchanged()
+
+        # excluded files don't matter
+        (data / ".cache" / "file").write_text("changed")
+        assert scan.ChangeDetector(config, config_file).unchanged()
+
+        (data / "sub" / "file").write_text("changed")
+        assert not scan.ChangeDetector(config, config_file).unchanged()
+
+        config["borg_create_excludes"] = []
+        assert not scan.ChangeDetector(config, config_file).unchanged()
+
+    def test_file_roots(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(scan, "get_log_directory", lambda: tmp_path)
+        data = create_tree(tmp_path)
+        (data / "other").write_text("other")
+        # both are yielded as data
+        config = {"borg_create_backup_dirs": [(data / "file").as_posix(), (data / "other").as_posix()], "borg_create_excludes": []}
+        config_file = tmp_path / "test.yml"
+
+        detector = scan.ChangeDetector(config, config_file)
+        assert not detector.unchanged()
+        detector.save()
+        assert scan.ChangeDetector(config, config_file).unchanged()
+        (data / "file").write_text("changed")
+        assert not scan.ChangeDetector(config, config_file).unchanged()
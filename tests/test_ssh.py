@@ -0,0 +1,48 @@
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+from borgctl import ssh
+from borgctl.helper import parse_borg_repository
+
+
+class TestSsh:
+
+    def test_parse_ssh_url(self):
+        assert parse_borg_repository("ssh://user1@backuphost:2222/./repo") == ("user1", "backuphost", "/./repo")
+        assert parse_borg_repository("ssh://user1@backuphost/opt/dir") == ("user1", "backuphost", "/opt/dir")
+
+    def test_setup_multiplexing(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(ssh, "get_log_directory", lambda: tmp_path)
+        monkeypatch.setattr(ssh, "control_paths", {})
+        config = {"repository": "ssh://user1@backuphost:2222/./repo", "ssh_key": "/root/.ssh/borg_default"}
+        env = ssh.setup_multiplexing(config, {"BORG_RSH": "ssh -i /root/.ssh/borg_default"})
+        rsh = shlex.split(env["BORG_RSH"])
+        assert rsh[:3] == ["ssh", "-i", "/root/.ssh/borg_default"]
+        assert "ControlMaster=auto" in rsh and "ControlPersist=300" in rsh
+        control_path = next(option for option in rsh if option.startswith("ControlPath="))
+        assert control_path.startswith(f"ControlPath={tmp_path}/ssh/")
+
+        # same user, host and key: same connection
+        other = ssh.setup_multiplexing(dict(config, repository="ssh://user1@backuphost:2222/./other"), {"BORG_RSH": "ssh -i /root/.ssh/borg_default"})
+        assert control_path in shlex.split(other["BORG_RSH"])
+        assert len(ssh.control_paths) == 1
+        assert list(ssh.control_paths.values())[0][-1] == "ssh://user1@backuphost:2222"
+
+    def test_no_ssh(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(ssh, "get_log_directory", lambda: tmp_path)
+        config = {"repository": "/opt/backup", "ssh_key": ""}
+        assert ssh.setup_multiplexing(config, {}) == {}
+        assert parse_borg_repository("/opt/backup") == (None, None, None)
+        env = {"BORG_RSH": "ssh -o ControlPath=/tmp/x"}
+        assert ssh.setup_multiplexing(dict(config, repository="user1@backuphost:/opt/dir"), env) == env
+
+    def test_parallel_setup(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(ssh, "get_log_directory", lambda: tmp_path)
+        monkeypatch.setattr(ssh, "control_paths", {})
+        registered = []
+        monkeypatch.setattr(ssh.atexit, "register", registered.append)
+        configs = [{"repository": f"user{i}@backuphost:/opt/dir", "ssh_key": ""} for i in range(50)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda config: ssh.setup_multiplexing(config, {}), configs))
+        assert len(ssh.control_paths) == 50
+        assert registered == [ssh.stop_masters]
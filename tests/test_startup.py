@@ -0,0 +1,52 @@
+import compileall
+import os
+import subprocess
+import sys
+import time
+
+import borgctl as borgctl_module
+
+
+# borgctl is called by monitoring hooks and shell prompts. The cheap code paths (--list, --version, -p, ...)
+# may add at most STARTUP_BUDGET_MS to the interpreter start and take at most STARTUP_FACTOR times as long as
+# importing the stdlib modules borgctl can't do without. Shared CI runners are slow and busy, they get more
+# time. BORGCTL_STARTUP_BUDGET_MS overrides the budget
+STARTUP_FACTOR = 1.5
+STARTUP_BUDGET_MS = int(os.environ.get("BORGCTL_STARTUP_BUDGET_MS", 150 if os.environ.get("CI") else 50))
+
+STDLIB_BASELINE = "import argparse, logging, pathlib, typing"
+RUN_BORGCTL = "import sys; sys.argv = ['borgctl', '-p']; import borgctl; borgctl.main()"
+
+
+def measure(*codes, runs=20):
+    # the fastest run is the one least disturbed by other processes on the machine
+    durations = {code: [] for code in codes}
+    for _ in range(runs):
+        for code in codes:
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+            durations[code].append(time.perf_counter() - start)
+    return [min(durations[code]) * 1000 for code in codes]
+
+
+class TestStartup:
+
+    def test_no_expensive_imports(self):
+        code = "import sys, borgctl; print(' '.join(sys.modules))"
+        modules = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout.split()
+        for module in ("ruamel.yaml", "importlib.metadata", "logging.config", "getpass", "statistics",
+                       "concurrent.futures", "borgctl.helper", "borgctl.events"):
+            assert module not in modules
+
+    def test_startup_time(self):
+        # an installed borgctl has its bytecode cached, compiling it is not part of the startup time
+        compileall.compile_dir(os.path.dirname(borgctl_module.__file__), quiet=1)
+        for _ in range(3):
+            interpreter, stdlib, borgctl = measure("pass", STDLIB_BASELINE, RUN_BORGCTL)
+            overhead = borgctl - interpreter
+            print(f"startup: interpreter {interpreter:.1f}ms, stdlib {stdlib:.1f}ms, borgctl -p {borgctl:.1f}ms, overhead {overhead:.1f}ms")
+            if overhead < STARTUP_BUDGET_MS:
+                break
+            # the whole machine may be slowed down for a while (throttling, other jobs). Measure again
+        assert overhead < STARTUP_BUDGET_MS
+        assert borgctl < STARTUP_FACTOR * stdlib
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from borgctl import state
+
+
+class TestState:
+
+    def test_update_state_index(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(state, "get_log_directory", lambda: tmp_path)
+        state.update_state_index("default", "create", 0)
+        state.update_state_index("default", "prune", 2)
+        state.update_state_index("other", "create", 1)
+        index = json.loads((tmp_path / "borg_state.json").read_text())
+        assert index["default"]["create"]["exit_code"] == 0
+        assert "last_success" in index["default"]["create"]
+        assert "last_failure" in index["default"]["prune"] and "last_success" not in index["default"]["prune"]
+        # warnings are neither a success nor a failure
+        assert index["other"]["create"].keys() == {"last_run", "exit_code"}
+        assert list(tmp_path.glob(".borg_state.json.*")) == []
+
+    def test_show_state(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr(state, "get_log_directory", lambda: tmp_path)
+        state.update_state_index("default", "create", 0)
+        state.update_state_index("other", "create", 2)
+        with pytest.raises(SystemExit):
+            state.show_state(["other.yml"], ["--json"])
+        assert list(json.loads(capsys.readouterr().out)) == ["other"]
+        with pytest.raises(SystemExit):
+            state.show_state(None, [])
+        out = capsys.readouterr().out
+        assert "default:" in out and "last failure" in out and "(exit code 2)" in out
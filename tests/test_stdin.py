@@ -0,0 +1,110 @@
+import json
+import sys
+
+import pytest
+
+from borgctl import run_borg_command, stdin, utils
+from borgctl.utils import BorgCtlError
+
+# records its arguments and the number of bytes it got on stdin, exits with $EXIT_CODE
+STUB_BORG = """#!{python}
+import os, sys
+count = len(sys.stdin.buffer.read()) if "-" in sys.argv else 0
+with open("{log}", "a") as f:
+    f.write(" ".join(sys.argv[1:]) + f" {{count}}\\n")
+sys.exit(int(os.environ.get("EXIT_CODE", "0")))
+"""
+
+CONFIG = """repository: "/tmp/repo"
+ssh_key: ""
+prefix: "host"
+passphrase: "secret"
+mount_point: "/mnt"
+borg_create_backup_dirs: ["/home"]
+borg_create_excludes: []
+borg_prune_arguments: ["--keep-last 10"]
+borg_create_stdin_sources: {sources}
+cron_commands: ["create", "prune"]
+state_commands: []
+history: false
+envs: {{}}
+borg_binary: "{borg}"
+"""
+
+
+class TestStdinSources:
+
+    def setup_config(self, tmp_path, sources):
+        borg = tmp_path / "borg"
+        borg.write_text(STUB_BORG.format(python=sys.executable, log=tmp_path / "borg.log"))
+        borg.chmod(0o755)
+        return {"prefix": "host", "borg_binary": borg.as_posix(), "borg_create_arguments": ["--compression=zstd"],
+                "borg_create_stdin_sources": sources}
+
+    def get_calls(self, tmp_path):
+        return (tmp_path / "borg.log").read_text().splitlines()
+
+    def test_archive_name(self):
+        config = {"prefix": "host"}
+        assert stdin.get_source_archive_name(config, {"name": "db/postgres.sql"}).startswith("::host-postgres_")
+        assert stdin.get_source_archive_name(config, {"name": "dump", "prefix": "db"}).startswith("::db_")
+
+    def test_stream(self, tmp_path, capfd):
+        config = self.setup_config(tmp_path, [{"command": "head -c 1000000 /dev/zero", "name": "zeros.bin"}])
+        assert stdin.run_stdin_sources(config, {}) == 0
+        calls = self.get_calls(tmp_path)
+        assert len(calls) == 1
+        assert calls[0].startswith("--verbose create --stats --stdin-name=zeros.bin --compression=zstd ::host-zeros_")
+        assert calls[0].endswith(" - 1000000")
+
+    def test_failed_command(self, tmp_path, capfd):
+        config = self.setup_config(tmp_path, [{"command": ["sh", "-c", "echo partial; exit 3"], "name": "db.sql"}])
+        assert stdin.run_stdin_sources(config, {}) == 2
+        calls = self.get_calls(tmp_path)
+        # the incomplete archive is deleted
+        assert calls[0].endswith(" - 8")
+        assert calls[1].startswith("--verbose delete ::host-db_")
+
+    def test_timeout(self, tmp_path, capfd):
+        config = self.setup_config(tmp_path, [{"command": "sleep 30", "name": "slow.sql", "timeout": 0.5},
+                                              {"command": "missing-command", "name": "missing.sql"}])
+        assert stdin.run_stdin_sources(config, {}) == 2
+        calls = self.get_calls(tmp_path)
+        assert len(calls) == 2
+        assert calls[1].startswith("--verbose delete ::host-slow_")
+
+    def load_config(self, tmp_path, monkeypatch, sources):
+        monkeypatch.setattr(utils, "get_log_directory", lambda: tmp_path)
+        monkeypatch.setattr("borgctl.archives.get_log_directory", lambda: tmp_path)
+        config = self.setup_config(tmp_path, sources)
+        config_file = tmp_path / "test.yml"
+        config_file.write_text(CONFIG.format(sources=json.dumps(sources), borg=config["borg_binary"]))
+        config_file.chmod(0o600)
+        env, config = utils.load_config(config_file)
+        return dict(env), config, config_file
+
+    def test_prune(self, tmp_path, monkeypatch, capfd):
+        sources = [{"command": "true", "name": "db.sql", "prune_arguments": ["--keep-daily 7"]}, {"command": "true", "name": "dump", "prefix": "db"}]
+        env, config, config_file = self.load_config(tmp_path, monkeypatch, sources)
+        assert run_borg_command("prune", env, config, config_file, []) == 0
+        # every source on its own, the archives of the backup directories without the ones of the sources
+        assert self.get_calls(tmp_path) == ["--verbose prune --list --glob-archives=host_* --keep-last 10 0",
+                                            "--verbose prune --list --glob-archives=host-db_* --keep-daily 7 0",
+                                            "--verbose prune --list --glob-archives=db_* --keep-last 10 0"]
+
+    def test_skipped(self, tmp_path, monkeypatch, capfd):
+        env, config, config_file = self.load_config(tmp_path, monkeypatch, [{"command": "true", "name": "db.sql"}])
+        # manual create with arguments
+        assert run_borg_command("create", env, config, config_file, ["::manual", "/etc"]) == 0
+        assert len(self.get_calls(tmp_path)) == 1
+        # the create of the backup directories failed
+        assert run_borg_command("create", dict(env, EXIT_CODE="2"), config, config_file, []) == 2
+        assert len(self.get_calls(tmp_path)) == 2
+        assert run_borg_command("prune", dict(env, EXIT_CODE="2"), config, config_file, []) == 2
+        assert len(self.get_calls(tmp_path)) == 3
+
+    def test_invalid_config(self, tmp_path, monkeypatch):
+        with pytest.raises(BorgCtlError):
+            self.load_config(tmp_path, monkeypatch, [{"command": "true", "name": "db.sql", "prefix": "host_db"}])
+        with pytest.raises(BorgCtlError):
+            self.load_config(tmp_path, monkeypatch, [{"command": "true", "name": "db.sql", "prune_arguments": "--keep-last 1"}])
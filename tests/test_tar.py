@@ -0,0 +1,85 @@
+import errno
+import gzip
+import hashlib
+import os
+
+import pytest
+
+from borgctl import tar
+from borgctl.utils import BorgCtlError
+
+
+class TestTarStream:
+
+    def test_from_arguments(self):
+        assert tar.TarStream.from_arguments("export-tar", ["::archive", "out.tar"], {}) == (None, ["::archive", "out.tar"])
+        stream, args = tar.TarStream.from_arguments("export-tar", ["--stream", "--compressor=zstd -T0 -19", "--exclude=*.log", "::archive", "out.tar.zst", "home"], {})
+        assert args == ["::archive", "-", "home", "--exclude=*.log"]
+        assert stream.compressor == ["zstd", "-T0", "-19"]
+        assert stream.file == "out.tar.zst"
+        stream, args = tar.TarStream.from_arguments("import-tar", ["--stream", "--no-checksum", "in.tar"], {"tar_compressor": "lz4"})
+        assert args == ["-"]
+        assert stream.compressor == ["lz4"]
+        assert not stream.checksum
+        with pytest.raises(BorgCtlError) as e:
+            # the file is missing
+            tar.TarStream.from_arguments("import-tar", ["--stream"], {})
+        assert e.value.code == 2
+
+    def test_get_compressor(self, monkeypatch):
+        assert tar.get_compressor("out.tar", None) == []
+        monkeypatch.setattr(tar.shutil, "which", lambda binary: binary if binary == "gzip" else None)
+        # pigz is not installed
+        assert tar.get_compressor("out.tar.gz", None) == ["gzip"]
+        with pytest.raises(BorgCtlError):
+            tar.get_compressor("out.tar.zst", None)
+
+    def test_export_and_import(self, tmp_path, capfd):
+        tar_file = tmp_path / "out.tar.gz"
+        stream = tar.TarStream("export-tar", tar_file.as_posix(), ["gzip"], True, 0)
+        assert stream.run(["sh", "-c", "printf 'tar data'"], {}, {}) == 0
+        assert gzip.decompress(tar_file.read_bytes()) == b"tar data"
+        checksum = hashlib.sha256(tar_file.read_bytes()).hexdigest()
+        assert (tmp_path / "out.tar.gz.sha256").read_text() == f"{checksum}  out.tar.gz\n"
+
+        stream = tar.TarStream("import-tar", tar_file.as_posix(), ["gzip"], True, 0)
+        assert stream.run(["sh", "-c", f"cat > {tmp_path / 'imported'}"], {}, {}) == 0
+        assert (tmp_path / "imported").read_bytes() == b"tar data"
+
+        # the file does not match the checksum: borg is not started
+        tar_file.write_bytes(gzip.compress(b"other data"))
+        assert stream.run(["sh", "-c", f"cat > {tmp_path / 'not-imported'}"], {}, {}) == 2
+        assert not (tmp_path / "not-imported").exists()
+
+    def test_failed_export(self, tmp_path, capfd):
+        tar_file = tmp_path / "out.tar"
+        stream = tar.TarStream("export-tar", tar_file.as_posix(), [], True, 0)
+        assert stream.run(["sh", "-c", "printf partial; exit 2"], {}, {}) == 2
+        # the incomplete file is deleted
+        assert not tar_file.exists()
+        assert not (tmp_path / "out.tar.sha256").exists()
+
+    def test_unwritable_destination(self, tmp_path, monkeypatch, capfd):
+        tar_file = tmp_path / "out.tar"
+
+        def copy_stream(source, dest, *args):
+            os.write(dest, b"part")
+            raise OSError(errno.ENOSPC, "No space left on device")
+        monkeypatch.setattr(tar, "copy_stream", copy_stream)
+        stream = tar.TarStream("export-tar", tar_file.as_posix(), [], True, 0)
+        # borg is killed (exit code -9)
+        assert stream.run(["sh", "-c", "sleep 10"], {}, {}) == 2
+        assert not tar_file.exists()
+        assert not (tmp_path / "out.tar.sha256").exists()
+
+    def test_unreadable_file(self, tmp_path, capfd):
+        stream = tar.TarStream("import-tar", tmp_path.as_posix(), [], False, 0)
+        assert stream.run(["sh", "-c", "sleep 10"], {}, {}) == 2
+
+    def test_logging(self, tmp_path, caplog, capfd):
+        caplog.set_level("INFO")
+        stream = tar.TarStream("export-tar", (tmp_path / "out.tar").as_posix(), [], False, 0)
+        assert stream.run(["sh", "-c", "printf data"], {"BORG_REPO": "/repo", "BORG_PASSPHRASE": "secret"}, {}) == 0
+        # the environment, like execute_borg, but not the passphrase
+        assert 'Executing: BORG_REPO="/repo" sh -c printf data' in caplog.text
+        assert "secret" not in caplog.text
@@ -0,0 +1,81 @@
+import gzip
+import io
+import os
+import time
+
+import pytest
+
+from borgctl import transcript
+
+
+class TestTranscript:
+
+    def test_tee_output(self, tmp_path):
+        data = b"A /home/user/file\n" * 1000
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, data)
+        os.close(write_fd)
+        with open(tmp_path / "console", "w") as console, gzip.open(tmp_path / "transcript.gz", "wb") as f:
+            transcript.tee_output(read_fd, console, f)
+        os.close(read_fd)
+        assert (tmp_path / "console").read_bytes() == data
+        assert gzip.decompress((tmp_path / "transcript.gz").read_bytes()) == data
+
+    def test_open_transcript(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(transcript, "get_log_directory", lambda: tmp_path)
+        with transcript.open_transcript(tmp_path / "default.yml", "create") as f:
+            f.write(b"output")
+        transcript_dir = tmp_path / "transcripts" / "default"
+        assert transcript_dir.stat().st_mode & 0o777 == 0o700
+        transcript_file = next(transcript_dir.glob("create_*.log.gz"))
+        assert gzip.decompress(transcript_file.read_bytes()) == b"output"
+
+    def test_cleanup(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(transcript, "get_log_directory", lambda: tmp_path)
+        transcript_dir = transcript.get_transcript_directory(tmp_path / "default.yml")
+        now = time.time()
+        for name, age, size in (("old", 40 * 86400, 10), ("a", 300, 600 * 1024), ("b", 200, 600 * 1024), ("c", 100, 3 * 1024**2)):
+            transcript_file = transcript_dir / f"{name}.log.gz"
+            transcript_file.write_bytes(b"x" * size)
+            os.utime(transcript_file, (now - age, now - age))
+
+        transcript.cleanup_transcripts({"transcript_max_size": 4}, tmp_path / "default.yml")
+        assert sorted(f.name for f in transcript_dir.iterdir()) == ["b.log.gz", "c.log.gz"]
+        # the newest one is kept, even if it's too large
+        transcript.cleanup_transcripts({"transcript_max_size": 1}, tmp_path / "default.yml")
+        assert [f.name for f in transcript_dir.iterdir()] == ["c.log.gz"]
+
+    def test_prefixed_output(self, tmp_path, capfd):
+        from borgctl import execute_borg
+        f = io.BytesIO()
+        assert execute_borg(["sh", "-c", "echo hello; exit 1"], {"PATH": os.environ["PATH"]}, "[default] ", transcript=f) == 1
+        assert capfd.readouterr().out == "[default] hello\n"
+        assert f.getvalue().endswith(b"sh -c echo hello; exit 1\nhello\n")
+        # without a transcript, too
+        assert execute_borg(["sh", "-c", "printf 'a\\nb'"], {"PATH": os.environ["PATH"]}, "[default] ") == 0
+        assert capfd.readouterr().out == "[default] a\n[default] b\n"
+
+    def test_tee_output_prefix(self, tmp_path):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b"first\nsec")
+        with open(tmp_path / "console", "w") as console:
+            # the incomplete line waits for the next read
+            os.write(write_fd, b"ond\r3%\r")
+            os.close(write_fd)
+            transcript.tee_output(read_fd, console, None, "[default] ")
+        os.close(read_fd)
+        assert (tmp_path / "console").read_bytes() == b"[default] first\n[default] second\r[default] 3%\r"
+
+    def test_closed_on_error(self, tmp_path, monkeypatch):
+        import borgctl
+        monkeypatch.setattr(transcript, "get_log_directory", lambda: tmp_path)
+        config = {"borg_binary": "borg", "passphrase": "", "transcripts": True, "history": False}
+
+        def execute_borg(*args, **kwargs):
+            raise KeyboardInterrupt()
+        monkeypatch.setattr(borgctl, "execute_borg", execute_borg)
+        with pytest.raises(KeyboardInterrupt):
+            borgctl.run_borg_command("info", {}, config, tmp_path / "default.yml", [])
+        transcript_file = next((tmp_path / "transcripts" / "default").glob("info_*.log.gz"))
+        # complete, gzip can read it
+        assert gzip.decompress(transcript_file.read_bytes()).endswith(b"borg exited with exit code 2\n")